@@ -28,7 +28,8 @@ from run_tests import run_tests, run_tests_creating_log, generate_expected_outpu
 from upload_results import upload_results_http
 from helper import run_helper
 from command_line_arguments import REPO_INFORMATION
-from sandbox import run_tests_in_sandbox, continue_inside_sandbox
+from sandbox import run_tests_in_sandbox, continue_inside_sandbox, serve_sandboxes
+from batch import run_batch
 
 
 def main():
@@ -64,6 +65,10 @@ def main():
 def run_autotest():
     args, tests, parameters = process_arguments()
 
+    if args.sandbox_server:
+        # we have been invoked inside a sandbox to fork sandboxes for batch mode
+        return serve_sandboxes(args.sandbox_server)
+
     if args.print_test_names:
         test_groups = OrderedDict()
         for test in tests.values():
@@ -79,6 +84,9 @@ def run_autotest():
         )
         return 0
 
+    if args.batch or args.serve:
+        return run_batch(tests, args, parameters)
+
     inside_sandbox = args.inside_sandbox
     starting_sandbox = not inside_sandbox and parameters.get("sandbox", "")
 
@@ -0,0 +1,254 @@
+# test many submissions with a single autotest invocation
+#
+# the test specification is parsed once,
+# then each submission is tested in a process forked from this one
+# and a line of JSON describing the result is printed for each submission
+#
+# remote tarfiles & git repositories are fetched by threads in this process
+# while earlier submissions are tested
+
+import collections, concurrent.futures, copy, json, multiprocessing, os, re, shutil
+import sys, tempfile, threading, traceback
+from util import AutotestException
+from copy_files_to_temp_directory import (
+    copy_files_to_temp_directory,
+    cleanup,
+    download,
+    git_clone,
+)
+from run_tests import run_tests
+from sandbox import (
+    run_tests_in_sandbox,
+    run_tests_in_sandbox_server,
+    start_sandbox_server,
+    stop_sandbox_server,
+)
+
+# state shared with worker processes via fork
+batch_state = {}
+
+
+def run_batch(tests, args, parameters):
+    """
+    test each submission listed in args.batch, or on stdin if args.serve is set
+    return the highest exit status of any submission
+    """
+    batch_state.update(
+        tests=tests,
+        args=args,
+        parameters=parameters,
+        argv0_realpath=os.path.realpath(sys.argv[0]),
+        initial_directory=os.getcwd(),
+    )
+    if args.serve:
+        manifest = sys.stdin
+    else:
+        try:
+            manifest = open(args.batch, encoding="utf-8")
+        except OSError as e:
+            raise AutotestException(f"can not open {args.batch}: {e}") from e
+
+    # canonical expected output is the same for every submission
+    # so compute it once before forking, postprocess_output_command
+    # may need the submission's files so it must be run by workers
+    for test in tests.values():
+        if not test.parameters.get("postprocess_output_command", None):
+            test.canonicalize_expected_output()
+
+    sandbox_server = None
+    if parameters.get("sandbox", "") and parameters.get("sandbox_pool", False):
+        # mounts shared by all sandboxes are created once by a server
+        # which forks a sandbox for each submission
+        sandbox_server = start_sandbox_server(
+            batch_state["argv0_realpath"], args, parameters
+        )
+        batch_state["sandbox_server_directory"] = sandbox_server[1]
+
+    exit_status = 0
+    context = multiprocessing.get_context("fork")
+    prefetch_directory = tempfile.mkdtemp()
+    # limits submissions fetched but not yet tested
+    fetch_slots = threading.Semaphore(args.jobs + args.prefetch)
+    # a new worker for each submission, so caches and global state are not shared between submissions
+    try:
+        with manifest, context.Pool(args.jobs, maxtasksperchild=1) as pool:
+            submissions = parse_manifest(manifest)
+            if args.prefetch:
+                submissions = prefetch_submissions(
+                    submissions, prefetch_directory, args.prefetch, fetch_slots
+                )
+            try:
+                for result in pool.imap_unordered(test_submission, submissions):
+                    print(json.dumps(result), flush=True)
+                    exit_status = max(exit_status, result["exit_status"])
+                    fetch_slots.release()
+            finally:
+                # so prefetching can not block the pool's shutdown
+                fetch_slots.release(args.jobs + args.prefetch)
+    finally:
+        if sandbox_server:
+            stop_sandbox_server(*sandbox_server)
+        shutil.rmtree(prefetch_directory, ignore_errors=True)
+    return exit_status
+
+
+def parse_manifest(manifest):
+    """
+    yield a dict describing each submission in manifest
+
+    each line is either a JSON object with some of the fields
+    id, tarfile, directory, git, commit
+    or the pathname of a tarfile or directory
+    """
+    for line in manifest:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            try:
+                submission = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield {"id": line, "error": f"invalid manifest line: {e}"}
+                continue
+        elif os.path.isdir(line):
+            submission = {"directory": line}
+        else:
+            submission = {"tarfile": line}
+        submission.setdefault(
+            "id",
+            submission.get("tarfile")
+            or submission.get("directory")
+            or submission.get("git"),
+        )
+        yield submission
+
+
+def prefetch_submissions(submissions, prefetch_directory, n_threads, fetch_slots):
+    """
+    yield submissions in order, after remote tarfiles & git repositories
+    have been fetched to prefetch_directory by up to n_threads threads
+
+    a slot is acquired from fetch_slots before each submission is fetched
+    """
+    with concurrent.futures.ThreadPoolExecutor(n_threads) as executor:
+        pending = collections.deque()
+        for submission in submissions:
+            fetch_slots.acquire()
+            pending.append(
+                executor.submit(prefetch_submission, submission, prefetch_directory)
+            )
+            while pending and (pending[0].done() or len(pending) >= n_threads):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def prefetch_submission(submission, prefetch_directory):
+    """
+    fetch a remote tarfile or git repository for submission to prefetch_directory
+    return the submission modified to use the local copy,
+    or unchanged if nothing needs to be fetched or fetching fails,
+    so any error is reported when the submission is tested
+    """
+    tarfile = submission.get("tarfile") or ""
+    git = submission.get("git") or ""
+    try:
+        if re.search(r"^https?://", tarfile):
+            fd, pathname = tempfile.mkstemp(dir=prefetch_directory)
+            with os.fdopen(fd, "wb") as f:
+                download(tarfile, f)
+            return dict(submission, tarfile=pathname, prefetched=pathname)
+        if git and not os.path.isdir(git):
+            pathname = tempfile.mkdtemp(dir=prefetch_directory)
+            git_clone(git, pathname, commit=submission.get("commit"))
+            # cloning the local repository checks out the same commit
+            return dict(submission, git=pathname, commit=None, prefetched=pathname)
+    except (OSError, AutotestException):
+        pass
+    return submission
+
+
+def remove_prefetched(submission):
+    pathname = submission.get("prefetched")
+    if not pathname:
+        return
+    if os.path.isdir(pathname):
+        shutil.rmtree(pathname, ignore_errors=True)
+    elif os.path.exists(pathname):
+        os.unlink(pathname)
+
+
+def test_submission(submission):
+    """
+    run the tests for a single submission in a worker process
+
+    stdout & stderr, including the output of any subprocesses,
+    are captured and returned as part of the result
+    """
+    tests = batch_state["tests"]
+    args = copy.copy(batch_state["args"])
+    parameters = batch_state["parameters"]
+    args.tarfile = submission.get("tarfile")
+    args.directory = submission.get("directory")
+    args.git = submission.get("git")
+    args.commit = submission.get("commit")
+    # identifies the submission's events in the results stream
+    args.submission = submission["id"]
+    # worker processes can not create their own pool of processes
+    args.jobs = 1
+    os.chdir(batch_state["initial_directory"])
+
+    temp_dir = None
+    with tempfile.TemporaryFile() as output:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved_fds = [os.dup(1), os.dup(2)]
+        os.dup2(output.fileno(), 1)
+        os.dup2(output.fileno(), 2)
+        try:
+            if "error" in submission:
+                raise AutotestException(submission["error"])
+            temp_dir = copy_files_to_temp_directory(args, parameters)
+            if batch_state.get("sandbox_server_directory"):
+                exit_status = run_tests_in_sandbox_server(
+                    batch_state["sandbox_server_directory"], tests, args, parameters
+                )
+            elif parameters.get("sandbox", ""):
+                exit_status = run_tests_in_sandbox(
+                    batch_state["argv0_realpath"], tests, args, parameters
+                )
+            else:
+                exit_status = run_tests(tests, parameters, args)
+        except AutotestException as e:
+            print(f"autotest: {e}", file=sys.stderr)
+            exit_status = 2
+        except SystemExit as e:
+            exit_status = e.code if isinstance(e.code, int) else 2
+        except Exception:
+            etype, evalue, _etraceback = sys.exc_info()
+            eformatted = "\n".join(traceback.format_exception_only(etype, evalue))
+            print(f"autotest: internal error: {eformatted}", file=sys.stderr)
+            if args.debug:
+                traceback.print_exc(file=sys.stderr)
+            exit_status = 2
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, saved_fd in enumerate(saved_fds, start=1):
+            os.dup2(saved_fd, fd)
+            os.close(saved_fd)
+        os.chdir(batch_state["initial_directory"])
+        if temp_dir:
+            cleanup(temp_dir=temp_dir, args=args)
+        remove_prefetched(submission)
+        output.seek(0)
+        output_text = output.read().decode("utf-8", errors="replace")
+
+    return {
+        "submission": submission["id"],
+        "exit_status": exit_status,
+        # results of individual tests are not available if tests were run in a sandbox
+        "tests": {
+            label: tests[label].test_passed for label in args.labels if label in tests
+        },
+        "output": output_text,
+    }
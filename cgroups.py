@@ -0,0 +1,127 @@
+# cgroup v2 support for subprocess_with_resource_limits
+#
+# each execution is placed in its own transient cgroup,
+# which limits the memory, processes & CPU of the whole process tree,
+# accurately measures the resources it used
+# and allows all its processes to be reliably killed
+#
+# limits are only applied if the corresponding controller is enabled
+# in cgroup.subtree_control of the parent directory, setrlimit limits still apply
+
+import itertools, os, time
+
+# used to create a unique name for each cgroup
+_cgroup_numbers = itertools.count()
+
+# seconds to wait for processes in a cgroup to exit after it is killed
+REMOVE_TIMEOUT_SECONDS = 1
+
+# period used for the cpu.max bandwidth limit
+CPU_PERIOD_MICROSECONDS = 100000
+
+
+class Cgroup:
+    def __init__(self, parent_directory, max_memory_bytes=0, max_pids=0, max_cpus=0):
+        """
+        create a new cgroup below parent_directory, limits of 0 are not set
+        raises OSError if the cgroup can not be created or processes added to it
+        """
+        self.directory = os.path.join(
+            parent_directory, f"autotest-{os.getpid()}-{next(_cgroup_numbers)}"
+        )
+        os.mkdir(self.directory)
+        try:
+            # cgroup.procs is only present if parent_directory is in a cgroup file system
+            if not os.access(os.path.join(self.directory, "cgroup.procs"), os.W_OK):
+                raise OSError(f"can not add processes to cgroup {self.directory}")
+            if max_memory_bytes:
+                self.write_if_present("memory.max", str(int(max_memory_bytes)))
+                # otherwise memory limit may be evaded by swapping
+                self.write_if_present("memory.swap.max", "0")
+            if max_pids:
+                self.write_if_present("pids.max", str(int(max_pids)))
+            if max_cpus:
+                quota = int(max_cpus * CPU_PERIOD_MICROSECONDS)
+                self.write_if_present("cpu.max", f"{quota} {CPU_PERIOD_MICROSECONDS}")
+        except OSError:
+            self.remove()
+            raise
+
+    def write_if_present(self, filename, value):
+        pathname = os.path.join(self.directory, filename)
+        if os.path.exists(pathname):
+            with open(pathname, "w", encoding="ascii") as f:
+                f.write(value)
+
+    def read_keyed_file(self, filename):
+        """
+        return contents of a file of 'key value' lines as a dict, empty if file absent
+        """
+        try:
+            with open(os.path.join(self.directory, filename), encoding="ascii") as f:
+                return dict(line.split() for line in f if line.strip())
+        except (OSError, ValueError):
+            return {}
+
+    def add_current_process(self):
+        """
+        move this process into the cgroup, intended to be called before exec
+        so the program & all its descendants are in the cgroup
+        raises OSError if this is not permitted
+        """
+        with open(os.path.join(self.directory, "cgroup.procs"), "w") as f:
+            f.write("0")
+
+    def resource_usage(self):
+        """
+        return a dict of resources used by processes in the cgroup,
+        with the same keys as subprocess_with_resource_limits.child_resource_usage
+        """
+        usage = {}
+        cpu_stat = self.read_keyed_file("cpu.stat")
+        if int(cpu_stat.get("usage_usec", 0)) == 0:
+            # the process could not be added to the cgroup
+            return usage
+        if "user_usec" in cpu_stat and "system_usec" in cpu_stat:
+            usage["user_cpu_seconds"] = int(cpu_stat["user_usec"]) / 1e6
+            usage["system_cpu_seconds"] = int(cpu_stat["system_usec"]) / 1e6
+        try:
+            pathname = os.path.join(self.directory, "memory.peak")
+            with open(pathname, encoding="ascii") as f:
+                usage["max_rss_bytes"] = int(f.read())
+        except (OSError, ValueError):
+            pass
+        return usage
+
+    def memory_limit_exceeded(self):
+        return int(self.read_keyed_file("memory.events").get("oom_kill", 0)) > 0
+
+    def process_limit_exceeded(self):
+        return int(self.read_keyed_file("pids.events").get("max", 0)) > 0
+
+    def kill(self):
+        """
+        kill all processes in the cgroup
+        """
+        try:
+            self.write_if_present("cgroup.kill", "1")
+        except OSError:
+            pass
+
+    def remove(self):
+        """
+        kill any remaining processes and remove the cgroup
+        """
+        self.kill()
+        deadline = time.time() + REMOVE_TIMEOUT_SECONDS
+        while True:
+            try:
+                os.rmdir(self.directory)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                # processes may not yet have exited
+                if time.time() > deadline:
+                    return
+                time.sleep(0.01)
@@ -1,10 +1,12 @@
 # process command-line arguments
 
 import argparse, fnmatch, os, re, sys
-from parse_test_specification import parse_file, parse_string
+from parse_test_specification import parse_string
+from test_specification_cache import parse_file_cached
 from util import die
 from run_test import _Test
 from copy_files_to_temp_directory import load_embedded_autotest
+from test_statistics import ORDERS
 
 # rewrite the extra help
 
@@ -26,11 +28,11 @@ autotest lab08 -l lectures_3 lectures_4        # run specified tests
 def process_arguments():
     args = parse_arguments()
 
-    if args.inside_sandbox:
+    if args.inside_sandbox or args.sandbox_server:
         return args, {}, {}
 
     test_specification_pathname = find_test_specification(args)
-    tests_as_dicts, parameters = parse_file(
+    tests_as_dicts, parameters = parse_file_cached(
         test_specification_pathname,
         initial_parameters=args.initial_parameters,
         initial_tests=args.initial_tests,
@@ -82,6 +84,13 @@ def parse_arguments():
     parser.add_argument(
         "-l", "--labels", nargs="+", default=[], help="execute tests with these LABELS"
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="run up to JOBS tests in parallel",
+    )
     parser.add_argument(
         "-m", "--marking", action="store_true", help="run automarking tests"
     )
@@ -89,6 +98,32 @@ def parse_arguments():
     parser.add_argument(
         "--print_test_names", action="store_true", help="print names of tests and files"
     )
+    parser.add_argument(
+        "--summary_only",
+        action="store_true",
+        help="print only whether each test passed or failed, not explanations of failures",
+    )
+    parser.add_argument(
+        "--fail_fast",
+        action="store_true",
+        help="stop after the first test which fails",
+    )
+    parser.add_argument(
+        "--order",
+        choices=ORDERS,
+        default="spec",
+        help="order in which tests are run, orders other than spec use statistics of previous runs",
+    )
+    parser.add_argument(
+        "--changed_only",
+        action="store_true",
+        help="run only tests whose results are not in the result cache, because files they use have changed, cached failures are still reported",
+    )
+    parser.add_argument(
+        "--json_results",
+        metavar="DESTINATION",
+        help="write a line of JSON for each test result as tests complete to DESTINATION, a file or fd:N, with --batch each line includes the submission id",
+    )
     parser.add_argument(
         "-p", "--programs", nargs="+", default=[], help="execute tests for PROGRAMS"
     )
@@ -102,6 +137,11 @@ def parse_arguments():
         action="store_true",
         help="re-invoke autotest inside a sandbox",
     )
+    parser.add_argument(
+        "--sandbox_server",
+        metavar="DIRECTORY",
+        help=argparse.SUPPRESS,
+    )
 
     parser.add_argument("extra_arguments", nargs="*", default=[], help="")
 
@@ -125,6 +165,24 @@ def parse_arguments():
         "--tarfile",
         help="add files from this tarfile to the test directory, can be http URL",
     )
+    source_args.add_argument(
+        "--batch",
+        metavar="MANIFEST",
+        help="test each submission listed in MANIFEST, printing a JSON result for each",
+    )
+    source_args.add_argument(
+        "--serve",
+        action="store_true",
+        help="test each submission listed on standard input, printing a JSON result for each",
+    )
+
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=4,
+        metavar="N",
+        help="with --batch or --serve, fetch up to N remote submissions while others are tested",
+    )
 
     # these CSE specific parameters should be move parameters which can be specified in a shell wrapper
     source_args.add_argument(
@@ -141,11 +199,21 @@ def parse_arguments():
 
     args = parser.parse_args()
 
-    if args.inside_sandbox:
+    if args.inside_sandbox or args.sandbox_server:
         return args
 
     check_obsolete_arguments(args)
 
+    if args.jobs < 1:
+        die("--jobs must be at least 1")
+
+    if args.prefetch < 0:
+        die("--prefetch must not be negative")
+
+    # tests are run in a temporary directory
+    if args.json_results and not re.fullmatch(r"fd:\d+", args.json_results):
+        args.json_results = os.path.abspath(args.json_results)
+
     args.debug = int(args.debug or os.environ.get("AUTOTEST_DEBUG", 0) or 0)
     args.initial_tests, args.initial_parameters = parse_string(
         "\n".join(args.parameters or ""),
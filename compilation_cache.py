@@ -0,0 +1,150 @@
+# cache of compiled binaries shared between autotest invocations
+#
+# binaries are stored in a directory named by a hash of
+# the compile command, the identity of the compiler and the contents of the files compiled
+#
+# several autotest processes may use the cache at the same time
+# entries are created in a temporary directory then renamed into place
+# and entries which disappear while being used are treated as cache misses
+
+import fcntl, glob, hashlib, os, shutil, sys, tempfile
+
+CACHE_FORMAT_VERSION = "1"
+PROGRAM_NAME = "program"
+OUTPUT_NAME = "output"
+LOCK_NAME = "lock"
+
+
+def compilation_cache_key(compile_command, arguments, test_files, print_command):
+    """
+    return a hash of everything which determines the result of a compilation
+    """
+    h = hashlib.sha256()
+    h.update(CACHE_FORMAT_VERSION.encode())
+    h.update(repr((compile_command, arguments, bool(print_command))).encode())
+    h.update(compiler_identity(compile_command).encode())
+    # local header files may be included by the files compiled
+    header_files = [f for f in glob.glob("*.h") if f not in test_files]
+    for pathname in sorted(test_files) + sorted(header_files):
+        h.update(pathname.encode() + b"\0")
+        try:
+            with open(pathname, "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        except OSError:
+            h.update(b"\0")
+    return h.hexdigest()
+
+
+def compiler_identity(compile_command):
+    """
+    return a string identifying the installed compiler used by compile_command
+    so the cache is not used after the compiler is upgraded
+    """
+    words = compile_command
+    if isinstance(compile_command, str):
+        words = compile_command.split()
+    if not words:
+        return ""
+    pathname = shutil.which(words[0])
+    if not pathname:
+        return ""
+    try:
+        pathname = os.path.realpath(pathname)
+        s = os.stat(pathname)
+        return f"{pathname}:{s.st_size}:{s.st_mtime_ns}"
+    except OSError:
+        return ""
+
+
+def fetch_compiled_program(cache_directory, key, program_pathname, debug=0):
+    """
+    link the cached binary for key to program_pathname
+    return the output of the original compilation, or None if key is not in the cache
+    """
+    entry = os.path.join(cache_directory, key)
+    try:
+        with open(os.path.join(entry, OUTPUT_NAME), encoding="utf-8") as f:
+            output = f.read()
+        link_or_copy(os.path.join(entry, PROGRAM_NAME), program_pathname)
+        # record use for least-recently-used eviction
+        os.utime(entry)
+    except OSError as e:
+        if debug > 1:
+            print(f"compilation cache miss for {key}: {e}", file=sys.stderr)
+        if os.path.exists(program_pathname):
+            os.unlink(program_pathname)
+        return None
+    if debug > 1:
+        print(f"compilation cache hit for {key}", file=sys.stderr)
+    return output
+
+
+def store_compiled_program(
+    cache_directory, key, program_pathname, output, max_bytes, debug=0
+):
+    """
+    add a binary and the output of its compilation to the cache
+    failures are ignored, the cache is only an optimization
+    """
+    try:
+        os.makedirs(cache_directory, 0o700, exist_ok=True)
+        temp_entry = tempfile.mkdtemp(prefix=".tmp-", dir=cache_directory)
+    except OSError as e:
+        if debug:
+            print(f"compilation cache not available: {e}", file=sys.stderr)
+        return
+    try:
+        link_or_copy(program_pathname, os.path.join(temp_entry, PROGRAM_NAME))
+        with open(os.path.join(temp_entry, OUTPUT_NAME), "w", encoding="utf-8") as f:
+            f.write(output)
+        # rename is atomic, if another process has added this entry it fails
+        os.rename(temp_entry, os.path.join(cache_directory, key))
+    except OSError as e:
+        if debug > 1:
+            print(f"compilation cache store failed for {key}: {e}", file=sys.stderr)
+        shutil.rmtree(temp_entry, ignore_errors=True)
+        return
+    evict_compiled_programs(cache_directory, max_bytes, debug=debug)
+
+
+def evict_compiled_programs(cache_directory, max_bytes, debug=0):
+    """
+    remove least recently used entries until the cache is smaller than max_bytes
+    """
+    try:
+        with open(os.path.join(cache_directory, LOCK_NAME), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = []
+            total_bytes = 0
+            for name in os.listdir(cache_directory):
+                entry = os.path.join(cache_directory, name)
+                if name == LOCK_NAME or name.startswith(".tmp-"):
+                    continue
+                n_bytes = sum(
+                    os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry)
+                )
+                entries.append((os.path.getmtime(entry), n_bytes, entry))
+                total_bytes += n_bytes
+            for _mtime, n_bytes, entry in sorted(entries):
+                if total_bytes <= max_bytes:
+                    break
+                if debug > 1:
+                    print(f"compilation cache evicting {entry}", file=sys.stderr)
+                shutil.rmtree(entry, ignore_errors=True)
+                total_bytes -= n_bytes
+    except OSError as e:
+        if debug:
+            print(f"compilation cache eviction failed: {e}", file=sys.stderr)
+
+
+def link_or_copy(source, destination):
+    """
+    hard link source to destination, copying if a link is not possible
+    e.g. because they are on different file systems
+    """
+    try:
+        os.link(source, destination)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copy2(source, destination)
@@ -1,11 +1,27 @@
 # create a temporary directory and copy the files needed for testing to it
 
-import atexit, glob, io, os, pkgutil, re, shutil, subprocess, sys, tarfile, tempfile
+import atexit, fcntl, glob, hashlib, io, os, pkgutil, re, shutil, subprocess, sys
+import tarfile, tempfile, urllib.request, zipfile
 from shutil import copy2, copystat
 from util import die
+from dependencies import file_dependencies
+from test_specification_cache import is_cache_file
 
 INITIAL_DIR_NAME = "autotest"
 
+# ioctl from <linux/fs.h> creating a copy-on-write clone of a file
+FICLONE = 0x40049409
+
+# limits on the contents of a submission tar or zip file
+MAX_ARCHIVE_BYTES = 256 * 1024 * 1024
+MAX_ARCHIVE_MEMBERS = 10000
+
+# suffix of the file holding the hash of a cached copy of a supplied file
+DIGEST_SUFFIX = ".sha256"
+
+# seconds to wait for a response when downloading a submission
+DOWNLOAD_TIMEOUT_SECONDS = 60
+
 
 def copy_files_to_temp_directory(args, parameters):
     temp_dir = tempfile.mkdtemp()
@@ -15,39 +31,49 @@ def copy_files_to_temp_directory(args, parameters):
     os.mkdir(initial_dir, 0o700)
 
     if parameters["supplied_files_directory"]:
-        copy_directory(parameters["supplied_files_directory"], initial_dir)
+        cache_directory = parameters["supplied_files_cache_directory"]
+        copy_directory(
+            parameters["supplied_files_directory"],
+            initial_dir,
+            ignore=lambda _src, names: set(filter(is_cache_file, names)),
+            copy_function=lambda src, dst: stage_file(
+                src, dst, cache_directory=cache_directory, debug=args.debug
+            ),
+        )
 
     fetch_submission(initial_dir, args)
 
     os.chdir(initial_dir)
 
     for expected_file in glob.glob("*.expected_*"):
-        os.chmod(expected_file, 0o400)
+        # files hard linked by stage_file are already read-only
+        # and their permissions must not be changed
+        if os.stat(expected_file).st_mode & 0o222:
+            os.chmod(expected_file, 0o400)
+
+    return temp_dir
 
 
 def fetch_submission(temp_dir, args):
     if args.debug:
         print(f"fetch_submission({temp_dir})", file=sys.stderr)
     if args.tarfile:
-        # FIXME handle xz compression
-        if re.search(r"^https?://.*\.tar(.[a-z]+)?", args.tarfile):
-            os.chdir(temp_dir)
-            execute(["wget", "-O", "submission.tar", args.tarfile])
-            execute(["tar", "-x", "-f", "submission.tar"])
-        else:
-            execute(
-                ["tar", "-x", "-C", temp_dir, "-f", args.tarfile],
-                print_command=args.debug,
-            )
+        try:
+            if re.search(r"^https?://", args.tarfile):
+                with tempfile.TemporaryFile() as f:
+                    download(args.tarfile, f)
+                    f.seek(0)
+                    extract_archive(f, temp_dir)
+            else:
+                with open(args.tarfile, "rb") as f:
+                    extract_archive(f, temp_dir)
+        except (OSError, EOFError, tarfile.TarError, zipfile.BadZipFile) as e:
+            die(f"can not extract {args.tarfile}: {e}")
     elif args.directory:
         copy_directory(args.directory, temp_dir)
     elif args.git:
         os.chdir(temp_dir)
-        if args.commit:
-            execute(["git", "clone", "--quiet", args.git, "."])
-            execute(["git", "checkout", "--quiet", args.commit])
-        else:
-            execute(["git", "clone", "--quiet", "--depth", "1", args.git, "."])
+        git_clone(args.git, ".", commit=args.commit, print_command=True)
         if os.path.isdir(args.exercise) and os.listdir(args.exercise):
             print("cd", args.exercise)
             os.chdir(args.exercise)
@@ -93,25 +119,11 @@ def fetch_submission(temp_dir, args):
                     if os.path.exists(os.path.join(temp_dir, file)):
                         continue
                     shutil.copy(file, temp_dir)
-                    if re.search(r"\.[pc].?$", file):
-                        try:
-                            # Kludge to pick up include files
-                            with open(file, encoding="utf-8") as f:
-                                for line in f:
-                                    m = re.search(
-                                        r'\b(require|include)\s*[\'"](.*?)[\'"]',
-                                        line,
-                                        flags=re.I,
-                                    )
-                                    if m:
-                                        files_to_copy.add(m.group(2))
-                                    m = re.search(
-                                        r"^\s*\b(use|require)\s*(\S+)", line, flags=re.I
-                                    )
-                                    if m:
-                                        files_to_copy.add(m.group(2) + ".pm")
-                        except UnicodeDecodeError:
-                            die(f"{file} is not a text file")
+                    try:
+                        # pick up include files & modules
+                        files_to_copy.update(file_dependencies(file, debug=args.debug))
+                    except UnicodeDecodeError:
+                        die(f"{file} is not a text file")
                 except IOError:
                     continue
 
@@ -121,7 +133,7 @@ def fetch_submission(temp_dir, args):
 # exit_status >- 2, internal error - testing not completed
 
 
-def copy_directory(src, dst, symlinks=False, ignore=None):
+def copy_directory(src, dst, symlinks=False, ignore=None, copy_function=copy2):
     names = os.listdir(src)
     if ignore is not None:
         ignored_names = ignore(src, names)
@@ -145,14 +157,241 @@ def copy_directory(src, dst, symlinks=False, ignore=None):
                 linkto = os.readlink(srcname)
                 os.symlink(linkto, dstname)
             elif os.path.isdir(srcname):
-                copy_directory(srcname, dstname, symlinks, ignore)
+                copy_directory(srcname, dstname, symlinks, ignore, copy_function)
             else:
-                copy2(srcname, dstname)
+                if os.path.lexists(dstname) and not os.path.isdir(dstname):
+                    # don't write through a hard link made by stage_file
+                    os.unlink(dstname)
+                copy_function(srcname, dstname)
         except OSError as why:
             # we don't want to stop if there is an unreadable file - just produce an error
             print("Warning:", why, file=sys.stderr)
 
 
+def stage_file(source, destination, cache_directory="", debug=0):
+    """
+    make destination a copy of source, as cheaply as possible
+
+    a copy-on-write clone is made if the file system supports it,
+    otherwise source is hard linked if it can not be changed by the tests,
+    i.e. it is read-only and owned by another user, as the owner can make it writable,
+    otherwise if cache_directory is set a read-only copy of source is kept there
+    and hard linked, so unchanged files are only copied once
+    """
+    if clone_file(source, destination):
+        return
+    s = os.stat(source)
+    if (
+        s.st_uid != os.geteuid()
+        and not os.access(source, os.W_OK)
+        and link_file(source, destination)
+    ):
+        return
+    if cache_directory:
+        cached_copy = get_cached_copy(source, cache_directory, debug=debug)
+        if cached_copy and link_file(cached_copy, destination):
+            return
+    copy2(source, destination)
+
+
+def clone_file(source, destination):
+    """
+    create destination as a copy-on-write clone of source
+    return True iff this succeeds
+    """
+    try:
+        with open(source, "rb") as s, open(destination, "xb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    except OSError:
+        if os.path.exists(destination):
+            os.unlink(destination)
+        return False
+    copystat(source, destination)
+    return True
+
+
+def link_file(source, destination):
+    try:
+        os.link(source, destination)
+        return True
+    except OSError:
+        return False
+
+
+def get_cached_copy(source, cache_directory, debug=0):
+    """
+    return the pathname of a read-only copy of source in cache_directory,
+    creating it if necessary, or None if this is not possible
+
+    the copy has the size & modification time of source,
+    so a copy which is out of date is replaced,
+    the copy is owned by the user running the tests, so tests could make it writable
+    and restore its mode & modification time, so the hash of its contents
+    recorded when it was created is also checked
+    """
+    try:
+        s = os.stat(source)
+        name = hashlib.sha256(os.path.realpath(source).encode()).hexdigest()
+        cached_copy = os.path.join(cache_directory, name)
+        digest_pathname = cached_copy + DIGEST_SUFFIX
+        try:
+            c = os.stat(cached_copy)
+            if (
+                c.st_size == s.st_size
+                and c.st_mtime_ns == s.st_mtime_ns
+                and not c.st_mode & 0o222
+            ):
+                with open(digest_pathname, encoding="ascii") as f:
+                    if f.read() == file_digest(cached_copy):
+                        return cached_copy
+        except FileNotFoundError:
+            pass
+        os.makedirs(cache_directory, 0o700, exist_ok=True)
+        fd, temp_pathname = tempfile.mkstemp(prefix=".tmp-", dir=cache_directory)
+        os.close(fd)
+        try:
+            copy2(source, temp_pathname)
+            os.chmod(temp_pathname, s.st_mode & 0o555)
+            with open(temp_pathname + DIGEST_SUFFIX, "w", encoding="ascii") as f:
+                f.write(file_digest(temp_pathname))
+            # rename is atomic so other processes never see a partial copy,
+            # a copy found without its digest is replaced
+            os.rename(temp_pathname + DIGEST_SUFFIX, digest_pathname)
+            os.rename(temp_pathname, cached_copy)
+        except OSError:
+            for pathname in [temp_pathname, temp_pathname + DIGEST_SUFFIX]:
+                if os.path.exists(pathname):
+                    os.unlink(pathname)
+            raise
+        if debug > 1:
+            print(f"cached copy of {source} created", file=sys.stderr)
+        return cached_copy
+    except OSError as e:
+        if debug:
+            print(f"cached copy of {source} not available: {e}", file=sys.stderr)
+        return None
+
+
+def file_digest(pathname):
+    """
+    return the SHA-256 hash of the contents of pathname in hexadecimal
+    """
+    h = hashlib.sha256()
+    with open(pathname, "rb") as f:
+        for data in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(data)
+    return h.hexdigest()
+
+
+def download(url, f):
+    """
+    write the contents of url to file f
+    """
+    with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT_SECONDS) as response:
+        shutil.copyfileobj(response, f)
+
+
+def extract_archive(f, directory):
+    """
+    extract the tar file, possibly compressed, or zip file f to directory
+
+    only regular files & directories are extracted,
+    raises OSError if a pathname is outside directory or limits are exceeded
+    """
+    # tar files may contain zip files, so zip files are recognized by their first bytes
+    if f.seekable() and f.read(4) in (b"PK\x03\x04", b"PK\x05\x06"):
+        with zipfile.ZipFile(f) as z:
+            members = z.infolist()
+            check_archive_size(len(members), sum(m.file_size for m in members))
+            for member in members:
+                pathname = archive_member_pathname(member.filename, directory)
+                if not pathname:
+                    continue
+                if member.is_dir():
+                    os.makedirs(pathname, 0o755, exist_ok=True)
+                else:
+                    with z.open(member) as source:
+                        mode = member.external_attr >> 16
+                        write_archive_member(source, pathname, mode)
+        return
+    if f.seekable():
+        f.seek(0)
+    # streaming mode reads f sequentially, so members are extracted as they arrive
+    with tarfile.open(fileobj=f, mode="r|*") as t:
+        n_members = n_bytes = 0
+        for member in t:
+            n_members += 1
+            n_bytes += member.size
+            check_archive_size(n_members, n_bytes)
+            pathname = archive_member_pathname(member.name, directory)
+            if not pathname:
+                continue
+            if member.isdir():
+                os.makedirs(pathname, 0o755, exist_ok=True)
+            elif member.isfile():
+                write_archive_member(t.extractfile(member), pathname, member.mode)
+                os.utime(pathname, (member.mtime, member.mtime))
+
+
+def check_archive_size(n_members, n_bytes):
+    if n_members > MAX_ARCHIVE_MEMBERS:
+        raise OSError(f"more than {MAX_ARCHIVE_MEMBERS} files")
+    if n_bytes > MAX_ARCHIVE_BYTES:
+        raise OSError(f"contents larger than {MAX_ARCHIVE_BYTES} bytes")
+
+
+def archive_member_pathname(name, directory):
+    """
+    return the pathname in directory for archive member name,
+    or None if name is the directory itself
+    leading slashes are removed, as tar does, but '..' is not permitted
+    """
+    components = [c for c in name.split("/") if c not in ("", ".")]
+    if ".." in components:
+        raise OSError(f"invalid pathname '{name}'")
+    if not components:
+        return None
+    return os.path.join(directory, *components)
+
+
+def write_archive_member(source, pathname, mode):
+    os.makedirs(os.path.dirname(pathname), 0o755, exist_ok=True)
+    if os.path.lexists(pathname):
+        os.unlink(pathname)
+    with open(pathname, "wb") as f:
+        shutil.copyfileobj(source, f)
+    # zip files may not record permissions
+    os.chmod(pathname, (mode & 0o755 | 0o600) if mode else 0o644)
+
+
+def git_clone(repository, directory, commit=None, print_command=False):
+    """
+    clone repository to directory and checkout commit, if specified,
+    files already in directory are kept unless the checkout replaces them
+
+    from remote repositories, only the file contents needed are fetched:
+    a shallow clone is made if commit is not specified, otherwise a partial clone
+    """
+    command = ["git", "clone", "--quiet", "--no-checkout"]
+    # these options are ignored with a warning for local repositories
+    if not os.path.isdir(repository):
+        if commit:
+            command += ["--filter=blob:none"]
+        else:
+            command += ["--depth", "1"]
+    # git will only clone to an empty directory
+    clone_directory = tempfile.mkdtemp(dir=directory)
+    execute(command + [repository, clone_directory], print_command=print_command)
+    os.rename(os.path.join(clone_directory, ".git"), os.path.join(directory, ".git"))
+    os.rmdir(clone_directory)
+    execute(
+        ["git", "-c", "advice.detachedHead=false", "checkout", "--quiet", "--force"]
+        + [commit or "HEAD"],
+        print_command=print_command,
+        cwd=directory,
+    )
+
+
 def cleanup(temp_dir=None, args=None):
     if args and args.debug >= 10:
         return
@@ -160,10 +399,10 @@ def cleanup(temp_dir=None, args=None):
         shutil.rmtree(temp_dir)
 
 
-def execute(command, print_command=True):
+def execute(command, print_command=True, cwd=None):
     if print_command:
         print(" ".join(command))
-    if subprocess.call(command) != 0:
+    if subprocess.call(command, cwd=cwd) != 0:
         die(f"{command[0]} failed")
 
 
@@ -179,7 +418,5 @@ def load_embedded_autotest(exercise):
         return None
     temp_dir = tempfile.mkdtemp()
     atexit.register(cleanup, temp_dir=temp_dir)
-    buffer = io.BytesIO(tar_data)
-    with tarfile.open(fileobj=buffer, mode="r|xz") as t:
-        t.extractall(temp_dir)
+    extract_archive(io.BytesIO(tar_data), temp_dir)
     return os.path.join(temp_dir, "tests.txt")
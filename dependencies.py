@@ -0,0 +1,179 @@
+# find the local files a source file depends on
+#
+# C & C++ dependencies are found by running the C compiler with -MM,
+# which follows nested includes as the compiler does,
+# Python imports are found by parsing the source
+# and Perl use/require statements with a regex,
+# then modules are resolved to files relative to the source file
+#
+# only files which exist are returned, so system headers & modules are ignored
+
+import ast, os, re, shutil, subprocess, sys
+
+C_SUFFIXES = [".c", ".cc", ".cpp", ".h", ".hpp"]
+PERL_SUFFIXES = [".pl", ".pm"]
+PYTHON_SUFFIXES = [".py"]
+
+# C compilers tried, in order, for finding includes
+C_DEPENDENCY_COMPILERS = ["cc", "gcc", "clang"]
+
+# used if no C compiler is available
+C_INCLUDE_REGEX = re.compile(r'^\s*#\s*include\s*"([^"]+)"', flags=re.M)
+
+PERL_MODULE_REGEX = re.compile(r"^\s*(?:use|require)\s+([A-Za-z_][\w:]*)", flags=re.M)
+PERL_FILE_REGEX = re.compile(r"""\b(?:require|do)\s*\(?\s*['"]([^'"]+)['"]""")
+
+# used if Python source can not be parsed
+PYTHON_IMPORT_REGEX = re.compile(r"^\s*(?:from|import)\s+([\w.]+)", flags=re.M)
+
+
+def find_dependencies(pathnames, debug=0):
+    """
+    return the set of pathnames plus the local files they depend on,
+    directly or indirectly, pathnames which do not exist are omitted
+    raises UnicodeDecodeError if a source file is not UTF-8
+    """
+    found = set()
+    pending = list(pathnames)
+    while pending:
+        pathname = os.path.normpath(pending.pop())
+        if pathname in found or not os.path.isfile(pathname):
+            continue
+        found.add(pathname)
+        pending.extend(file_dependencies(pathname, debug=debug))
+    return found
+
+
+def dependency_graph(test_files, debug=0):
+    """
+    test_files is a dict mapping the label of each test to the files it uses,
+    return a dict mapping these files, and the files they depend on,
+    to the set of labels of the tests which depend on them
+    """
+    graph = {}
+    for label, pathnames in test_files.items():
+        for pathname in find_dependencies(pathnames, debug=debug):
+            graph.setdefault(pathname, set()).add(label)
+    return graph
+
+
+def has_known_dependencies(pathname):
+    """
+    return True if the files pathname depends on can be found from its source
+    """
+    suffix = os.path.splitext(pathname)[1].lower()
+    return suffix in C_SUFFIXES + PERL_SUFFIXES + PYTHON_SUFFIXES
+
+
+def file_dependencies(
+    pathname,
+    debug=0,
+    # pylint: disable=dangerous-default-value
+    cache={},
+):
+    """
+    return the local files pathname depends on,
+    results are cached until pathname's size or modification time changes
+    """
+    if not has_known_dependencies(pathname):
+        return []
+    suffix = os.path.splitext(pathname)[1].lower()
+    s = os.stat(pathname)
+    cache_key = (os.path.realpath(pathname), s.st_size, s.st_mtime_ns)
+    if cache_key not in cache:
+        with open(pathname, encoding="utf-8") as f:
+            source = f.read()
+        if suffix in C_SUFFIXES:
+            dependencies = c_dependencies(pathname, source, debug=debug)
+        elif suffix in PERL_SUFFIXES:
+            dependencies = perl_dependencies(pathname, source)
+        else:
+            dependencies = python_dependencies(pathname, source)
+        directory = os.path.dirname(pathname)
+        cache[cache_key] = [
+            d
+            for d in dependencies
+            if os.path.isfile(os.path.join(directory, d) if directory else d)
+        ]
+        if debug > 1:
+            print(f"dependencies of {pathname}: {cache[cache_key]}", file=sys.stderr)
+    return [
+        os.path.normpath(os.path.join(os.path.dirname(pathname), d))
+        for d in cache[cache_key]
+    ]
+
+
+def c_dependencies(pathname, source, debug=0):
+    """
+    return files included by a C or C++ file, including nested includes,
+    relative to the file's directory
+    """
+    compiler = next(filter(shutil.which, C_DEPENDENCY_COMPILERS), None)
+    if compiler:
+        directory = os.path.dirname(pathname) or "."
+        # -MG treats missing headers as generated files, rather than an error
+        p = subprocess.run(
+            [compiler, "-MM", "-MG", os.path.basename(pathname)],
+            cwd=directory,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+            errors="replace",
+            check=False,
+        )
+        if p.returncode == 0:
+            return parse_make_rule(p.stdout)[1:]
+        if debug:
+            print(f"{compiler} -MM {pathname} failed", file=sys.stderr)
+    return C_INCLUDE_REGEX.findall(source)
+
+
+def parse_make_rule(rule):
+    """
+    return the prerequisites of the make rule printed by -MM
+    """
+    rule = rule.replace("\\\n", " ")
+    prerequisites = rule.partition(": ")[2]
+    words = re.split(r"(?<!\\)\s+", prerequisites.strip())
+    return [w.replace("\\ ", " ") for w in words if w]
+
+
+def perl_dependencies(pathname, source):
+    """
+    return files used or required by a Perl file, relative to the file's directory
+    """
+    dependencies = PERL_FILE_REGEX.findall(source)
+    for module in PERL_MODULE_REGEX.findall(source):
+        module_pathname = module.replace("::", "/") + ".pm"
+        dependencies += [module_pathname, os.path.join("lib", module_pathname)]
+    return dependencies
+
+
+def python_dependencies(pathname, source):
+    """
+    return files imported by a Python file, relative to the file's directory
+    """
+    modules = []
+    try:
+        for node in ast.walk(ast.parse(source, filename=pathname)):
+            if isinstance(node, ast.Import):
+                modules += [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom):
+                # relative imports are treated as imports from the same directory
+                module = node.module or ""
+                modules.append(module)
+                # names imported may be submodules
+                modules += [f"{module}.{alias.name}" for alias in node.names]
+    except (SyntaxError, ValueError):
+        modules = PYTHON_IMPORT_REGEX.findall(source)
+    dependencies = []
+    for module in modules:
+        components = [c for c in module.split(".") if c]
+        # importing a.b also imports package a
+        for i in range(1, len(components) + 1):
+            module_pathname = os.path.join(*components[:i])
+            dependencies += [
+                module_pathname + ".py",
+                os.path.join(module_pathname, "__init__.py"),
+            ]
+    return dependencies
@@ -7,7 +7,7 @@ Todo:
     * This code needs extensive rewriting
 """
 
-import difflib
+from line_diff import line_diff
 from termcolor import colored as termcolor_colored
 from collections import defaultdict
 
@@ -26,6 +26,7 @@ def explain_output_differences(
     max_lines_shown=32,
     show_all_lines=False,
     max_line_length_shown=1024,
+    max_lines_diffed=100000,
     debug=False,
     **parameters,
 ):
@@ -142,6 +143,7 @@ def explain_output_differences(
         show_all_lines,
         debug,
         actual_line_color,
+        max_lines_diffed=int(max_lines_diffed),
     )
     if not parameters["colorize_output"]:
         actual_line_color = defaultdict(lambda: "")
@@ -233,9 +235,10 @@ def create_diff(
     show_all_lines,
     debug,
     actual_line_color,
+    max_lines_diffed=100000,
 ):
     prefix_removed = 0
-    # difflib.ndiff is horrendously slow so clear matching prefix & suffix
+    # clear matching prefix & suffix
     # but leave 1 line of matching prefix and suffix for context
     if (
         canonical_actual_lines
@@ -288,21 +291,20 @@ def create_diff(
         canonical_expected_lines.pop()
         suffix_removed += 1
 
-    maximum_len_for_diff = 128
     diff_truncated = False
     if not show_all_lines and (
-        len(canonical_expected_lines) > maximum_len_for_diff
-        or len(canonical_actual_lines) > maximum_len_for_diff
+        len(canonical_expected_lines) > max_lines_diffed
+        or len(canonical_actual_lines) > max_lines_diffed
     ):
-        actual_lines = actual_lines[0:maximum_len_for_diff]
-        expected_lines = expected_lines[0:maximum_len_for_diff]
-        canonical_actual_lines = canonical_actual_lines[0:maximum_len_for_diff]
-        canonical_expected_lines = canonical_expected_lines[0:maximum_len_for_diff]
+        actual_lines = actual_lines[0:max_lines_diffed]
+        expected_lines = expected_lines[0:max_lines_diffed]
+        canonical_actual_lines = canonical_actual_lines[0:max_lines_diffed]
+        canonical_expected_lines = canonical_expected_lines[0:max_lines_diffed]
         diff_truncated = True
 
     expected_line_number = 0
     actual_line_number = 0
-    diff = difflib.ndiff(canonical_actual_lines, canonical_expected_lines)
+    diff = line_diff(canonical_actual_lines, canonical_expected_lines)
     diff_explanation = [
         f"The difference between your {name}({colored('-', 'red')})"
         + f" and the correct {name}({colored('+', 'green')}) is:"
@@ -52,9 +52,10 @@ def run_helper(tests, parameters, args):
         "source": source,
         "autotest_directory": args.autotest_directory,
     }
+    environment = dict(test.parameters["environment"])
     for k, v in helper_info.items():
-        os.environ["HELPER_" + k.upper()] = v.replace("\x00", "\\x00")
-    os.environ["HELPER_JSON"] = json.dumps(helper_info, separators=(",", ":"))
+        environment["HELPER_" + k.upper()] = v.replace("\x00", "\\x00")
+    environment["HELPER_JSON"] = json.dumps(helper_info, separators=(",", ":"))
 
     if args.debug:
         print(f"running {AUTOTEST_HELPER} info='{helper_info}'")
@@ -62,12 +63,12 @@ def run_helper(tests, parameters, args):
     for var in ["HOME", "LOGNAME"]:
         value = parameters["__environment_original"].get(var, "")
         if value:
-            os.environ[var] = value
+            environment[var] = value
 
     try:
         sys.stdout.flush()
         sys.stderr.flush()
-        p = subprocess.run([AUTOTEST_HELPER])
+        p = subprocess.run([AUTOTEST_HELPER], env=environment)
         return p.returncode == 0
     except OSError as e:
         if args.debug:
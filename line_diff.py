@@ -0,0 +1,273 @@
+# fast diff of lists of lines, producing output in the format of difflib.ndiff
+#
+# difflib.ndiff is very slow for long outputs,
+# here long outputs are aligned using patience diff
+# with Myers' algorithm for regions without lines unique to them.
+# Short outputs are aligned with difflib.SequenceMatcher as difflib.ndiff does,
+# so the result is identical.
+# Replaced lines are then compared character by character, as difflib.ndiff does,
+# to produce '?' lines marking where similar lines differ.
+
+import bisect, collections, difflib
+
+# outputs with at most this many pairs of lines are aligned using difflib.SequenceMatcher
+MAX_SEQUENCE_MATCHER_PAIRS = 128 * 128
+
+# regions needing more line insertions & deletions than this are treated as replaced
+MAX_MYERS_DIFFERENCES = 500
+
+# replaced regions in long outputs are searched for similar lines
+# a window of this many lines at a time
+FANCY_REPLACE_WINDOW = 32
+
+
+def line_diff(a, b):
+    """
+    yield lines in the format of difflib.ndiff(a, b),
+    lines in a and b must not include newlines
+
+    lines are aligned before the first line is yielded
+    but similar lines are found only as the output is consumed
+    """
+    matches = []
+    if len(a) * len(b) <= MAX_SEQUENCE_MATCHER_PAIRS:
+        for i, j, size in difflib.SequenceMatcher(None, a, b).get_matching_blocks():
+            matches.extend((i + k, j + k) for k in range(size))
+        window = max(len(a), len(b))
+    else:
+        align(a, 0, len(a), b, 0, len(b), matches)
+        window = FANCY_REPLACE_WINDOW
+    i = j = 0
+    for match_i, match_j in matches + [(len(a), len(b))]:
+        if i < match_i and j < match_j:
+            yield from replace(a, i, match_i, b, j, match_j, window)
+        elif i < match_i:
+            yield from dump("-", a, i, match_i)
+        elif j < match_j:
+            yield from dump("+", b, j, match_j)
+        if match_i < len(a):
+            yield "  " + a[match_i]
+        i, j = match_i + 1, match_j + 1
+
+
+def align(a, alo, ahi, b, blo, bhi, matches):
+    """
+    append to matches the pairs of indices of lines matched
+    in a[alo:ahi] and b[blo:bhi] in increasing order
+    """
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        matches.append((alo, blo))
+        alo += 1
+        blo += 1
+    suffix_matches = []
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+        suffix_matches.append((ahi, bhi))
+    if alo < ahi and blo < bhi:
+        anchors = unique_common_lines(a, alo, ahi, b, blo, bhi)
+        if anchors:
+            for i, j in anchors:
+                if alo < i or blo < j:
+                    align(a, alo, i, b, blo, j, matches)
+                matches.append((i, j))
+                alo, blo = i + 1, j + 1
+            align(a, alo, ahi, b, blo, bhi, matches)
+        else:
+            myers(a, alo, ahi, b, blo, bhi, matches)
+    matches.extend(reversed(suffix_matches))
+
+
+def unique_common_lines(a, alo, ahi, b, blo, bhi):
+    """
+    return the longest increasing sequence of pairs of indices of
+    lines occurring exactly once in both a[alo:ahi] and b[blo:bhi]
+    """
+    a_counts = collections.Counter(a[alo:ahi])
+    b_counts = collections.Counter(b[blo:bhi])
+    a_indices = {line: i for i, line in enumerate(a[alo:ahi], alo)}
+    pairs = [
+        (a_indices[line], j)
+        for j, line in enumerate(b[blo:bhi], blo)
+        if b_counts[line] == 1 and a_counts.get(line, 0) == 1
+    ]
+
+    # pairs are ordered by j, usually i is also increasing
+    if all(p[0] < q[0] for p, q in zip(pairs, pairs[1:])):
+        return pairs
+
+    # patience sorting finds the longest sequence with increasing i
+    pile_tops = []
+    pile_top_indices = []
+    predecessors = []
+    for index, (i, _) in enumerate(pairs):
+        pile = bisect.bisect_left(pile_tops, i)
+        predecessors.append(pile_top_indices[pile - 1] if pile else None)
+        if pile == len(pile_tops):
+            pile_tops.append(i)
+            pile_top_indices.append(index)
+        else:
+            pile_tops[pile] = i
+            pile_top_indices[pile] = index
+    sequence = []
+    index = pile_top_indices[-1] if pile_top_indices else None
+    while index is not None:
+        sequence.append(pairs[index])
+        index = predecessors[index]
+    sequence.reverse()
+    return sequence
+
+
+def myers(a, alo, ahi, b, blo, bhi, matches):
+    """
+    append to matches the pairs of indices of a longest common subsequence
+    of a[alo:ahi] and b[blo:bhi] found with Myers' algorithm,
+    nothing is appended if more than MAX_MYERS_DIFFERENCES differences are needed
+    """
+    n, m = ahi - alo, bhi - blo
+    max_d = min(n + m, MAX_MYERS_DIFFERENCES)
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    trace = []
+    for d in range(max_d + 1):
+        trace.append(list(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                break
+        else:
+            continue
+        break
+    else:
+        return
+
+    # follow the path back from (n, m) collecting diagonal moves
+    reversed_matches = []
+    x, y = n, m
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+            previous_k = k + 1
+        else:
+            previous_k = k - 1
+        previous_x = v[offset + previous_k]
+        previous_y = previous_x - previous_k
+        while x > previous_x and y > previous_y:
+            x -= 1
+            y -= 1
+            reversed_matches.append((alo + x, blo + y))
+        x, y = previous_x, previous_y
+    matches.extend(reversed(reversed_matches))
+
+
+def dump(tag, lines, lo, hi):
+    for line in lines[lo:hi]:
+        yield f"{tag} {line}"
+
+
+def replace(a, alo, ahi, b, blo, bhi, window):
+    """
+    yield diff lines for replacing a[alo:ahi] with b[blo:bhi],
+    comparing window lines of each at a time
+    """
+    while alo < ahi and blo < bhi:
+        a_end = min(ahi, alo + window)
+        b_end = min(bhi, blo + window)
+        yield from fancy_replace(a, alo, a_end, b, blo, b_end)
+        alo, blo = a_end, b_end
+    yield from dump("-", a, alo, ahi)
+    yield from dump("+", b, blo, bhi)
+
+
+def plain_replace(a, alo, ahi, b, blo, bhi):
+    # as difflib.ndiff, dump the shorter block first
+    if bhi - blo < ahi - alo:
+        yield from dump("+", b, blo, bhi)
+        yield from dump("-", a, alo, ahi)
+    else:
+        yield from dump("-", a, alo, ahi)
+        yield from dump("+", b, blo, bhi)
+
+
+def fancy_replace(a, alo, ahi, b, blo, bhi):
+    """
+    as difflib.Differ._fancy_replace,
+    find the most similar pair of lines and mark their differences with '?' lines,
+    then recursively do the same for the lines before and after the pair
+    """
+    best_ratio, cutoff = 0.74, 0.75
+    cruncher = difflib.SequenceMatcher(difflib.IS_CHARACTER_JUNK)
+    equal_i = equal_j = None
+    for j in range(blo, bhi):
+        cruncher.set_seq2(b[j])
+        for i in range(alo, ahi):
+            if a[i] == b[j]:
+                if equal_i is None:
+                    equal_i, equal_j = i, j
+                continue
+            cruncher.set_seq1(a[i])
+            if (
+                cruncher.real_quick_ratio() > best_ratio
+                and cruncher.quick_ratio() > best_ratio
+                and cruncher.ratio() > best_ratio
+            ):
+                best_ratio, best_i, best_j = cruncher.ratio(), i, j
+    if best_ratio < cutoff:
+        if equal_i is None:
+            yield from plain_replace(a, alo, ahi, b, blo, bhi)
+            return
+        best_i, best_j = equal_i, equal_j
+    else:
+        equal_i = None
+
+    yield from fancy_helper(a, alo, best_i, b, blo, best_j)
+    a_line, b_line = a[best_i], b[best_j]
+    if equal_i is None:
+        a_tags = b_tags = ""
+        cruncher.set_seqs(a_line, b_line)
+        for tag, ai1, ai2, bj1, bj2 in cruncher.get_opcodes():
+            a_length, b_length = ai2 - ai1, bj2 - bj1
+            if tag == "replace":
+                a_tags += "^" * a_length
+                b_tags += "^" * b_length
+            elif tag == "delete":
+                a_tags += "-" * a_length
+            elif tag == "insert":
+                b_tags += "+" * b_length
+            else:
+                a_tags += " " * a_length
+                b_tags += " " * b_length
+        yield from tagged_line("-", a_line, a_tags)
+        yield from tagged_line("+", b_line, b_tags)
+    else:
+        yield "  " + a_line
+    yield from fancy_helper(a, best_i + 1, ahi, b, best_j + 1, bhi)
+
+
+def fancy_helper(a, alo, ahi, b, blo, bhi):
+    if alo < ahi:
+        if blo < bhi:
+            yield from fancy_replace(a, alo, ahi, b, blo, bhi)
+        else:
+            yield from dump("-", a, alo, ahi)
+    elif blo < bhi:
+        yield from dump("+", b, blo, bhi)
+
+
+def tagged_line(tag, line, tags):
+    yield f"{tag} {line}"
+    # tabs & spaces in line are kept so tags line up with line
+    tags = "".join(
+        c if t == " " and c.isspace() else t for (c, t) in zip(line, tags)
+    ).rstrip()
+    if tags:
+        yield f"? {tags}\n"
@@ -0,0 +1,103 @@
+# direct use of mount(2) & related system calls via ctypes
+#
+# much faster than running mount & umount
+
+import ctypes, ctypes.util, os, sys
+
+# flags for mount(2) & unshare(2) from <sys/mount.h> & <sched.h>
+MS_RDONLY = 1
+MS_NOSUID = 2
+MS_NODEV = 4
+MS_NOEXEC = 8
+MS_REMOUNT = 32
+MS_NOATIME = 1024
+MS_NODIRATIME = 2048
+MS_BIND = 4096
+MS_REC = 16384
+MS_PRIVATE = 1 << 18
+MS_RELATIME = 1 << 21
+CLONE_NEWNS = 0x00020000
+CLONE_NEWPID = 0x20000000
+CLONE_NEWNET = 0x40000000
+MNT_DETACH = 2
+
+# flags which can not be removed when remounting a bind mount in a user namespace
+# os.statvfs uses the same values as mount(2) for these except relatime
+LOCKED_MOUNT_FLAGS = MS_NOSUID | MS_NODEV | MS_NOEXEC | MS_NOATIME | MS_NODIRATIME
+
+
+def get_libc(
+    # pylint: disable=dangerous-default-value
+    cache={},
+):
+    if "libc" not in cache:
+        cache["libc"] = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    return cache["libc"]
+
+
+def mount(source, target, args, fstype=None, flags=0, data=None):
+    """
+    call mount(2) directly, much faster than running mount
+    raise OSError if the mount fails
+    """
+    if args and args.debug:
+        print(f"mount({source}, {target}, {fstype}, {flags:#x})", file=sys.stderr)
+    if get_libc().mount(
+        source.encode(),
+        target.encode(),
+        fstype.encode() if fstype else None,
+        ctypes.c_ulong(flags),
+        data.encode() if data else None,
+    ):
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"mount {source} {target}: {os.strerror(errno)}")
+
+
+def unshare_namespaces(flags=CLONE_NEWNS):
+    """
+    move this process into the new namespaces specified by flags,
+    with CLONE_NEWNS it gets its own copy of the mount namespace,
+    so its mounts are not seen by other processes,
+    with CLONE_NEWPID only children created afterwards are in the new PID namespace
+    """
+    if get_libc().unshare(flags):
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"unshare: {os.strerror(errno)}")
+    if flags & CLONE_NEWNS:
+        mount("none", "/", args=None, flags=MS_REC | MS_PRIVATE)
+
+
+def umount(target):
+    """
+    detach the filesystem mounted at target
+    raise OSError if this fails
+    """
+    if get_libc().umount2(target.encode(), MNT_DETACH):
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"umount {target}: {os.strerror(errno)}")
+
+
+def mount_overlay(lower_directory, directory, args=None):
+    """
+    create directory as an overlayfs mount with lower_directory as its lower layer,
+    changes are stored in directories created alongside directory
+    raise OSError if this is not possible, e.g. if not in a user namespace
+    """
+    parent_directory = os.path.dirname(directory)
+    upper_directory = os.path.join(parent_directory, "overlay_upper")
+    work_directory = os.path.join(parent_directory, "overlay_work")
+    os.mkdir(upper_directory)
+    os.mkdir(work_directory)
+    os.mkdir(directory)
+    try:
+        mount(
+            "overlay",
+            directory,
+            args,
+            fstype="overlay",
+            data=f"lowerdir={lower_directory},upperdir={upper_directory},workdir={work_directory}",
+        )
+    except OSError:
+        for d in [directory, work_directory, upper_directory]:
+            os.rmdir(d)
+        raise
@@ -0,0 +1,142 @@
+# compare a program's stdout to its expected stdout while the program runs
+#
+# output is canonicalized a line at a time, giving exactly the result of
+# _Test.make_string_canonical for the complete output,
+# so a mismatch is found as soon as the output can no longer be correct
+
+import codecs, re
+
+BLANK_LINE = re.compile(r"\s*")
+
+
+class OutputComparator:
+    def __init__(
+        self,
+        canonical_expected,
+        canonical_translator,
+        ignore_case=False,
+        ignore_blank_lines=False,
+        ignore_trailing_whitespace=True,
+        fail_fast=False,
+        window_lines=32,
+        window_bytes=32768,
+    ):
+        """
+        canonical_expected is the expected output after make_string_canonical
+
+        if fail_fast is set, feed returns False once output is incorrect and
+        another window_lines lines or window_bytes bytes have been received,
+        this output is kept so the difference can be explained
+        """
+        self.canonical_expected = canonical_expected
+        self.canonical_translator = canonical_translator
+        self.ignore_case = ignore_case
+        self.ignore_blank_lines = ignore_blank_lines
+        self.ignore_trailing_whitespace = ignore_trailing_whitespace
+        self.fail_fast = fail_fast
+        self.window_lines = window_lines
+        self.window_bytes = window_bytes
+        self.decoder = codecs.getincrementaldecoder("UTF-8")(errors="replace")
+        # output after the last newline
+        self.partial_line = ""
+        self.n_lines = 0
+        # number of characters of canonical_expected matched so far
+        self.n_matched = 0
+        self.mismatch = False
+        self.window_lines_received = 0
+        self.window_bytes_received = 0
+        self.stopped = False
+
+    def feed(self, data):
+        """
+        compare the next bytes of output,
+        return False if the program should be stopped
+        """
+        if not self.mismatch:
+            text = self.partial_line + self.decoder.decode(data)
+            last_newline = text.rfind("\n")
+            self.partial_line = text[last_newline + 1 :]
+            if last_newline >= 0:
+                lines = self.canonicalize(text[0 : last_newline + 1]).split("\n")
+                for line in lines[0:-1]:
+                    self.compare_line(line)
+            if not self.mismatch:
+                self.compare_partial_line()
+            if not self.mismatch:
+                return True
+            self.partial_line = ""
+        # output containing the mismatch is counted as part of the window
+        self.window_lines_received += data.count(b"\n")
+        self.window_bytes_received += len(data)
+        if self.fail_fast and (
+            self.window_lines_received >= self.window_lines
+            or self.window_bytes_received >= self.window_bytes
+        ):
+            self.stopped = True
+        return not self.stopped
+
+    def finish(self):
+        """
+        compare the remaining output,
+        return True if the complete output matched the expected output
+        """
+        if not self.mismatch:
+            text = self.partial_line + self.decoder.decode(b"", final=True)
+            self.partial_line = ""
+            lines = self.canonicalize(text).split("\n")
+            for line in lines[0:-1]:
+                self.compare_line(line)
+            self.compare_line(lines[-1], last_line=True)
+        return not self.mismatch and self.n_matched == len(self.canonical_expected)
+
+    def canonicalize(self, text):
+        """
+        apply the character by character parts of make_string_canonical,
+        text must be the complete output or end with a newline
+        """
+        text = re.sub("\r\n?", "\n", text)
+        if self.ignore_case:
+            text = text.lower()
+        return text.translate(self.canonical_translator)
+
+    def compare_line(self, line, last_line=False):
+        line_number = self.n_lines
+        self.n_lines += 1
+        if not last_line:
+            # make_string_canonical removes a blank first line
+            # and lines of only white space after it, but not the last line
+            if self.ignore_blank_lines and (
+                line == "" or (line_number > 0 and BLANK_LINE.fullmatch(line))
+            ):
+                return
+            if self.ignore_trailing_whitespace:
+                line = line.rstrip(" \t")
+            line += "\n"
+        self.compare_canonical(line)
+
+    def compare_partial_line(self):
+        """
+        check the start of an unfinished line,
+        so a program printing a very long line can be stopped
+
+        this is only done for ASCII text not containing carriage returns
+        as otherwise the canonical form of the line may depend on what follows
+        """
+        line = self.partial_line
+        if not line or "\r" in line or not line.isascii():
+            return
+        if self.ignore_case:
+            line = line.lower()
+        line = line.translate(self.canonical_translator)
+        if self.ignore_blank_lines and BLANK_LINE.fullmatch(line):
+            return
+        if self.ignore_trailing_whitespace:
+            line = line.rstrip(" \t")
+        if not self.canonical_expected.startswith(line, self.n_matched):
+            self.mismatch = True
+
+    def compare_canonical(self, text):
+        if self.canonical_expected.startswith(text, self.n_matched):
+            self.n_matched += len(text)
+        else:
+            self.mismatch = True
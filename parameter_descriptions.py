@@ -8,7 +8,7 @@
 # 	4) code to finalize and update the parameter value possible depending on other parameters
 # 	5) where this parameter must be set for all tests
 
-import collections, copy, os, re, string, sys
+import collections, os, re, string, sys
 from util import TestSpecificationError
 
 # parameters are set to any values explicity set in the specification
@@ -269,6 +269,8 @@ def finalize_compiler_checker_list(name, compilers_or_checkers, parameters):
             f"invalid value for parameter '{name}': {compilers_or_checkers}"
         )
     program = parameters["program"]
+    # lists may be shared with other tests, so create a new list
+    compilers_or_checkers = list(compilers_or_checkers)
     for index, command in enumerate(compilers_or_checkers):
         if not command:
             raise TestSpecificationError(
@@ -308,11 +310,17 @@ def select_command_from_alternatives(alternatives):
             executable = alternative[0]
         else:
             return None
-        if search_path(executable):
+        executables_searched[executable] = search_path(executable)
+        if executables_searched[executable]:
             return alternative
     return None
 
 
+# results of searching PATH for alternative commands,
+# used to validate cached test specifications
+executables_searched = {}
+
+
 def search_path(program):
     """
     return first occurence of program as executable in $PATH
@@ -453,7 +461,7 @@ def finalize_compile_commands(_name, value, parameters):
         if isinstance(command, str):
             command += " ".join(compiler_args)
         else:
-            command += compiler_args
+            command = command + compiler_args
 
         compile_commands.append(command)
     return compile_commands
@@ -472,6 +480,67 @@ PARAMETER_LIST += [
             In most cases, set these parameters will be more appropriate.
         """,
     ),
+    Parameter(
+        "compilation_cache_directory",
+        default="",
+        required_type=str,
+        description="""
+            If set to a non-empty string, binaries produced by **`compile_commands`** are cached in this directory.<br>
+            The cache is indexed by the compile command, the compiler binary and the contents of the files compiled.<br>
+            If a binary is found in the cache, it is used instead of running the compiler
+            and the compiler output is reproduced.<br>
+            The directory can be shared by multiple simultaneous autotests.
+        """,
+    ),
+    Parameter(
+        "compilation_cache_max_bytes",
+        default=1024 * 1024 * 1024,
+        required_type=int,
+        description="""
+            Maximum size of **`compilation_cache_directory`** in bytes.<br>
+            Least recently used binaries are removed when it is exceeded.
+        """,
+    ),
+    Parameter(
+        "result_cache_directory",
+        default="",
+        required_type=str,
+        description="""
+            If set to a non-empty string, results of tests are cached in this directory.<br>
+            The cache is indexed by the test's parameters, including its environment,
+            and the contents of the files in the test directory before any test is run,
+            except binaries compiled by **`compile_commands`**, instead the compiler used is included.<br>
+            Tests which share the test directory, i.e. are not run in a copy of it,
+            may use files written by earlier tests, so their cached results are only used
+            if the results of all earlier tests sharing the test directory are cached.<br>
+            If a test's result is found in the cache, it is reported without running the test.<br>
+            Tests must be deterministic for their results to be cached.<br>
+            If autotest is run with **`--changed_only`**, tests whose passing results are cached are not reported,
+            cached failures are still reported,
+            and if this parameter is not set, `~/.cache/autotest/results` is used.
+        """,
+    ),
+    Parameter(
+        "result_cache_max_bytes",
+        default=64 * 1024 * 1024,
+        required_type=int,
+        description="""
+            Maximum size of **`result_cache_directory`** in bytes.<br>
+            Least recently used results are removed when it is exceeded.
+        """,
+    ),
+    Parameter(
+        "test_statistics_file",
+        default="",
+        required_type=str,
+        description="""
+            If set to a non-empty string, the number of runs, failures and duration of each test
+            are recorded in this file.<br>
+            They are used to order tests if autotest is run with **`--order`**,
+            which records them in `~/.cache/autotest/test_statistics.json` if this parameter is not set.
+            This parameter must be set as a global parameter.
+        """,
+    ),
     Parameter(
         "setup_command",
         finalize=finalize_command,
@@ -500,7 +569,23 @@ PARAMETER_LIST += [
             This directory is also prepended to any relative file pathnames in test specifications.<br>
             Its default value is the directory containing the test specification file (`tests.txt`).<br>
             Only one directory is copied for all tests.  This parameter must be set as a global parameter.
-            It is usually specified in a wrapper shell script via -P.
+            It is usually specified in a wrapper shell script via -P.<br>
+            Files are cloned rather than copied if the file system supports it,
+            and hard linked if they can not be changed by tests.
+        """,
+    ),
+    Parameter(
+        "supplied_files_cache_directory",
+        default="",
+        required_type=str,
+        description="""
+            If set to a non-empty string, read-only copies of files from **`supplied_files_directory`**
+            are kept in this directory and hard linked for testing,
+            so large files are not copied every time autotest is run.<br>
+            It should be on the same file system as the temporary directory used for testing, e.g. /tmp.
+            Copies are replaced when the original file's size or modification time changes,
+            or if their contents no longer match the hash recorded when they were created.
+            This parameter must be set as a global parameter.
         """,
     ),
 ]
@@ -547,9 +632,15 @@ def interpolate_file(e, parameter_name, parameters):
     return contents
 
 
+# pathnames of files read by read_file, used to validate cached test specifications
+files_read = set()
+
+
 def read_file(pathname, parameters):
     if not os.path.isabs(pathname):
         pathname = os.path.join(parameters["supplied_files_directory"], pathname)
+    # relative to the current directory, like supplied_files_directory
+    files_read.add(os.path.normpath(pathname))
     try:
         with open(pathname, encoding="utf-8") as f:
             return f.read()
@@ -557,6 +648,37 @@ def read_file(pathname, parameters):
         raise TestSpecificationError(f"{pathname}: {e}") from e
 
 
+def get_original_environment(
+    # pylint: disable=dangerous-default-value
+    cache={},
+):
+    """
+    return a copy of the environment autotest was run with,
+    the same dict is returned for every test so it must not be modified
+    """
+    if "environment" not in cache:
+        cache["environment"] = dict(os.environ.items())
+    return cache["environment"]
+
+
+def get_filtered_environment(
+    environment_kept,
+    # pylint: disable=dangerous-default-value
+    cache={},
+):
+    """
+    return the variables in the original environment whose name matches environment_kept
+    the same dict is returned for every test so it must not be modified
+    """
+    if environment_kept not in cache:
+        cache[environment_kept] = dict(
+            (k, v)
+            for (k, v) in get_original_environment().items()
+            if re.fullmatch(environment_kept, k)
+        )
+    return cache[environment_kept]
+
+
 PARAMETER_LIST += [
     Parameter(
         "stdin",
@@ -613,7 +735,7 @@ PARAMETER_LIST += [
     ),
     Parameter(
         "__environment_original",
-        default=lambda p: dict((k, v) for (k, v) in os.environ.items()),
+        default=lambda p: get_original_environment(),
         show_in_documentation=False,
         description="""
             Internal variable holding original environment.
@@ -631,11 +753,7 @@ PARAMETER_LIST += [
     ),
     Parameter(
         "__environment_filtered",
-        default=lambda p: dict(
-            (k, v)
-            for (k, v) in os.environ.items()
-            if re.fullmatch(p["environment_kept"], k)
-        ),
+        default=lambda p: get_filtered_environment(p["environment_kept"]),
         show_in_documentation=False,
         description="""
             Internal variable holding filtered original environment.
@@ -781,6 +899,8 @@ def finalize_expected_files(name, expected_files, parameters):
             f"error invalid value for parameter '{name}': {expected_files}"
         )
 
+    # dict may be shared with other tests, so create a new dict
+    expected_files = dict(expected_files)
     efn = parameters.get("expected_file_name", "")
     if efn:
         efc = parameters.get("expected_file_contents", "")
@@ -838,6 +958,20 @@ def finalize_max_bytes(name, value, parameters):
         return max(len_expected, int(value))
 
 
+def finalize_postprocess_output_function(name, value, _parameters):
+    if not value:
+        return ""
+    if not isinstance(value, str):
+        raise TestSpecificationError(f"invalid value for parameter '{name}': {value}")
+    try:
+        compile(value, name, "eval")
+    except SyntaxError as e:
+        raise TestSpecificationError(
+            f"invalid value for parameter '{name}': {e}"
+        ) from e
+    return value
+
+
 PARAMETER_LIST += [
     Parameter(
         "max_stdout_bytes",
@@ -870,6 +1004,24 @@ PARAMETER_LIST += [
             Maximum CPU time in seconds (0 for no limit).
         """,
     ),
+    Parameter(
+        "reference_cpu_seconds",
+        default=0.0,
+        description="""
+            CPU time in seconds used by a reference solution for this test.<br>
+            Used with **`max_cpu_ratio`** to detect inefficient solutions.
+            The CPU time used by each test is included in the output of **`--json_results`**.
+        """,
+    ),
+    Parameter(
+        "max_cpu_ratio",
+        default=0.0,
+        description="""
+            If non-zero and **`reference_cpu_seconds`** is set,
+            a test fails if it uses more than **`max_cpu_ratio`** * **`reference_cpu_seconds`** seconds of CPU time
+            even if its output is correct.
+        """,
+    ),
     Parameter(
         "max_core_size",
         default=0,
@@ -888,7 +1040,9 @@ PARAMETER_LIST += [
         "max_rss_bytes",
         default=100000000,
         description="""
-            Maximum resident set size in bytes.
+            Maximum resident set size in bytes.<br>
+            Only enforced if **`cgroup_directory`** is set,
+            when it limits the memory used by all the test's processes.
         """,
     ),
     Parameter(
@@ -903,7 +1057,8 @@ PARAMETER_LIST += [
         default=4096,
         description="""
             Maximum number of processes the current process may create.
-            Note: unfortunately this is total per user processes not child processes
+            Note: unfortunately this is total per user processes not child processes,
+            unless **`cgroup_directory`** is set
         """,
     ),
     Parameter(
@@ -913,6 +1068,30 @@ PARAMETER_LIST += [
             Maximum number of files that can be simultaneously open
         """,
     ),
+    Parameter(
+        "max_cpus",
+        default=0.0,
+        description="""
+            If non-zero and **`cgroup_directory`** is set,
+            the number of CPUs the test's processes together may use at once.
+        """,
+    ),
+    Parameter(
+        "cgroup_directory",
+        default="",
+        required_type=str,
+        description="""
+            If set, each test is run in a new cgroup v2 created in this directory,
+            for example a directory delegated by systemd.<br>
+            The cgroup limits memory, processes and CPU for all the test's processes
+            (**`max_rss_bytes`**, **`max_processes`**, **`max_cpus`**),
+            measures the CPU time and peak memory they use
+            and ensures they are all killed when the test finishes.<br>
+            Limits are only applied if the corresponding controller
+            is enabled in the directory's *cgroup.subtree_control*.<br>
+            If a cgroup can not be used, tests are run with only the limits set by setrlimit.
+        """,
+    ),
     " ## Parameters controlling comparison of expected to actual output",
     "These apply to comparision for stdout, stderr, and files",
     Parameter(
@@ -972,6 +1151,30 @@ PARAMETER_LIST += [
             If it is a list it is executed directly.
         """,
     ),
+    Parameter(
+        "postprocess_output_coprocess",
+        default=False,
+        description="""
+            Run **`postprocess_output_command`** once as a co-process rather than once for each output.<br>
+            Each output is written to the command's stdin as its length in bytes in decimal and a newline, followed by the output encoded in UTF-8.<br>
+            The command must write the postprocessed output to its stdout in the same format.<br>
+            A probe record is sent first, if the command does not respond correctly it is run once for each output.
+            The probe's length is sent before the probe, the command must not respond until it has read the probe.<br>
+            When tests are run in parallel this check is made once, before worker processes are started.
+        """,
+    ),
+    Parameter(
+        "postprocess_output_function",
+        default="",
+        finalize=finalize_postprocess_output_function,
+        description="""
+            Pass expected and actual output through this Python function before comparison,
+            after **`postprocess_output_command`** if it is also set.<br>
+            The value is a Python expression evaluating to a function taking and returning a string,
+            for example: `"lambda output: ''.join(sorted(output.splitlines(True)))"`<br>
+            The module `re` is available to the expression.
+        """,
+    ),
     Parameter(
         "allow_unexpected_stderr",
         default=False,
@@ -980,6 +1183,17 @@ PARAMETER_LIST += [
             This means warning messages don't cause a test to be failed.
         """,
     ),
+    Parameter(
+        "fail_fast_on_mismatch",
+        default=False,
+        description="""
+            Stop a test's program once its output can no longer match the expected output.<br>
+            Only **`max_lines_shown`** further lines of output are collected for the explanation.<br>
+            This saves time and memory for programs which produce large amounts of incorrect output.<br>
+            Output is checked as it is produced unless **`postprocess_output_command`** is set
+            or output is not UNICODE.
+        """,
+    ),
     "### Parameters controlling information printed about test",
     Parameter(
         "colorize_output",
@@ -1090,6 +1304,14 @@ PARAMETER_LIST += [
             Any further characters are elided.
         """,
     ),
+    Parameter(
+        "max_lines_diffed",
+        default=100000,
+        description="""
+            Maximum lines of expected & actual output compared to find the differences shown in test explanations.
+            Any further lines are ignored.
+        """,
+    ),
     Parameter(
         "no_replace_semicolon_reproduce_command",
         default=False,
@@ -1114,6 +1336,7 @@ def finalize_dcc_output_checking(_name, value, parameters):
         or not parameters["files"][0].endswith(".c")
         or parameters["expected_stderr"]
         or parameters.get("postprocess_output_command", "")
+        or parameters.get("postprocess_output_function", "")
         or parameters.get("compiler_args", "")
         or (
             isinstance(parameters["command"], str)
@@ -1122,12 +1345,14 @@ def finalize_dcc_output_checking(_name, value, parameters):
     ):
         return False
 
+    environment = dict(parameters["environment"])
     for (
         p
     ) in "expected_stdout ignore_case compare_only_characters ignore_characters ignore_trailing_whitespace ignore_whitespace ignore_blank_lines max_stdout_bytes".split():
         dcc_equivalent = "DCC_" + p.upper().replace("WHITESPACE", "WHITE_SPACE")
         value = str(parameters.get(p, ""))
-        parameters["environment"][dcc_equivalent] = value
+        environment[dcc_equivalent] = value
+    parameters["environment"] = environment
 
     return True
 
@@ -1170,6 +1395,55 @@ PARAMETER_LIST += [
             Any specified fields/values are added to upload requests.
         """,
     ),
+    Parameter(
+        "serial",
+        default=False,
+        description="""
+            If true, this test is not run in parallel with other tests when tests are run with --jobs.<br>
+            Tests run in parallel are each run in a separate copy of the test directory,
+            so files they create are not visible to other tests.<br>
+            Tests with **`serial`** set are run in order in the test directory,
+            so should be used for tests which depend on files created by previous tests.
+        """,
+    ),
+    Parameter(
+        "isolate_tests",
+        default=False,
+        description="""
+            If true, this test is run in a separate copy of the test directory,
+            which is discarded after the test, even if tests are not run in parallel.
+            Files it creates are not visible to other tests.
+            Tests with **`serial`** set are still run in the test directory.<br>
+            Inside a **`sandbox`**, the copies made for this test and for tests run in parallel
+            are overlayfs mounts of the test directory, so no files need be copied.
+        """,
+    ),
+    Parameter(
+        "deduplicate_executions",
+        default=False,
+        description="""
+            If true, the program is run only once for tests which differ only in
+            how its output is checked or reported, e.g. in **`expected_stdout`** or **`description`**,
+            and the output of this execution is checked for each of these tests.<br>
+            Tests with **`expected_files`** set, and tests run in parallel
+            except those with **`serial`** set, are always run.<br>
+            This should not be set if the program's output depends on files changed
+            by earlier executions of the same command.
+        """,
+    ),
+    Parameter(
+        "cache_test_specification",
+        default=False,
+        description="""
+            If true, the parsed test specification is saved in a file next to the test specification.<br>
+            It is used by later autotests, until the test specification,
+            files it refers to or autotest itself changes.<br>
+            Parameters depending on the environment, such as **`environment`**, are recalculated for each autotest.<br>
+            The file is only used if it is owned by the user running autotest or the owner of the test specification,
+            and is not writable by other users.<br>
+            This can make starting autotests with large specifications faster.
+        """,
+    ),
     Parameter(
         "debug",
         default=0,
@@ -1201,7 +1475,8 @@ PARAMETER_LIST += [
         description="""
            Run tests within a sandbox - currently requires /usr/bin/unshare.
            Deliberate escape from sandbox may be possible.
-           Only one sandbox is used for all tests.  This parameter must be set as a global parameter.
+           Only one sandbox is used for all tests, but see **`isolate_tests`**.
+           This parameter must be set as a global parameter.
         """,
     ),
     Parameter(
@@ -1256,6 +1531,21 @@ PARAMETER_LIST += [
         description="""
            Command used to create sandbox
            It is given two arguments: the full pathname of the autotest.py and '--inside_sandbox'
+           or, if **`sandbox_pool`** is set, three arguments:
+           the full pathname of the autotest.py, '--sandbox_server' and a directory
+        """,
+    ),
+    Parameter(
+        "sandbox_pool",
+        default=False,
+        description="""
+           If true and tests are run in a **`sandbox`** with **`--batch`** or **`--serve`**,
+           **`sandbox_command`** is run once and mounts shared by all submissions are created once.
+           A sandbox is then forked for each submission, which only needs to mount
+           /tmp and the submission's directory.
+           Each forked sandbox has its own mount and PID namespaces,
+           and its own network namespace if **`sandbox_network`** is true.
+           This parameter must be set as a global parameter.
         """,
     ),
 ]
@@ -1310,6 +1600,43 @@ def normalize_parameters(parameters, check_required_parameters_set=True, debug=0
         raise TestSpecificationError(f"{error_prefix}: {e}") from e
 
 
+# parameters whose values depend on the environment autotest is run in,
+# in the order they are calculated
+ENVIRONMENT_PARAMETERS = [
+    "__environment_original",
+    "__environment_filtered",
+    "environment_base",
+    "environment",
+    "colorize_output",
+]
+
+
+def remove_environment_parameters(parameters):
+    """
+    remove the calculated values of ENVIRONMENT_PARAMETERS from normalized test parameters,
+    which must be a TestParameters, values specified for the test are kept
+    """
+    for name in ENVIRONMENT_PARAMETERS:
+        if not any(name in mapping for mapping in parameters.maps[1:]):
+            parameters.maps[0].pop(name, None)
+
+
+def renormalize_environment_parameters(parameters, debug=0):
+    """
+    calculate ENVIRONMENT_PARAMETERS for test parameters normalized in another environment,
+    after remove_environment_parameters
+    """
+    remove_environment_parameters(parameters)
+    set_parameter_calculated_defaults(parameters, debug=debug)
+    # dcc_output_checking adds variables to environment
+    for name in ENVIRONMENT_PARAMETERS + ["dcc_output_checking"]:
+        p = PARAMETERS[name]
+        if p.finalize:
+            value = p.finalize(p.name, parameters.get(p.name, None), parameters)
+            if value is not None:
+                parameters[p.name] = value
+
+
 def normalize_parameters1(parameters, check_required_parameters_set=True, debug=0):
     set_parameter_aliases(parameters, debug=debug)
     # this allows these to be used in calculated default values or finalize
@@ -1341,7 +1668,8 @@ def set_parameter_constant_defaults(parameters, debug=0):
             and p.default is not None
             and not callable(p.default)
         ):
-            parameters[p.name] = copy.deepcopy(p.default)
+            # default values are shared by all tests and must not be modified
+            parameters[p.name] = p.default
 
 
 def set_parameter_calculated_defaults(parameters, debug=0):
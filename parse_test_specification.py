@@ -2,7 +2,7 @@
 
 # parse a "tests.txt" file specifying an autotest
 
-import ast, io, collections, copy, os, pprint, re, sys, tokenize
+import ast, io, collections, os, pprint, re, sys, tokenize
 from parameter_descriptions import check_valid_parameter_name, normalize_parameters
 from util import TestSpecificationError
 
@@ -173,15 +173,46 @@ def process_line(
         )
 
     if label not in tests:
-        tests[label] = copy.deepcopy(global_parameters)
-        tests[label]["_source_name"] = str(source_name)
-        tests[label]["_line_number"] = str(line_number)
-    tests[label].update(copy.deepcopy(local_parameters))
+        # test parameters are layered: values calculated by normalize_parameters,
+        # values specified for this test, and global values
+        # global values are shared with other tests, not copied
+        tests[label] = TestParameters(
+            {},
+            {"_source_name": str(source_name), "_line_number": str(line_number)},
+            dict(global_parameters),
+        )
+    test = tests[label]
+    if isinstance(test, TestParameters):
+        test.maps[1].update(local_parameters)
+    else:
+        test.update(local_parameters)
     test_local_parameters[label].update(local_parameters.keys())
 
     return local_parameters
 
 
+class TestParameters(collections.ChainMap):
+    """
+    parameter values for a test stored in layers, so values can be shared between tests
+    assignments are made to the first layer
+
+    normalize_parameters checks for parameters hundreds of times per test,
+    so lookups are implemented more efficiently than ChainMap's
+    """
+
+    def __contains__(self, key):
+        for mapping in self.maps:
+            if key in mapping:
+                return True
+        return False
+
+    def get(self, key, default=None):
+        for mapping in self.maps:
+            if key in mapping:
+                return mapping[key]
+        return default
+
+
 def parse_line_assignments(values, debug=0):
     """
     return a dict containing the parameters specified by values
@@ -247,13 +278,16 @@ def get_line_literals(stream, source_name, parameters, debug=0):
 
     shell-like bare-words and merge of adjacent tokens is implemented
 
-    triple-quoted strings, lists & dict can span multiple lines - which is handled in an brittle, inefficient and ugly manner
+    triple-quoted strings, lists & dict can span multiple lines
+    LiteralScanner is used to find where they end, so lines are parsed only once complete
     """
-    source_lines = ""
+    source_lines = []
     start_lines_number = 1
+    scanner = None
     for line_number, line in enumerate(stream, 1):
-        if source_lines == "":
+        if not source_lines:
             start_lines_number = line_number
+            scanner = LiteralScanner()
 
             # hack for backwards compatiblity change lines like this:
             # compiler_args=-Dmain=_main autotest_add.c add.c -o add
@@ -273,18 +307,24 @@ def get_line_literals(stream, source_name, parameters, debug=0):
             # as hack for backwards compatiblity we surround such labels with single-quotes
             line = re.sub(r"^(\d\w+)\s", r"'\1' ", line)
 
-        source_lines += line
+        source_lines.append(line)
+        if scanner:
+            scanner.scan(line)
+            if not scanner.is_complete():
+                continue
         try:
+            combined_lines = "".join(source_lines)
             yield (
                 start_lines_number,
-                parse_literals(source_lines, parameters, debug=debug),
-                source_lines,
+                parse_literals(combined_lines, parameters, debug=debug),
+                combined_lines,
             )
-            source_lines = ""
+            source_lines = []
         except (tokenize.TokenError, SyntaxError, ValueError):
             # assume this exceptions results from a multi-line string, strings, lists & dict
             # continue adding more lines until string/expression is complete
-            pass
+            # the scanner was wrong about this literal, so try parsing after every line
+            scanner = None
         except Exception as e:
             raise TestSpecificationError(f"{source_name}:{line_number}:{e}") from e
 
@@ -294,6 +334,81 @@ def get_line_literals(stream, source_name, parameters, debug=0):
         )
 
 
+class LiteralScanner:
+    """
+    track the strings, brackets and comments in the text scanned so far
+    in time linear in the length of the text
+
+    this is much cheaper than re-tokenizing the text but only approximates Python's tokenizer,
+    so callers must handle the tokenizer disagreeing
+    """
+
+    # characters which may change state outside a string
+    SPECIAL_CHARACTERS = re.compile(r"'''|\"\"\"|['\"#\\\[\](){}]")
+
+    # characters which may end a string started by each quote
+    # a newline ends a single-quoted string, incorrectly
+    STRING_END = {
+        "'": re.compile(r"\\(?:.|\n)|'|\n"),
+        '"': re.compile(r'\\(?:.|\n)|"|\n'),
+        "'''": re.compile(r"\\(?:.|\n)|'''"),
+        '"""': re.compile(r'\\(?:.|\n)|"""'),
+    }
+
+    def __init__(self):
+        self.quote = None
+        self.depth = 0
+        self.continued = False
+
+    def scan(self, text, closing_depth=None):
+        """
+        update state from the characters of text
+        if closing_depth is not None, stop and return the index of
+        the closing bracket which reduces nesting to closing_depth
+        otherwise return None
+        """
+        self.continued = False
+        index = 0
+        while index < len(text):
+            if self.quote:
+                match = self.STRING_END[self.quote].search(text, index)
+                if not match:
+                    return None
+                index = match.end()
+                if match.group() in [self.quote, "\n"]:
+                    self.quote = None
+                continue
+            match = self.SPECIAL_CHARACTERS.search(text, index)
+            if not match:
+                return None
+            character = match.group()
+            index = match.end()
+            if character in "[({":
+                self.depth += 1
+            elif character in "])}":
+                self.depth -= 1
+                if self.depth == closing_depth:
+                    return match.start()
+            elif character == "#":
+                index = text.find("\n", index)
+                if index < 0:
+                    return None
+            elif character == "\\":
+                if text[index : index + 1] in ["", "\n"]:
+                    self.continued = True
+                index += 1
+            else:
+                self.quote = character
+        return None
+
+    def is_complete(self):
+        """
+        return True unless the text scanned so far ends
+        inside a triple-quoted string, brackets or with a line continuation
+        """
+        return not self.quote and self.depth <= 0 and not self.continued
+
+
 def parse_literals(combined_lines, parameters, debug=0):
     """
     parse 1 or more lines into literals
@@ -330,8 +445,8 @@ def parse_literals(combined_lines, parameters, debug=0):
                 f"{token.start[1]}: syntax error in assignment"
             )
 
-        # chop up string in reverse  attempting to find something
-        # that parses as a Python literal list or dict - ugly and brittle
+        # find the end of a Python literal list or dict
+        # if the matching bracket doesn't work, try every closing bracket - ugly and brittle
         if (
             token.string in "[{"
             and literals
@@ -346,6 +461,20 @@ def parse_literals(combined_lines, parameters, debug=0):
             if debug > 3:
                 print(f"list/dict parsing remaining_lines={repr(remaining_lines)}")
                 print(token)
+            # the matching bracket is almost always the end of the literal
+            end = LiteralScanner().scan(remaining_lines, closing_depth=0)
+            if end is not None and remaining_lines[end] == closing_ch:
+                try:
+                    literal = ast.literal_eval(remaining_lines[: end + 1])
+                    return (
+                        literals
+                        + [literal]
+                        + parse_literals(
+                            remaining_lines[end + 1 :], parameters, debug=debug
+                        )
+                    )
+                except (ValueError, SyntaxError):
+                    pass
             for end in range(len(remaining_lines)):
                 if remaining_lines[end] == closing_ch:
                     try:
@@ -1,7 +1,13 @@
+import io
+import json
+import os
 import pytest
 import subprocess
 import re
+import shutil
 import sys
+import tarfile
+import zipfile
 
 
 # created from at's original test script (yes this script needs to be thrown into a fire)
@@ -339,3 +345,776 @@ class TestStandard:
         if not p.stdout != re.search(r" tests passed 0 tests failed *$", p.stdout):
             print(p.stdout)
             assert False
+
+    def test_parallel(self):
+        test_folder = "tests/parallel"
+        outputs = []
+        for jobs in ["1", "4"]:
+            p = subprocess.run(
+                args=[
+                    sys.executable,
+                    "./autotest.py",
+                    "-D",
+                    test_folder,
+                    "-a",
+                    f"{test_folder}/autotest",
+                    "--jobs",
+                    jobs,
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=10,
+                encoding="utf-8",
+            )
+            outputs.append(p.stdout)
+        # results must be printed in the same order whether or not tests are run in parallel
+        if outputs[0] != outputs[1] or not re.search(
+            r"Test 4 \(./echo.sh a\) - failed \(Incorrect output - same as Test 3\)\n.*5 tests passed 2 tests failed",
+            outputs[1],
+            flags=re.S,
+        ):
+            print(outputs[0])
+            print(outputs[1])
+            assert False
+
+    def test_compilation_cache(self, tmp_path):
+        test_folder = "tests/compilation_cache"
+        outputs = []
+        for _ in range(2):
+            p = subprocess.run(
+                args=[
+                    sys.executable,
+                    "./autotest.py",
+                    "-D",
+                    test_folder,
+                    "-a",
+                    f"{test_folder}/autotest",
+                    "--parameters",
+                    f"compilation_cache_directory={tmp_path}",
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=10,
+                encoding="utf-8",
+            )
+            outputs.append(p.stdout)
+        # second run uses cached binaries but must produce the same output, including compiler warnings
+        if outputs[0] != outputs[1] or not re.search(
+            r"unused variable.*2 tests passed 0 tests failed *$", outputs[1], flags=re.S
+        ):
+            print(outputs[0])
+            print(outputs[1])
+            assert False
+        assert len([p for p in tmp_path.iterdir() if p.is_dir()]) == 2
+
+    def test_batch(self, tmp_path):
+        test_folder = "tests/batch"
+        results_file = tmp_path / "results.json"
+        p = subprocess.run(
+            args=[
+                sys.executable,
+                "./autotest.py",
+                "-a",
+                f"{test_folder}/autotest",
+                "--batch",
+                f"{test_folder}/manifest.jsonl",
+                "--jobs",
+                "2",
+                "--json_results",
+                str(results_file),
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=10,
+            encoding="utf-8",
+        )
+        results = dict(
+            (r["submission"], r) for r in map(json.loads, p.stdout.splitlines())
+        )
+        if (
+            p.returncode != 2
+            or results["tests/batch/correct"]["tests"] != {"1": True, "2": True}
+            or results["incorrect"]["tests"] != {"1": True, "2": False}
+            or results["incorrect"]["exit_status"] != 1
+            or results["missing"]["exit_status"] != 2
+            or "2 tests passed 0 tests failed"
+            not in results["tests/batch/correct"]["output"]
+        ):
+            print(p.stdout)
+            assert False
+        # events of submissions tested concurrently are labelled with their submission
+        events = [json.loads(line) for line in results_file.read_text().splitlines()]
+        statuses = set(
+            (e["submission"], e.get("label"), e.get("status")) for e in events
+        )
+        if statuses != {
+            ("tests/batch/correct", "1", "passed"),
+            ("tests/batch/correct", "2", "passed"),
+            ("tests/batch/correct", None, None),
+            ("incorrect", "1", "passed"),
+            ("incorrect", "2", "failed"),
+            ("incorrect", None, None),
+        }:
+            print(events)
+            assert False
+
+    def test_sandbox_pool(self):
+        test_folder = "tests/sandbox_pool"
+        p = subprocess.run(
+            args=[
+                sys.executable,
+                "./autotest.py",
+                "-a",
+                f"{test_folder}/autotest",
+                "--batch",
+                f"{test_folder}/manifest.jsonl",
+                "--jobs",
+                "2",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=20,
+            encoding="utf-8",
+        )
+        # each forked sandbox has its own PID namespace,
+        # so only one process running the sandbox server is visible to its tests
+        results = dict(
+            (r["submission"], r) for r in map(json.loads, p.stdout.splitlines())
+        )
+        if p.returncode != 0 or any(
+            results[s]["exit_status"] != 0 for s in ["first", "second"]
+        ):
+            print(p.stdout)
+            assert False
+
+    def test_batch_archives(self, tmp_path):
+        test_folder = "tests/batch"
+        submission = f"{test_folder}/correct/hello.sh"
+        with tarfile.open(tmp_path / "correct.tar.xz", "w:xz") as t:
+            t.add(submission, arcname="hello.sh")
+        with zipfile.ZipFile(tmp_path / "correct.zip", "w") as z:
+            z.write(submission, arcname="hello.sh")
+        with tarfile.open(tmp_path / "unsafe.tar", "w") as t:
+            member = tarfile.TarInfo("../hello.sh")
+            member.size = 1
+            t.addfile(member, io.BytesIO(b"x"))
+        manifest = tmp_path / "manifest.txt"
+        names = ["correct.tar.xz", "correct.zip", "unsafe.tar"]
+        manifest.write_text("".join(f"{tmp_path}/{name}\n" for name in names))
+        p = subprocess.run(
+            args=[
+                sys.executable,
+                "./autotest.py",
+                "-a",
+                f"{test_folder}/autotest",
+                "--batch",
+                str(manifest),
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=10,
+            encoding="utf-8",
+        )
+        results = dict(
+            (r["submission"], r) for r in map(json.loads, p.stdout.splitlines())
+        )
+        # pathnames outside the test directory must not be extracted
+        if (
+            results[f"{tmp_path}/correct.tar.xz"]["exit_status"] != 0
+            or results[f"{tmp_path}/correct.zip"]["exit_status"] != 0
+            or "invalid pathname" not in results[f"{tmp_path}/unsafe.tar"]["output"]
+        ):
+            print(p.stdout)
+            assert False
+
+    def test_test_specification_cache(self, tmp_path):
+        test_folder = tmp_path / "test_specification_cache"
+        shutil.copytree("tests/test_specification_cache", test_folder)
+        outputs = []
+        for stdin in ["a\n", "a\n", "c\n"]:
+            (test_folder / "autotest" / "1.stdin").write_text(stdin)
+            p = subprocess.run(
+                args=[
+                    sys.executable,
+                    "./autotest.py",
+                    "-D",
+                    test_folder,
+                    "-a",
+                    test_folder / "autotest",
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=10,
+                encoding="utf-8",
+            )
+            outputs.append(p.stdout)
+        assert (test_folder / "autotest" / ".tests.txt.autotest_cache").exists()
+        # the cache must not be used after a file referred to by the specification changes
+        if (
+            outputs[0] != outputs[1]
+            or not re.search(r"2 tests passed 0 tests failed *$", outputs[1])
+            or not re.search(r"1 tests passed 1 tests failed *$", outputs[2])
+        ):
+            print(outputs)
+            assert False
+
+    def test_test_specification_cache_environment(self, tmp_path):
+        test_folder = tmp_path / "test_specification_cache"
+        shutil.copytree("tests/test_specification_cache", test_folder)
+        specification = test_folder / "autotest" / "tests.txt"
+        cache = test_folder / "autotest" / ".tests.txt.autotest_cache"
+        with open(specification, "a", encoding="utf-8") as f:
+            f.write(
+                '3 command="echo $ANSWER" environment_kept=ANSWER expected_stdout="b\\n"\n'
+            )
+
+        def run_autotest(answer):
+            return subprocess.run(
+                args=[
+                    sys.executable,
+                    "./autotest.py",
+                    "-D",
+                    test_folder,
+                    "-a",
+                    test_folder / "autotest",
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=10,
+                encoding="utf-8",
+                env=dict(os.environ, ANSWER=answer),
+            ).stdout
+
+        outputs = [run_autotest("b")]
+        cache_inode = cache.stat().st_ino
+        # the cache is shared between environments and environment is recalculated
+        outputs.append(run_autotest("c"))
+        cache_reused = cache.stat().st_ino == cache_inode
+        # a cache other users can write is not loaded
+        cache.chmod(0o666)
+        outputs.append(run_autotest("b"))
+        if (
+            not cache_reused
+            or cache.stat().st_ino == cache_inode
+            or not re.search(r"3 tests passed 0 tests failed *$", outputs[0])
+            or not re.search(r"2 tests passed 1 tests failed *$", outputs[1])
+            or not re.search(r"3 tests passed 0 tests failed *$", outputs[2])
+        ):
+            print(outputs)
+            assert False
+
+    def test_fail_fast_on_mismatch(self):
+        test_folder = "tests/fail_fast_on_mismatch"
+        p = subprocess.run(
+            args=[
+                sys.executable,
+                "./autotest.py",
+                "-D",
+                test_folder,
+                "-a",
+                f"{test_folder}/autotest",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=10,
+            encoding="utf-8",
+        )
+        # programs printing 100000000 lines must be stopped once their output is incorrect
+        if (
+            p.stdout.count("failed (Incorrect output)") != 3
+            or p.stdout.count("stopped soon after its output became incorrect") != 3
+            or not re.search(r"1 tests passed 3 tests failed *$", p.stdout)
+        ):
+            print(p.stdout)
+            assert False
+
+    def test_long_output_diff(self):
+        test_folder = "tests/long_output_diff"
+        p = subprocess.run(
+            args=[
+                sys.executable,
+                "./autotest.py",
+                "-D",
+                test_folder,
+                "-a",
+                f"{test_folder}/autotest",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=10,
+            encoding="utf-8",
+        )
+        # differences more than 128 lines apart must both be shown
+        if not re.search(
+            r"\n\+ 10\n.*\n- 900 changed\n\+ 900\n.*0 tests passed 1 tests failed",
+            p.stdout,
+            flags=re.S,
+        ):
+            print(p.stdout)
+            assert False
+
+    def test_summary_only(self):
+        test_folder = "tests/parallel"
+        p = subprocess.run(
+            args=[
+                sys.executable,
+                "./autotest.py",
+                "-D",
+                test_folder,
+                "-a",
+                f"{test_folder}/autotest",
+                "--summary_only",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=10,
+            encoding="utf-8",
+        )
+        # failures are reported without explaining them
+        if "Your program produced" in p.stdout or not re.search(
+            r"Test 4 \(./echo.sh a\) - failed \(Incorrect output\)\n.*5 tests passed 2 tests failed",
+            p.stdout,
+            flags=re.S,
+        ):
+            print(p.stdout)
+            assert False
+
+    def test_postprocess_coprocess(self):
+        test_folder = "tests/postprocess_coprocess"
+        p = subprocess.run(
+            args=[
+                sys.executable,
+                "./autotest.py",
+                "-D",
+                test_folder,
+                "-a",
+                f"{test_folder}/autotest",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=10,
+            encoding="utf-8",
+        )
+        # tests with different environments must not share a co-process,
+        # and a command echoing lines of input must not stall as a co-process
+        expected_stdout = (
+            "bash -n echo.sh\n"
+            "Test a (echo.sh z) - passed\n"
+            "Test b (echo.sh z) - passed\n"
+            "Test c (echo.sh z) - passed\n"
+            "Test d (echo.sh z) - passed\n"
+            "Test e (echo.sh z) - passed\n"
+            "5 tests passed 0 tests failed \n"
+        )
+        assert p.stdout == expected_stdout
+
+    def test_postprocess_coprocess_unsupported_parallel(self):
+        test_folder = "tests/postprocess_coprocess"
+        p = subprocess.run(
+            args=[
+                sys.executable,
+                "./autotest.py",
+                "-D",
+                test_folder,
+                "-a",
+                f"{test_folder}/autotest",
+                "--jobs",
+                "2",
+                "--debug",
+                "c",
+                "d",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=10,
+            encoding="utf-8",
+        )
+        # the handshake is done before forking, not repeated by each pool process
+        if (
+            "2 tests passed 0 tests failed" not in p.stdout
+            or p.stdout.count("not run as co-process") != 1
+        ):
+            print(p.stdout)
+            assert False
+
+    def test_json_results(self, tmp_path):
+        test_folder = "tests/parallel"
+        results_file = tmp_path / "results.json"
+        subprocess.run(
+            args=[
+                sys.executable,
+                "./autotest.py",
+                "-D",
+                test_folder,
+                "-a",
+                f"{test_folder}/autotest",
+                "--json_results",
+                str(results_file),
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=10,
+            encoding="utf-8",
+        )
+        events = [json.loads(line) for line in results_file.read_text().splitlines()]
+        statuses = [(e.get("label"), e.get("status")) for e in events]
+        assert statuses[0:4] == [
+            ("1", "passed"),
+            ("2", "passed"),
+            ("3", "failed"),
+            ("4", "failed"),
+        ]
+        assert events[2]["short_explanation"] == "Incorrect output"
+        assert events[2]["stdout_bytes"] == 2
+        # memory use is measured for each test, not only when it exceeds earlier tests
+        assert all(isinstance(e["rusage"]["max_rss_bytes"], int) for e in events[:-1])
+        assert events[-1] == {
+            "event": "summary",
+            "passed": 5,
+            "failed": 2,
+            "not_run": 0,
+            "unchanged": 0,
+            "skipped": 0,
+        }
+
+    def test_max_cpu_ratio(self):
+        test_folder = "tests/max_cpu_ratio"
+        p = subprocess.run(
+            args=[
+                sys.executable,
+                "./autotest.py",
+                "-D",
+                test_folder,
+                "-a",
+                f"{test_folder}/autotest",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=20,
+            encoding="utf-8",
+        )
+        # correct output is not enough if too much CPU time is used
+        if not re.search(
+            r"Test fast .* - passed\n.*Test slow .* - failed \(Too slow\)\n.*1 tests passed 1 tests failed",
+            p.stdout,
+            flags=re.S,
+        ):
+            print(p.stdout)
+            assert False
+
+    def test_cgroup_fallback(self, tmp_path):
+        test_folder = "tests/cgroup_fallback"
+        # a directory which is not in a cgroup file system can not be used,
+        # so tests are run with only setrlimit limits
+        p = subprocess.run(
+            args=[
+                sys.executable,
+                "./autotest.py",
+                "-D",
+                test_folder,
+                "-a",
+                f"{test_folder}/autotest",
+                "--parameters",
+                f"cgroup_directory={tmp_path}",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=20,
+            encoding="utf-8",
+        )
+        if (
+            "Test once (spin.sh once) - passed" not in p.stdout
+            or "CPU limit of 1 seconds exceeded" not in p.stdout
+            or "1 tests passed 1 tests failed" not in p.stdout
+            or list(tmp_path.iterdir())
+        ):
+            print(p.stdout)
+            assert False
+
+    def test_isolate_tests(self):
+        test_folder = "tests/isolate_tests"
+        p = subprocess.run(
+            args=[
+                sys.executable,
+                "./autotest.py",
+                "-D",
+                test_folder,
+                "-a",
+                f"{test_folder}/autotest",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=10,
+            encoding="utf-8",
+        )
+        # files created by one test must not be seen by the next
+        if "3 tests passed 0 tests failed" not in p.stdout:
+            print(p.stdout)
+            assert False
+
+    def test_supplied_files_cache(self, tmp_path):
+        test_folder = "tests/supplied_files_cache"
+        outputs = []
+        for run in range(3):
+            if run == 2:
+                # a cached copy changed by a test is not used again,
+                # even if its size, mode and modification time are unchanged
+                for cached_copy in tmp_path.glob("*.sha256"):
+                    copy = cached_copy.with_suffix("")
+                    s = copy.stat()
+                    copy.chmod(0o644)
+                    copy.write_text(copy.read_text().upper())
+                    copy.chmod(s.st_mode)
+                    os.utime(copy, ns=(s.st_atime_ns, s.st_mtime_ns))
+            p = subprocess.run(
+                args=[
+                    sys.executable,
+                    "./autotest.py",
+                    "-D",
+                    test_folder,
+                    "-a",
+                    f"{test_folder}/autotest",
+                    "--parameters",
+                    f"supplied_files_cache_directory={tmp_path}",
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=10,
+                encoding="utf-8",
+            )
+            outputs.append(p.stdout)
+        # later runs hard link the cached copies of supplied files
+        if (
+            outputs[0] != outputs[1]
+            or outputs[0] != outputs[2]
+            or "2 tests passed 0 tests failed" not in outputs[1]
+        ):
+            print("\n".join(outputs))
+            assert False
+        cached_copies = [p for p in tmp_path.iterdir() if p.suffix != ".sha256"]
+        assert len(cached_copies) == 2
+        assert all(not p.stat().st_mode & 0o222 for p in cached_copies)
+
+    def test_result_cache(self, tmp_path):
+        test_folder = "tests/result_cache"
+        submission_folder = tmp_path / "submission"
+        submission_folder.mkdir()
+        shutil.copy2(f"{test_folder}/hello.sh", submission_folder)
+
+        def run_autotest(*extra_args):
+            return subprocess.run(
+                args=[
+                    sys.executable,
+                    "./autotest.py",
+                    "-D",
+                    str(submission_folder),
+                    "-a",
+                    f"{test_folder}/autotest",
+                    "--parameters",
+                    f"result_cache_directory={tmp_path / 'cache'}",
+                    *extra_args,
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=10,
+                encoding="utf-8",
+            ).stdout
+
+        outputs = [run_autotest(), run_autotest(), run_autotest("--changed_only")]
+        # results of tests are replayed until the submission changes
+        with open(submission_folder / "hello.sh", "a", encoding="utf-8") as f:
+            f.write("echo extra\n")
+        outputs.append(run_autotest("--changed_only"))
+        if (
+            outputs[0] != outputs[1]
+            or "1 tests passed 1 tests failed" not in outputs[1]
+            or "hello everyone" not in outputs[1]
+            # cached failures are still reported with --changed_only
+            or "0 tests passed 1 tests failed 1 tests unchanged" not in outputs[2]
+            or "hello everyone" not in outputs[2]
+            or "0 tests passed 2 tests failed" not in outputs[3]
+        ):
+            print("\n".join(outputs))
+            assert False
+
+    def test_result_cache_data_file(self, tmp_path):
+        test_folder = "tests/result_cache_data"
+        submission_folder = tmp_path / "submission"
+        shutil.copytree(
+            test_folder, submission_folder, ignore=shutil.ignore_patterns("autotest")
+        )
+
+        def run_autotest(*extra_args):
+            return subprocess.run(
+                args=[
+                    sys.executable,
+                    "./autotest.py",
+                    "-D",
+                    str(submission_folder),
+                    "-a",
+                    f"{test_folder}/autotest",
+                    "--parameters",
+                    f"result_cache_directory={tmp_path / 'cache'}",
+                    *extra_args,
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=10,
+                encoding="utf-8",
+            ).stdout
+
+        outputs = [run_autotest()]
+        # names.txt is listed only by test names but read by test greet's command
+        (submission_folder / "names.txt").write_text("bob\n")
+        outputs.append(run_autotest("--changed_only"))
+        if (
+            "2 tests passed 0 tests failed" not in outputs[0]
+            or "0 tests passed 2 tests failed" not in outputs[1]
+            or "hello bob" not in outputs[1]
+        ):
+            print("\n".join(outputs))
+            assert False
+
+    def test_result_cache_files(self, tmp_path):
+        test_folder = "tests/result_cache_files"
+        outputs = []
+        for extra_args in [[], [], ["--changed_only"]]:
+            p = subprocess.run(
+                args=[
+                    sys.executable,
+                    "./autotest.py",
+                    "-D",
+                    test_folder,
+                    "-a",
+                    f"{test_folder}/autotest",
+                    "--parameters",
+                    f"result_cache_directory={tmp_path / 'cache'}",
+                    *extra_args,
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=10,
+                encoding="utf-8",
+            )
+            outputs.append(p.stdout)
+        # test 2 can only be replayed if test 1, which writes its file, is too
+        if (
+            "2 tests passed 0 tests failed" not in outputs[0]
+            or outputs[1] != outputs[0]
+            or not outputs[2].endswith(
+                "0 tests passed 0 tests failed  2 tests unchanged\n"
+            )
+        ):
+            print("\n".join(outputs))
+            assert False
+
+    def test_result_cache_compiled(self, tmp_path):
+        test_folder = "tests/result_cache_compiled"
+        outputs = []
+        for _ in range(2):
+            p = subprocess.run(
+                args=[
+                    sys.executable,
+                    "./autotest.py",
+                    "-D",
+                    test_folder,
+                    "-a",
+                    f"{test_folder}/autotest",
+                    "--parameters",
+                    f"result_cache_directory={tmp_path / 'cache'}",
+                    "--changed_only",
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=10,
+                encoding="utf-8",
+            )
+            outputs.append(p.stdout)
+        # binaries built in different directories differ but the result is cached
+        cache_entries = [e for e in (tmp_path / "cache").iterdir() if e.name != "lock"]
+        if (
+            "1 tests passed 0 tests failed" not in outputs[0]
+            or not outputs[1].endswith(
+                "0 tests passed 0 tests failed  1 tests unchanged\n"
+            )
+            or len(cache_entries) != 1
+        ):
+            print("\n".join(outputs))
+            assert False
+
+    def test_dependencies(self):
+        test_folder = "tests/dependencies"
+        # files are found in the current directory, so headers included
+        # by headers must be found by following includes
+        p = subprocess.run(
+            args=[sys.executable, "../../autotest.py", "-a", "autotest"],
+            cwd=test_folder,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=10,
+            encoding="utf-8",
+        )
+        if "1 tests passed 0 tests failed" not in p.stdout:
+            print(p.stdout)
+            assert False
+
+    def test_order(self, tmp_path):
+        test_folder = "tests/test_order"
+
+        def run_autotest(*extra_args):
+            return subprocess.run(
+                args=[
+                    sys.executable,
+                    "./autotest.py",
+                    "-D",
+                    test_folder,
+                    "-a",
+                    f"{test_folder}/autotest",
+                    "--parameters",
+                    f"test_statistics_file={tmp_path / 'statistics.json'}",
+                    "--summary_only",
+                    *extra_args,
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=10,
+                encoding="utf-8",
+            ).stdout
+
+        outputs = [
+            run_autotest("--fail_fast"),
+            run_autotest("--order", "most_likely_to_fail", "--fail_fast"),
+        ]
+        # test 2 failed previously so it is run first
+        reordered = re.search(
+            r"^Test 2 .*\n0 tests passed 1 tests failed 2 tests skipped",
+            outputs[1],
+            flags=re.M,
+        )
+        if (
+            "1 tests passed 1 tests failed 1 tests skipped" not in outputs[0]
+            or not reordered
+        ):
+            print("\n".join(outputs))
+            assert False
+
+    def test_deduplicate_executions(self):
+        test_folder = "tests/deduplicate_executions"
+        p = subprocess.run(
+            args=[
+                sys.executable,
+                "./autotest.py",
+                "-D",
+                test_folder,
+                "-a",
+                f"{test_folder}/autotest",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=10,
+            encoding="utf-8",
+        )
+        # the program is run once for tests 1-3, and again for test 4
+        if "4 tests passed 0 tests failed" not in p.stdout:
+            print(p.stdout)
+            assert False
@@ -0,0 +1,219 @@
+# cache of test results shared between autotest invocations
+#
+# results are stored in a file named by a hash of the test's parameters,
+# which include its environment, and the contents of the test directory,
+# which include the files tested and supplied files,
+# so a test is only run again if something which could change its result changes
+#
+# source files which only other tests depend on are excluded from the hash,
+# as are compiled binaries, which may differ between identical compilations,
+# e.g. debug information includes the build directory,
+# instead the identity of the compiler is included
+#
+# the hash is calculated before any test is run, tests which may depend on
+# files written by earlier tests include the hashes of those tests
+#
+# tests are assumed to be deterministic,
+# results of tests depending on, e.g., the time of day should not be cached
+#
+# several autotest processes may use the cache at the same time
+# entries are written to a temporary file then renamed into place
+
+import fcntl, hashlib, json, os, sys, tempfile
+from compilation_cache import compiler_identity
+
+CACHE_FORMAT_VERSION = "2"
+LOCK_NAME = "lock"
+
+# parameters which can not change the result of a test
+IGNORED_PARAMETERS = {
+    "debug",
+    "compilation_cache_directory",
+    "compilation_cache_max_bytes",
+    "result_cache_directory",
+    "result_cache_max_bytes",
+    "supplied_files_cache_directory",
+}
+
+# attributes of a failed execution needed to report it
+EXECUTION_ATTRIBUTES = [
+    "short_explanation",
+    "long_explanation",
+    "returncode",
+    "stdout_bytes",
+    "stderr_bytes",
+    "rusage",
+    "stdout",
+    "stderr",
+]
+
+
+class CachedExecution:
+    """
+    failed execution of a test recreated from the cache,
+    with only the attributes needed to report it
+    """
+
+    def __init__(self, attributes):
+        self.__dict__.update(attributes)
+
+    def get_long_explanation(self):
+        return self.long_explanation
+
+
+def test_result_key(
+    parameters, directory=".", unrelated_files=(), compiled_files=(), earlier_keys=()
+):
+    """
+    return a hash of everything which determines the result of a test,
+    unrelated_files are pathnames relative to directory not used by the test,
+    compiled_files are pathnames relative to directory of binaries built for the test,
+    earlier_keys are the keys of earlier tests whose files the test may use
+    """
+    h = hashlib.sha256()
+    h.update(CACHE_FORMAT_VERSION.encode())
+    # parameters starting with _ are internal, e.g. the original environment
+    # the environment used for the test is in the parameter environment
+    relevant_parameters = sorted(
+        (name, value)
+        for (name, value) in parameters.items()
+        if not name.startswith("_") and name not in IGNORED_PARAMETERS
+    )
+    h.update(repr(relevant_parameters).encode())
+    for compile_command in parameters.get("compile_commands") or []:
+        h.update(compiler_identity(compile_command).encode() + b"\0")
+    for key in earlier_keys:
+        h.update(key.encode())
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        # symlinks to directories are listed in dirs but not followed
+        links = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+        for name in sorted(files + links):
+            pathname = os.path.join(root, name)
+            relative_pathname = os.path.relpath(pathname, directory)
+            if (
+                relative_pathname in unrelated_files
+                or relative_pathname in compiled_files
+            ):
+                continue
+            h.update(relative_pathname.encode() + b"\0")
+            h.update(file_hash(pathname))
+    return h.hexdigest()
+
+
+def file_hash(
+    pathname,
+    # pylint: disable=dangerous-default-value
+    cache={},
+):
+    """
+    return a hash of the contents of pathname, or of its target if it is a symlink
+    hashes are cached until the file's inode, size or modification time changes
+    """
+    try:
+        if os.path.islink(pathname):
+            return b"->" + os.readlink(pathname).encode()
+        s = os.stat(pathname)
+        file_id = (pathname, s.st_ino, s.st_size, s.st_mtime_ns)
+        if file_id not in cache:
+            h = hashlib.sha256()
+            with open(pathname, "rb") as f:
+                for data in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(data)
+            cache[file_id] = h.digest()
+        return cache[file_id]
+    except OSError:
+        return b"\0"
+
+
+def fetch_test_result(cache_directory, key, explain=True, debug=0):
+    """
+    return (True, failed_execution) if the result of test with key is in the cache,
+    failed_execution is a CachedExecution or None if the test passed,
+    return (False, None) if the result is not in the cache
+    or if explain is set and the cached failure has no explanation
+    """
+    pathname = os.path.join(cache_directory, key)
+    try:
+        with open(pathname, encoding="utf-8") as f:
+            entry = json.load(f)
+        failed_execution = entry["failed_execution"]
+        if failed_execution and explain:
+            if failed_execution["long_explanation"] is None:
+                raise ValueError("explanation not cached")
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        if debug > 1:
+            print(f"result cache miss for {key}: {e}", file=sys.stderr)
+        return (False, None)
+    if debug > 1:
+        print(f"result cache hit for {key}", file=sys.stderr)
+    try:
+        # record use for least-recently-used eviction
+        os.utime(pathname)
+    except OSError:
+        pass
+    if failed_execution:
+        return (True, CachedExecution(failed_execution))
+    return (True, None)
+
+
+def store_test_result(cache_directory, key, failed_execution, explain=True, debug=0):
+    """
+    add the result of a test to the cache, failed_execution is None if the test passed
+    the explanation of a failure is only stored if explain is set
+    failures are ignored, the cache is only an optimization
+    """
+    entry = {"failed_execution": None}
+    if failed_execution:
+        entry["failed_execution"] = dict(
+            (attribute, getattr(failed_execution, attribute, None))
+            for attribute in EXECUTION_ATTRIBUTES
+        )
+        entry["failed_execution"]["long_explanation"] = (
+            failed_execution.get_long_explanation() if explain else None
+        )
+    try:
+        os.makedirs(cache_directory, 0o700, exist_ok=True)
+        fd, temp_pathname = tempfile.mkstemp(prefix=".tmp-", dir=cache_directory)
+    except OSError as e:
+        if debug:
+            print(f"result cache not available: {e}", file=sys.stderr)
+        return
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        # rename is atomic so other processes never see a partial entry
+        os.rename(temp_pathname, os.path.join(cache_directory, key))
+    except (OSError, TypeError, ValueError) as e:
+        if debug > 1:
+            print(f"result cache store failed for {key}: {e}", file=sys.stderr)
+        os.unlink(temp_pathname)
+
+
+def evict_test_results(cache_directory, max_bytes, debug=0):
+    """
+    remove least recently used entries until the cache is smaller than max_bytes,
+    entries are small so this is done once for all the tests run, not for each entry
+    """
+    try:
+        with open(os.path.join(cache_directory, LOCK_NAME), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = []
+            total_bytes = 0
+            for name in os.listdir(cache_directory):
+                if name == LOCK_NAME or name.startswith(".tmp-"):
+                    continue
+                entry = os.path.join(cache_directory, name)
+                s = os.stat(entry)
+                entries.append((s.st_mtime, s.st_size, entry))
+                total_bytes += s.st_size
+            for _mtime, n_bytes, entry in sorted(entries):
+                if total_bytes <= max_bytes:
+                    break
+                if debug > 1:
+                    print(f"result cache evicting {entry}", file=sys.stderr)
+                os.unlink(entry)
+                total_bytes -= n_bytes
+    except OSError as e:
+        if debug:
+            print(f"result cache eviction failed: {e}", file=sys.stderr)
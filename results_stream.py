@@ -0,0 +1,96 @@
+# stream of machine-readable test results
+#
+# a line of JSON is written for each test as soon as its result is known,
+# followed by a line summarizing the run,
+# so results can be consumed while tests are still running
+#
+# in batch mode the results of several submissions are interleaved in one stream,
+# so each event includes the submission's id
+
+import json, os, re
+
+
+class ResultsStream:
+    """
+    file results are written to,
+    if submission is set it is included in every event
+    """
+
+    def __init__(self, file, submission=None):
+        self.file = file
+        self.submission = submission
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def open_results_stream(destination, submission=None):
+    """
+    return a ResultsStream for writing results to destination,
+    which is either a pathname, appended to, or fd:N for inherited file descriptor N
+    """
+    m = re.fullmatch(r"fd:(\d+)", destination)
+    if m:
+        f = os.fdopen(int(m.group(1)), "w", encoding="utf-8", closefd=False)
+    else:
+        # pylint: disable=consider-using-with
+        f = open(destination, "a", encoding="utf-8")
+    return ResultsStream(f, submission=submission)
+
+
+def write_result(stream, test, reported_test, status):
+    """
+    write a line describing result of test,
+    reported_test is the failed execution being reported, if any
+    status is one of "passed", "failed" or "not_run"
+    """
+    if stream is None:
+        return
+    execution = reported_test or test
+    short_explanation = reported_test.short_explanation if reported_test else None
+    event = {
+        "event": "test",
+        "label": test.label,
+        "status": status,
+        "short_explanation": short_explanation,
+        "compile_seconds": round(test.compile_seconds, 6),
+        "run_seconds": round(test.run_seconds, 6),
+        "compare_seconds": round(test.compare_seconds, 6),
+        "exit_status": execution.returncode,
+        "stdout_bytes": execution.stdout_bytes,
+        "stderr_bytes": execution.stderr_bytes,
+        "rusage": execution.rusage,
+    }
+    write_event(stream, event)
+
+
+def write_summary(stream, n_passed, n_failed, n_not_run, n_unchanged=0, n_skipped=0):
+    """
+    write a line with the number of tests with each result,
+    unchanged tests have passing results in the result cache and were not reported,
+    skipped tests were not run because of an earlier failure
+    """
+    if stream is None:
+        return
+    write_event(
+        stream,
+        {
+            "event": "summary",
+            "passed": n_passed,
+            "failed": n_failed,
+            "not_run": n_not_run,
+            "unchanged": n_unchanged,
+            "skipped": n_skipped,
+        },
+    )
+
+
+def write_event(stream, event):
+    if stream.submission is not None:
+        event = {"submission": stream.submission, **event}
+    # each event is written & flushed as a single line so readers never see part of an event
+    stream.file.write(json.dumps(event) + "\n")
+    stream.file.flush()
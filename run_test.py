@@ -3,11 +3,62 @@
 # This code needs extensive rewriting.
 # Much of the code can be moved to parameter_descriptions.py
 
-import codecs, os, re, shlex, subprocess, time
+import atexit, codecs, os, re, selectors, shlex, subprocess, sys, time
 from subprocess_with_resource_limits import run
 from explain_output_differences import explain_output_differences, sanitize_string
+from output_comparator import OutputComparator
 from termcolor import colored as termcolor_colored
 
+LINE_ENDING = re.compile("\r\n?")
+BLANK_LINES = re.compile(r"\n\s*\n")
+LEADING_NEWLINES = re.compile(r"^\n+")
+TRAILING_WHITESPACE = re.compile(r"[ \t]+\n")
+
+# record sent first to a postprocess_output_command co-process,
+# it does not end with a newline so commands which echo lines of input can not answer it
+COPROCESS_PROBE = b"autotest co-process probe"
+# seconds to wait for any response to only the length of the probe record,
+# which a co-process should not answer but a command echoing its input will
+COPROCESS_ECHO_SECONDS = 0.1
+# seconds a postprocess_output_command co-process has to answer the probe record
+COPROCESS_HANDSHAKE_SECONDS = 2
+# seconds a postprocess_output_command co-process has to answer other records
+COPROCESS_TIMEOUT_SECONDS = 30
+
+# parameters which affect only how the output of a test is checked & reported,
+# tests differing only in these share one execution of the program
+CHECKING_PARAMETERS = {
+    "allow_unexpected_stderr",
+    "colorize_output",
+    "compare_only_characters",
+    "debug",
+    "description",
+    "expected_stderr",
+    "expected_stderr_file",
+    "expected_stdout",
+    "expected_stdout_file",
+    "fail_fast_on_mismatch",
+    "ignore_blank_lines",
+    "ignore_case",
+    "ignore_characters",
+    "ignore_trailing_whitespace",
+    "ignore_whitespace",
+    "label",
+    "max_cpu_ratio",
+    "max_line_length_shown",
+    "max_lines_diffed",
+    "max_lines_shown",
+    "no_replace_semicolon_reproduce_command",
+    "reference_cpu_seconds",
+    "show_actual_output",
+    "show_all_lines",
+    "show_diff",
+    "show_expected_output",
+    "show_reproduce_command",
+    "show_stdin",
+    "show_stdout_if_errors",
+}
+
 
 class InternalError(Exception):
     pass
@@ -41,32 +92,57 @@ class _Test:
         self.parameters = parameters
         self.program = parameters["program"]
         self.stdin = parameters["stdin"]
+        # canonical forms of expected outputs, shared with copies of this test
+        self.canonical_expected = {}
 
         self.test_passed = None
+        self.returncode = None
+        self.stdout_bytes = None
+        self.stderr_bytes = None
+        self.rusage = None
+        # seconds spent compiling, running & checking the output of this test
+        self.compile_seconds = 0.0
+        self.run_seconds = 0.0
+        self.compare_seconds = 0.0
+        # files other tests depend on but this test does not, set by run_tests
+        self.unrelated_files = set()
 
     def __str__(self):
         return f"Test({self.label}, {self.program}, {self.command})"
 
-    def run_test(self, compile_command=""):
+    def run_test(self, compile_command="", executions=None):
+        """
+        run the test & check its output,
+        executions, if not None, holds the output of previous executions,
+        which is reused by tests differing only in how output is checked
+        """
         if self.debug > 1:
             print(
                 f'run_test(compile_command="{compile_command}", command="{self.command}")\n'
             )
 
-        self.set_environ()
-
-        for attempt in range(3):
-            if self.debug > 1:
-                print("run_test attempt", attempt)
-            (stdout, stderr, self.returncode) = run(**self.parameters)
-            if stdout or stderr or self.returncode == 0 or not self.expected_stdout:
-                break
-            if self.debug > 1:
-                print("run_test retry", (stdout, stderr, self.returncode))
-            # ugly work-around for
-            # weird termination with non-zero exit status seen on some CSE servers
-            # ignore this execution and try again
-            time.sleep(1)
+        start_time = time.time()
+        execution_key = None
+        if executions is not None:
+            execution_key = self.execution_key(compile_command)
+        if execution_key and execution_key in executions:
+            (stdout, stderr, stdout_comparator) = self.reuse_execution(
+                executions[execution_key]
+            )
+        else:
+            (stdout, stderr, stdout_comparator) = self.execute_program()
+            # output is incomplete if the program was stopped because it was incorrect
+            if execution_key and not (stdout_comparator and stdout_comparator.stopped):
+                executions[execution_key] = (
+                    stdout,
+                    stderr,
+                    self.returncode,
+                    self.rusage,
+                )
+        self.run_seconds = time.time() - start_time
+        start_time = time.time()
+        self.stdout_bytes = len(stdout)
+        self.stderr_bytes = len(stderr)
 
         if self.parameters["unicode_stdout"]:
             self.stdout = codecs.decode(stdout, "UTF-8", errors="replace")
@@ -81,8 +157,10 @@ class _Test:
         self.short_explanation = None
         self.long_explanation = None
 
+        stdout_matched = stdout_comparator.finish() if stdout_comparator else None
+        self.stopped_on_mismatch = bool(stdout_comparator and stdout_comparator.stopped)
         stdout_short_explanation = self.check_stream(
-            self.stdout, self.expected_stdout, "output"
+            self.stdout, self.expected_stdout, "output", matched=stdout_matched
         )
         if not self.parameters["allow_unexpected_stderr"] or stdout_short_explanation:
             if (
@@ -105,6 +183,9 @@ class _Test:
         if not self.short_explanation:
             self.short_explanation = self.check_files()
 
+        if not self.short_explanation:
+            self.short_explanation = self.check_cpu_time()
+
         self.test_passed = not self.short_explanation
         if not self.test_passed:
             self.failed_compiler = (
@@ -112,8 +193,70 @@ class _Test:
                 if isinstance(compile_command, list)
                 else str(compile_command)
             )
+        self.compare_seconds = time.time() - start_time
         return self.test_passed
 
+    def execute_program(self):
+        """
+        run the program for this test, setting returncode & rusage
+        return (stdout, stderr, stdout_comparator)
+        """
+        for attempt in range(3):
+            if self.debug > 1:
+                print("run_test attempt", attempt)
+            stdout_comparator = self.make_stdout_comparator()
+            self.rusage = {}
+            (stdout, stderr, self.returncode) = run(
+                **self.parameters,
+                stdout_comparator=stdout_comparator,
+                resource_usage=self.rusage,
+            )
+            if stdout or stderr or self.returncode == 0 or not self.expected_stdout:
+                break
+            if self.debug > 1:
+                print("run_test retry", (stdout, stderr, self.returncode))
+            # ugly work-around for
+            # weird termination with non-zero exit status seen on some CSE servers
+            # ignore this execution and try again
+            time.sleep(1)
+        return (stdout, stderr, stdout_comparator)
+
+    def reuse_execution(self, execution):
+        """
+        use the output of an identical execution of the program by another test
+        return (stdout, stderr, stdout_comparator) as execute_program does
+        """
+        if self.debug > 1:
+            print("run_test reusing execution")
+        (stdout, stderr, self.returncode, rusage) = execution
+        self.rusage = dict(rusage)
+        stdout_comparator = self.make_stdout_comparator()
+        if stdout_comparator:
+            # the complete output is available so there is no program to stop
+            stdout_comparator.fail_fast = False
+            stdout_comparator.feed(stdout)
+        return (stdout, stderr, stdout_comparator)
+
+    def execution_key(self, compile_command):
+        """
+        return a key identifying the execution of the program by this test,
+        or None if the execution can not be shared with other tests
+        """
+        parameters = self.parameters
+        # files created by the program are checked in the test's directory
+        if not parameters["deduplicate_executions"] or parameters["expected_files"]:
+            return None
+        return repr(
+            (
+                str(compile_command),
+                sorted(
+                    (name, value)
+                    for (name, value) in parameters.items()
+                    if name not in CHECKING_PARAMETERS and not name.startswith("_")
+                ),
+            )
+        )
+
     def check_files(self):
         for pathname, expected_contents in self.parameters["expected_files"].items():
             try:
@@ -135,7 +278,34 @@ class _Test:
                 self.file_actual = actual_contents
                 return short_explanation
 
-    def check_stream(self, actual, expected, name):
+    def check_cpu_time(self):
+        """
+        return a short explanation if the program used too much CPU time
+        compared to the reference solution, or None
+        """
+        max_cpu_ratio = self.parameters["max_cpu_ratio"]
+        reference_cpu_seconds = self.parameters["reference_cpu_seconds"]
+        if not max_cpu_ratio or not reference_cpu_seconds:
+            return None
+        cpu_seconds = (
+            self.rusage["user_cpu_seconds"] + self.rusage["system_cpu_seconds"]
+        )
+        allowed_cpu_seconds = max_cpu_ratio * reference_cpu_seconds
+        if cpu_seconds <= allowed_cpu_seconds:
+            return None
+        self.long_explanation = (
+            f"Your program used {cpu_seconds:.2f} seconds of CPU time.\n"
+            f"A correct solution uses {reference_cpu_seconds:.2f} seconds, "
+            f"this test allows at most {allowed_cpu_seconds:.2f} seconds.\n"
+            "Your program may be using an inefficient algorithm.\n"
+        )
+        return "Too slow"
+
+    def check_stream(self, actual, expected, name, matched=None):
+        """
+        return a short explanation if actual is not the expected output or None,
+        matched is the result of comparing actual & expected if already known
+        """
         if self.debug:
             print("name:", name)
             print("actual:", actual[0:256] if actual else "")
@@ -152,7 +322,9 @@ class _Test:
                     else:
                         return "Your non-unicode output is not correct"
                 # handling unicode input
-                if self.compare_strings(actual, expected):
+                if matched is None:
+                    matched = self.compare_strings(actual, expected)
+                if matched:
                     return None
                 else:
                     return "Incorrect " + name
@@ -173,46 +345,112 @@ class _Test:
                 return None
 
     def make_string_canonical(self, raw_str, keep_all_lines=False):
-        s = re.sub("\r\n?", "\n", raw_str)
-        filter = self.parameters.get("postprocess_output_command", None)
-
-        if filter:
-            if self.debug:
-                print(f"postprocess_output_command={filter} str='{s}'")
-            p = subprocess.run(
-                filter,
-                stdout=subprocess.PIPE,
-                input=s,
-                stderr=subprocess.PIPE,
-                shell=isinstance(filter, str),
-                universal_newlines=True,
-            )
-            if p.stderr:
-                raise InternalError(
-                    "error from postprocess_output_command: " + p.stderr
-                )
-            if p.returncode:
-                raise InternalError(
-                    "non-zero exit status from postprocess_output_command"
-                )
-            s = p.stdout
-            if self.debug:
-                print(f"after filter s='{s}'")
-
+        s = self.postprocess_output(LINE_ENDING.sub("\n", raw_str))
         if self.parameters["ignore_case"]:
             s = s.lower()
         s = s.translate(self.canonical_translator)
         if self.parameters["ignore_blank_lines"] and not keep_all_lines:
-            s = re.sub(r"\n\s*\n", "\n", s)
-            s = re.sub(r"^\n+", "", s)
+            s = BLANK_LINES.sub("\n", s)
+            s = LEADING_NEWLINES.sub("", s)
         if self.parameters["ignore_trailing_whitespace"]:
-            s = re.sub(r"[ \t]+\n", "\n", s)
+            s = TRAILING_WHITESPACE.sub("\n", s)
         if self.debug > 1:
             print(f"make_string_canonical('{raw_str}') -> '{s}'")
         return s
 
+    def postprocess_output(self, s):
+        """
+        apply postprocess_output_command and postprocess_output_function to s,
+        the last result is memoized as the same output is often postprocessed repeatedly
+        """
+        command = self.parameters.get("postprocess_output_command", None)
+        function_source = self.parameters.get("postprocess_output_function", "")
+        if not command and not function_source:
+            return s
+        last_postprocessed = getattr(self, "last_postprocessed", None)
+        if last_postprocessed and last_postprocessed[0] == s:
+            return last_postprocessed[1]
+        result = s
+        if command:
+            if self.debug:
+                print(f"postprocess_output_command={command} str='{result}'")
+            result = run_postprocess_command(
+                command,
+                result,
+                coprocess=self.parameters["postprocess_output_coprocess"],
+                environment=self.parameters["environment"],
+                debug=self.debug,
+            )
+            if self.debug:
+                print(f"after filter s='{result}'")
+        if function_source:
+            try:
+                result = get_postprocess_function(function_source)(result)
+            # pylint: disable=broad-except
+            except Exception as e:
+                raise InternalError(
+                    f"error from postprocess_output_function: {e}"
+                ) from e
+            if not isinstance(result, str):
+                raise InternalError("postprocess_output_function did not return a str")
+        self.last_postprocessed = (s, result)
+        return result
+
+    def make_expected_canonical(self, expected, keep_all_lines=False):
+        """
+        make_string_canonical for expected output,
+        memoized as it is the same for every execution of the test
+        """
+        keep_all_lines = keep_all_lines and self.parameters["ignore_blank_lines"]
+        key = (expected, keep_all_lines)
+        if key not in self.canonical_expected:
+            self.canonical_expected[key] = self.make_string_canonical(
+                expected, keep_all_lines=keep_all_lines
+            )
+        return self.canonical_expected[key]
+
+    def canonicalize_expected_output(self):
+        """
+        memoize canonical forms of all unicode expected output for this test
+        """
+        expected_outputs = [self.expected_stdout, self.expected_stderr] + list(
+            self.parameters["expected_files"].values()
+        )
+        for expected in expected_outputs:
+            if expected and isinstance(expected, str):
+                self.make_expected_canonical(expected)
+                self.make_expected_canonical(expected, keep_all_lines=True)
+
+    def make_stdout_comparator(self):
+        """
+        return an OutputComparator to check stdout as the program runs,
+        or None if stdout must be compared after the program finishes
+        """
+        parameters = self.parameters
+        if (
+            not parameters["unicode_stdout"]
+            or not isinstance(self.expected_stdout, str)
+            or not self.expected_stdout
+            or parameters.get("postprocess_output_command", None)
+            or parameters.get("postprocess_output_function", "")
+        ):
+            return None
+        max_lines_shown = int(parameters["max_lines_shown"])
+        return OutputComparator(
+            self.make_expected_canonical(self.expected_stdout),
+            self.canonical_translator,
+            ignore_case=parameters["ignore_case"],
+            ignore_blank_lines=parameters["ignore_blank_lines"],
+            ignore_trailing_whitespace=parameters["ignore_trailing_whitespace"],
+            # dcc stops the program itself if its output is incorrect
+            fail_fast=parameters["fail_fast_on_mismatch"]
+            and not parameters["dcc_output_checking"],
+            window_lines=max_lines_shown,
+            window_bytes=max_lines_shown * int(parameters["max_line_length_shown"]),
+        )
+
     def compare_strings(self, actual, expected):
-        return self.make_string_canonical(actual) == self.make_string_canonical(
+        return self.make_string_canonical(actual) == self.make_expected_canonical(
             expected
         )
 
@@ -326,6 +564,10 @@ class _Test:
                 self.long_explanation += self.report_bit_differences(
                     expected_bits, actual_bits
                 )
+            if self.stopped_on_mismatch:
+                self.long_explanation += (
+                    "Your program was stopped soon after its output became incorrect.\n"
+                )
 
         if self.stdout_ok and self.stderr_ok and self.file_not_ok:
             if self.parameters["unicode_files"]:
@@ -408,14 +650,18 @@ class _Test:
     def report_difference(self, name, expected, actual):
         if self.debug:
             print(f"report_difference({name}, '{expected}', '{actual}')")
-        canonical_expected = self.make_string_canonical(expected)
-        canonical_actual = self.make_string_canonical(actual)
-        canonical_actual_plus_newlines = self.make_string_canonical(
-            actual, keep_all_lines=True
-        )
-        canonical_expected_plus_newlines = self.make_string_canonical(
+        canonical_expected = self.make_expected_canonical(expected)
+        canonical_expected_plus_newlines = self.make_expected_canonical(
             expected, keep_all_lines=True
         )
+        canonical_actual = self.make_string_canonical(actual)
+        # keep_all_lines only changes the result if blank lines are ignored
+        if self.parameters["ignore_blank_lines"]:
+            canonical_actual_plus_newlines = self.make_string_canonical(
+                actual, keep_all_lines=True
+            )
+        else:
+            canonical_actual_plus_newlines = canonical_actual
         return explain_output_differences(
             name,
             expected,
@@ -493,11 +739,201 @@ class _Test:
         value = self.parameters[parameter]
         return value and value[0] not in "0fF"
 
-    def set_environ(self):
-        test_environ = self.parameters["environment"]
-        if os.environ != test_environ:
-            os.environ.clear()
-            os.environ.update(test_environ)
+
+def run_postprocess_command(command, s, coprocess=False, environment=None, debug=0):
+    """
+    return s passed through command, run with environment if it is set,
+    if coprocess is set command is run as a co-process if it supports this
+    """
+    if coprocess:
+        result = run_postprocess_coprocess(
+            command, s, environment=environment, debug=debug
+        )
+        if result is not None:
+            return result
+    p = subprocess.run(
+        command,
+        stdout=subprocess.PIPE,
+        input=s,
+        stderr=subprocess.PIPE,
+        shell=isinstance(command, str),
+        universal_newlines=True,
+        env=environment,
+    )
+    if p.stderr:
+        raise InternalError("error from postprocess_output_command: " + p.stderr)
+    if p.returncode:
+        raise InternalError("non-zero exit status from postprocess_output_command")
+    return p.stdout
+
+
+# postprocess_output_command co-processes indexed by process id, command,
+# environment & directory
+postprocess_coprocesses = {}
+
+# postprocess_output_command commands which do not support being run as a co-process,
+# inherited by forked processes so they need not repeat the handshake
+unsupported_coprocess_commands = set()
+
+
+def run_postprocess_coprocess(command, s, environment=None, debug=0):
+    """
+    return s passed through a co-process running command,
+    or None if command does not support running as a co-process
+
+    the co-process is started once in each autotest process
+    and reads records from stdin, writing the postprocessed record to stdout.
+    A record is its length in bytes in decimal and a newline,
+    followed by the record encoded in UTF-8.
+    A probe record is sent first to check the command supports this.
+    """
+    command_key = command if isinstance(command, str) else tuple(command)
+    if command_key in unsupported_coprocess_commands:
+        return None
+    # a co-process keeps the environment & directory it was started with
+    key = (
+        os.getpid(),
+        command_key,
+        tuple(sorted(environment.items())) if environment is not None else None,
+        os.getcwd(),
+    )
+    process = postprocess_coprocesses.get(key, None)
+    try:
+        if process is None:
+            # pylint: disable=consider-using-with
+            process = subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                shell=isinstance(command, str),
+                env=environment,
+            )
+            postprocess_coprocesses[key] = process
+            os.set_blocking(process.stdin.fileno(), False)
+            check_coprocess(process)
+        result = exchange_coprocess_record(
+            process, s.encode("UTF-8"), COPROCESS_TIMEOUT_SECONDS
+        )
+        return result.decode("UTF-8", errors="replace")
+    except (OSError, ValueError) as e:
+        if debug:
+            print(
+                f"postprocess_output_command '{command}' not run as co-process: {e}",
+                file=sys.stderr,
+            )
+        if process:
+            process.kill()
+            process.wait()
+        postprocess_coprocesses.pop(key, None)
+        unsupported_coprocess_commands.add(command_key)
+        return None
+
+
+def check_postprocess_coprocesses(tests):
+    """
+    run the co-process handshake for the postprocess_output_command of tests,
+    called before forking so commands which do not support being run as a co-process
+    are found once rather than in every forked process
+    """
+    for test in tests:
+        parameters = test.parameters
+        command = parameters.get("postprocess_output_command", None)
+        if command and parameters["postprocess_output_coprocess"]:
+            run_postprocess_coprocess(
+                command,
+                "",
+                environment=parameters["environment"],
+                debug=parameters["debug"],
+            )
+
+
+def check_coprocess(process):
+    """
+    raise ValueError unless process answers COPROCESS_PROBE as a co-process should
+
+    the length of the probe is sent before the probe itself,
+    a command which echoes its input answers before the probe is sent,
+    if it echoes lines of input it can not answer the probe, which has no newline
+    """
+    header = b"%d\n" % len(COPROCESS_PROBE)
+    os.write(process.stdin.fileno(), header)
+    with selectors.DefaultSelector() as selector:
+        selector.register(process.stdout, selectors.EVENT_READ)
+        if selector.select(COPROCESS_ECHO_SECONDS):
+            raise ValueError("response before record sent")
+    exchange_coprocess_record(
+        process, COPROCESS_PROBE, COPROCESS_HANDSHAKE_SECONDS, header_sent=True
+    )
+
+
+def exchange_coprocess_record(process, record, timeout, header_sent=False):
+    """
+    send record to a co-process and return the record it sends back,
+    its length is not sent if header_sent is set
+    ValueError is raised if this does not happen within timeout seconds
+    """
+    header = b"" if header_sent else b"%d\n" % len(record)
+    request = memoryview(header + record)
+    response = bytearray()
+    response_length = None
+    deadline = time.monotonic() + timeout
+    with selectors.DefaultSelector() as selector:
+        selector.register(process.stdout, selectors.EVENT_READ)
+        selector.register(process.stdin, selectors.EVENT_WRITE)
+        while response_length is None or len(response) < response_length:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ValueError(f"no response within {timeout} seconds")
+            for selector_key, _ in selector.select(remaining):
+                if selector_key.fileobj is process.stdin:
+                    try:
+                        n_bytes = os.write(process.stdin.fileno(), request)
+                    except BlockingIOError:
+                        continue
+                    request = request[n_bytes:]
+                    if not request:
+                        selector.unregister(process.stdin)
+                    continue
+                data = os.read(process.stdout.fileno(), 65536)
+                if not data:
+                    raise ValueError("co-process exited")
+                response += data
+                if response_length is None and b"\n" in response:
+                    (header, _, rest) = response.partition(b"\n")
+                    response_length = int(header)
+                    response = rest
+    if len(response) != response_length:
+        raise ValueError("response longer than record length")
+    return bytes(response)
+
+
+def stop_postprocess_coprocesses():
+    for key, process in postprocess_coprocesses.items():
+        if key[0] == os.getpid():
+            process.stdin.close()
+            try:
+                process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+atexit.register(stop_postprocess_coprocesses)
+
+
+def get_postprocess_function(
+    source,
+    # pylint: disable=dangerous-default-value
+    cache={},
+):
+    """
+    return the function defined by the Python expression source,
+    e.g. "lambda output: ''.join(sorted(output.splitlines(True)))"
+    """
+    if source not in cache:
+        # pylint: disable=eval-used
+        cache[source] = eval(source, {"re": re})
+    return cache[source]
 
 
 def echo_command_for_string(test_input):
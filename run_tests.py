@@ -1,17 +1,33 @@
 # run all the tests
 # This code needs extensive revision.
 
-import copy, glob, io, os, re, subprocess, sys
+import copy, glob, io, multiprocessing, os, re, shutil, subprocess, sys, tempfile, time
 from termcolor import colored as termcolor_colored
 from parse_test_specification import output_file_without_parameters
 from util import die
 from command_line_arguments import REPO
 from parameter_descriptions import finalize_dcc_output_checking
+from results_stream import open_results_stream, write_result, write_summary
+from mounts import mount_overlay, umount
+from copy_files_to_temp_directory import stage_file
+from compilation_cache import (
+    compilation_cache_key,
+    fetch_compiled_program,
+    store_compiled_program,
+)
+from result_cache import (
+    evict_test_results,
+    fetch_test_result,
+    store_test_result,
+    test_result_key,
+)
+from dependencies import dependency_graph, has_known_dependencies
+from test_statistics import load_statistics, save_statistics, record_result, order_tests
 
 # necessary for typehinting
-from typing import Dict, List, Any, Union
+from typing import Dict, List, Any, Tuple, Union
 
-from run_test import _Test
+from run_test import _Test, check_postprocess_coprocesses
 from argparse import Namespace
 
 
@@ -71,7 +87,82 @@ def run_tests(
         print(error_msg, flush=True, file=file)
         return 1
 
-    results = [run_one_test(test, file=file) for test in tests_to_run]
+    if args.changed_only or any(
+        test.parameters["result_cache_directory"] for test in tests_to_run
+    ):
+        set_unrelated_files(tests_to_run, debug=debug)
+
+    statistics_file = global_parameters["test_statistics_file"]
+    if not statistics_file and args.order != "spec":
+        statistics_file = user_cache_pathname(global_parameters, "test_statistics.json")
+    statistics = {}
+    if statistics_file:
+        statistics = load_statistics(statistics_file, debug=debug)
+        tests_to_run = order_tests(
+            tests_to_run, args.order, statistics, lambda t: statistics_key(t, args)
+        )
+
+    previous_errors: Dict[str, Any] = {}
+    explain = not args.summary_only
+    results_stream = None
+    if args.json_results:
+        results_stream = open_results_stream(
+            args.json_results, submission=getattr(args, "submission", None)
+        )
+    parallel = args.jobs > 1 and len(tests_to_run) > 1
+    # results are looked up before any test changes the test directory
+    cached_results = fetch_cached_results(
+        tests_to_run, explain, args.changed_only, parallel
+    )
+    if parallel:
+        results = run_tests_in_parallel(
+            tests_to_run,
+            args.jobs,
+            file=file,
+            previous_errors=previous_errors,
+            explain=explain,
+            results_stream=results_stream,
+            changed_only=args.changed_only,
+            fail_fast=args.fail_fast,
+            cached_results=cached_results,
+        )
+    else:
+        results = []
+        # outputs of executions shared by tests, see deduplicate_executions
+        executions: Dict[str, Any] = {}
+        for test in tests_to_run:
+            result = run_one_test(
+                test,
+                file=file,
+                previous_errors=previous_errors,
+                explain=explain,
+                results_stream=results_stream,
+                changed_only=args.changed_only,
+                executions=executions,
+                cached_result=cached_results[test.label],
+            )
+            results.append(result)
+            if args.fail_fast and result in (0, -1):
+                break
+
+    cache_directories = set(
+        (cached_results[test.label][0], test.parameters["result_cache_max_bytes"])
+        for test in tests_to_run
+    )
+    for cache_directory, max_bytes in cache_directories:
+        if cache_directory and os.path.isdir(cache_directory):
+            evict_test_results(cache_directory, max_bytes, debug=debug)
+
+    if statistics_file:
+        for test, result in zip(tests_to_run, results):
+            key = statistics_key(test, args)
+            # tests replayed from the result cache were not run
+            if result in (0, 1) and test.run_seconds:
+                seconds = test.compile_seconds + test.run_seconds + test.compare_seconds
+                record_result(statistics, key, not result, seconds)
+            elif result == -1:
+                record_result(statistics, key, True)
+        save_statistics(statistics_file, statistics, debug=debug)
 
     if debug > 3:
         subprocess.call("echo after tests run;ls -l;pwd", shell=True)
@@ -79,6 +170,19 @@ def run_tests(
     n_tests_passed = results.count(1)
     n_tests_failed = results.count(0)
     n_tests_not_run = results.count(-1)
+    n_tests_unchanged = results.count(None)
+    # tests after a failure are not run if fail_fast is set
+    n_tests_skipped = len(tests_to_run) - len(results)
+    if results_stream:
+        write_summary(
+            results_stream,
+            n_tests_passed,
+            n_tests_failed,
+            n_tests_not_run,
+            n_unchanged=n_tests_unchanged,
+            n_skipped=n_tests_skipped,
+        )
+        results_stream.close()
 
     if n_tests_passed:
         print(
@@ -92,19 +196,224 @@ def run_tests(
         print(colored("0 tests failed", "green"), end=" ", file=file)
     if n_tests_not_run:
         print("", n_tests_not_run, "tests could not be run", end="", file=file)
+    if n_tests_unchanged:
+        print("", n_tests_unchanged, "tests unchanged", end="", file=file)
+    if n_tests_skipped:
+        print("", n_tests_skipped, "tests skipped", end="", file=file)
     print(file=file)
     return 1 if n_tests_failed + n_tests_not_run else 0
 
 
+def statistics_key(test: _Test, args: Namespace) -> str:
+    """
+    return the name of test in the test statistics file
+    """
+    return f"{args.exercise}:{test.label}"
+
+
+def set_unrelated_files(tests: List[_Test], debug: int = 0) -> None:
+    """
+    set unrelated_files for each test to the source files which other tests depend on
+    but it does not, so changes to them do not invalidate its cached result
+
+    other files, e.g. data files, may be read by the test's command so are never
+    unrelated, nor are source files named in the test's command, arguments or stdin
+    """
+    test_files = dict(
+        (test.label, [f for g in test.files for f in glob.glob(g)]) for test in tests
+    )
+    try:
+        graph = dependency_graph(test_files, debug=debug)
+    except (OSError, UnicodeDecodeError):
+        return
+    for test in tests:
+        named = " ".join(
+            str(test.parameters.get(p, ""))
+            for p in ["command", "arguments", "stdin", "stdin_file"]
+        )
+        test.unrelated_files = set(
+            pathname
+            for (pathname, labels) in graph.items()
+            if test.label not in labels
+            and has_known_dependencies(pathname)
+            and os.path.basename(pathname) not in named
+        )
+
+
 # TODO: provide stricter type for previous_errors
 def run_one_test(
     # pylint: disable=dangerous-default-value
     test: _Test,
     file=sys.stdout,
     previous_errors: Dict[str, Any] = {},
-) -> int:
+    explain: bool = True,
+    results_stream=None,
+    changed_only: bool = False,
+    executions: Union[Dict[str, Any], None] = None,
+    cached_result: Tuple[str, Union[str, None], bool, Any] = ("", None, False, None),
+) -> Union[int, None]:
     """
     return -1 for test not run, 0 for test failed, 1 for test passed
+    return None if changed_only is set and the test's passing result is cached
+    executions is passed to run_test,
+    cached_result is the test's entry from fetch_cached_results
+    """
+    test_files = prepare_test(test, file=file)
+    if test_files is None:
+        write_result(results_stream, test, None, "not_run")
+        return -1
+    (cache_directory, cache_key, cached, failed_individual_test) = cached_result
+    # cached failures are still reported, so they are counted in the exit status
+    if cached and changed_only and not failed_individual_test:
+        return None
+    if cached:
+        replay_cached_result(test, failed_individual_test, file=file)
+    elif test.parameters["isolate_tests"] and not test.parameters["serial"]:
+        failed_individual_test = execute_test_in_working_copy(
+            test, test_files, os.getcwd(), file=file, executions=executions
+        )
+    else:
+        failed_individual_test = execute_test(
+            test, test_files, file=file, executions=executions
+        )
+    result = report_test_result(
+        test,
+        failed_individual_test,
+        file=file,
+        previous_errors=previous_errors,
+        explain=explain,
+    )
+    write_result(
+        results_stream, test, failed_individual_test, "passed" if result else "failed"
+    )
+    if cache_key and not cached:
+        store_test_result(
+            cache_directory,
+            cache_key,
+            failed_individual_test,
+            explain=explain,
+            debug=test.parameters["debug"],
+        )
+    return result
+
+
+def fetch_cached_results(
+    tests: List[_Test], explain: bool, changed_only: bool, parallel: bool
+) -> Dict[str, Tuple[str, Union[str, None], bool, Any]]:
+    """
+    look up the results of tests in the result cache before any test is run
+    return a dict mapping labels to (cache_directory, cache_key, cached, failed_execution)
+    cache_key is None if the result cache is not used,
+    failed_execution is the cached failed execution if cached is True
+
+    a test run in a copy of the test directory no earlier test can have changed
+    is independent of other tests, others may need files written by earlier tests
+    which share the test directory, so their keys include the keys of these tests
+    and, because a test replayed from the cache writes no files,
+    their cached results are only used if those of all these tests are cached
+    """
+    cache_directories = [
+        result_cache_directory(test.parameters, changed_only) for test in tests
+    ]
+    if not any(cache_directories):
+        return dict((test.label, ("", None, False, None)) for test in tests)
+    results = {}
+    shared_keys: List[str] = []
+    shared_results_cached = True
+    for test, cache_directory in zip(tests, cache_directories):
+        parameters = test.parameters
+        # tests run in parallel are copied from a snapshot of the test directory
+        isolated = not parameters["serial"] and (
+            parallel or (parameters["isolate_tests"] and not shared_keys)
+        )
+        cache_key = test_result_key(
+            parameters,
+            unrelated_files=test.unrelated_files,
+            compiled_files=compiled_files(test),
+            earlier_keys=[] if isolated else shared_keys,
+        )
+        if not isolated:
+            shared_keys.append(cache_key)
+        if not cache_directory:
+            shared_results_cached = shared_results_cached and isolated
+            results[test.label] = ("", None, False, None)
+            continue
+        (cached, failed_execution) = fetch_test_result(
+            cache_directory, cache_key, explain=explain, debug=parameters["debug"]
+        )
+        if not isolated:
+            shared_results_cached = shared_results_cached and cached
+        results[test.label] = (cache_directory, cache_key, cached, failed_execution)
+    if not shared_results_cached:
+        # all tests sharing the test directory are run, in order
+        for test in tests:
+            (cache_directory, cache_key, cached, _) = results[test.label]
+            if cached and cache_key in shared_keys:
+                results[test.label] = (cache_directory, cache_key, False, None)
+    return results
+
+
+def result_cache_directory(parameters: Dict[str, Any], changed_only: bool) -> str:
+    """
+    return the directory results of a test are cached in, or "" if they are not cached
+    """
+    cache_directory = parameters["result_cache_directory"]
+    if not cache_directory and changed_only:
+        cache_directory = user_cache_pathname(parameters, "results")
+    return cache_directory
+
+
+def compiled_files(test: _Test) -> List[str]:
+    """
+    return the pathnames of the binaries built for test by compile_commands
+    """
+    parameters = test.parameters
+    program = parameters["program"]
+    if not program or not parameters["compile_commands"]:
+        return []
+    test_files = [f for g in test.files for f in glob.glob(g)]
+    return [program] + [
+        get_unique_program_name(program, compile_command, test_files)
+        for compile_command in parameters["compile_commands"]
+    ]
+
+
+def user_cache_pathname(parameters: Dict[str, Any], name: str) -> str:
+    """
+    return pathname for name in the user's autotest cache directory,
+    or "" if HOME is not set
+    """
+    home = parameters["__environment_original"].get("HOME", "")
+    if not home:
+        return ""
+    return os.path.join(home, ".cache", "autotest", name)
+
+
+def replay_cached_result(test: _Test, failed_execution: Any, file=sys.stdout) -> None:
+    """
+    print the start of the description of test and
+    set the attributes of test from its cached result, as execute_test does
+    """
+    parameters = test.parameters
+    description = f"Test {parameters['label']} ({parameters['description']}) - "
+    print(description, end="", file=file)
+    test.test_passed = failed_execution is None
+    if failed_execution:
+        for attribute in [
+            "stdout",
+            "stderr",
+            "returncode",
+            "stdout_bytes",
+            "stderr_bytes",
+            "rusage",
+        ]:
+            setattr(test, attribute, getattr(failed_execution, attribute))
+
+
+def prepare_test(test: _Test, file=sys.stdout) -> Union[List[str], None]:
+    """
+    run any checkers & compilers needed for test
+    return the list of files for the test, or None if the test can not be run
     """
     parameters = test.parameters
     debug = parameters["debug"]
@@ -126,7 +435,7 @@ def run_one_test(
             flush=True,
             file=file,
         )
-        return -1
+        return None
 
     missing_files = [f for f in test.files if not glob.glob(f)]
     if missing_files:
@@ -137,9 +446,12 @@ def run_one_test(
             flush=True,
             file=file,
         )
-        return -1
+        return None
 
-    if not run_compilers(test_files, parameters, file=file, debug=debug):
+    start_time = time.time()
+    compiled = run_compilers(test_files, parameters, file=file, debug=debug)
+    test.compile_seconds = time.time() - start_time
+    if not compiled:
         print(
             not_run_description,
             "because",
@@ -147,12 +459,44 @@ def run_one_test(
             flush=True,
             file=file,
         )
-        return -1
+        return None
 
     if debug > 3:
         subprocess.call("echo after run_compilers;ls -l", shell=True)
 
     chmod_program(**parameters)
+    return test_files
+
+
+# attributes of a test set by execute_test
+TEST_RESULT_ATTRIBUTES = [
+    "test_passed",
+    "stdout",
+    "stderr",
+    "returncode",
+    "stdout_bytes",
+    "stderr_bytes",
+    "rusage",
+    "run_seconds",
+    "compare_seconds",
+]
+
+
+def execute_test(
+    test: _Test,
+    test_files: List[str],
+    file=sys.stdout,
+    executions: Union[Dict[str, Any], None] = None,
+) -> Union[_Test, None]:
+    """
+    run test once for each compile command
+    executions is passed to run_test
+    return the failed execution to be reported, or None if the test passed
+    """
+    parameters = test.parameters
+    debug = parameters["debug"]
+    label = parameters["label"]
+    description = f"Test {label} ({parameters['description']}) - "
 
     print(description, end="", file=file)
 
@@ -167,6 +511,7 @@ def run_one_test(
             run_support_command(
                 test.parameters["setup_command"],
                 result_cache={},
+                environment=test.parameters["environment"],
                 debug=test.parameters["debug"],
             )
         individual_test = copy.copy(test)
@@ -180,7 +525,9 @@ def run_one_test(
         if compile_command and not parameters["compiler_args"]:
             compile_command_str += " " + " ".join(test_files)
 
-        individual_test.run_test(compile_command=compile_command_str)
+        individual_test.run_test(
+            compile_command=compile_command_str, executions=executions
+        )
         individual_tests.append(individual_test)
         if not individual_test.stderr_ok and not parameters["allow_unexpected_stderr"]:
             break
@@ -192,9 +539,12 @@ def run_one_test(
     test.test_passed = not failed_individual_tests
     test.stdout = individual_tests[0].stdout
     test.stderr = individual_tests[0].stderr
+    for attribute in ["returncode", "stdout_bytes", "stderr_bytes", "rusage"]:
+        setattr(test, attribute, getattr(individual_tests[0], attribute))
+    test.run_seconds = sum(it.run_seconds for it in individual_tests)
+    test.compare_seconds = sum(it.compare_seconds for it in individual_tests)
     if test.test_passed:
-        print(colored("passed", "green"), flush=True, file=file)
-        return 1
+        return None
 
     # pick the best failed test to report
     # if we have errors then should be more informative than incorrect output except memory leaks
@@ -202,9 +552,43 @@ def run_one_test(
         not parameters["unicode_stderr"]
         or ("free not called" not in failed_individual_tests[-1].stderr)
     ):
-        individual_test = failed_individual_tests[-1]
+        return failed_individual_tests[-1]
     else:
-        individual_test = failed_individual_tests[0]
+        return failed_individual_tests[0]
+
+
+def report_test_result(
+    test: _Test,
+    individual_test: Union[_Test, None],
+    file=sys.stdout,
+    # pylint: disable=dangerous-default-value
+    previous_errors: Dict[str, Any] = {},
+    explain: bool = True,
+) -> int:
+    """
+    print result of test already executed,
+    previous_errors is used to avoid repeating identical explanations
+    if explain is False only the short explanation of a failure is printed,
+    and the long explanation is never created
+    return 0 for test failed, 1 for test passed
+    """
+    parameters = test.parameters
+    label = parameters["label"]
+    colored = (
+        termcolor_colored if parameters["colorize_output"] else lambda x, *a, **kw: x
+    )
+    if individual_test is None:
+        print(colored("passed", "green"), flush=True, file=file)
+        return 1
+
+    if not explain:
+        print(
+            colored("failed", "red"),
+            f"({individual_test.short_explanation})",
+            flush=True,
+            file=file,
+        )
+        return 0
 
     long_explanation = individual_test.get_long_explanation()
     # remove hexadecimal constants
@@ -233,6 +617,203 @@ def run_one_test(
     return 0
 
 
+def run_tests_in_parallel(
+    tests_to_run: List[_Test],
+    jobs: int,
+    file=sys.stdout,
+    # pylint: disable=dangerous-default-value
+    previous_errors: Dict[str, Any] = {},
+    explain: bool = True,
+    results_stream=None,
+    changed_only: bool = False,
+    fail_fast: bool = False,
+    cached_results: Dict[str, Tuple[str, Union[str, None], bool, Any]] = {},
+) -> List[Union[int, None]]:
+    """
+    run up to jobs tests concurrently, each in a separate process
+    with its own copy of the test directory
+
+    checkers & compilers are run first for all tests in this process, so binaries are shared
+    cached_results, from fetch_cached_results, has the results of tests in the result cache,
+    these tests are not run, and if changed_only is set, those which passed are not reported
+    if fail_fast is set, tests still running are stopped after the first failure
+    and only the results of tests before it are returned
+
+    tests with the parameter serial set are run in this process in the test directory,
+    in order, while other tests run
+
+    results are printed in the order of tests_to_run and
+    identical explanations are reported as for sequential execution
+    """
+    prepared = []
+    for test in tests_to_run:
+        output = io.StringIO()
+        test_files = prepare_test(test, file=output)
+        cached_result = ("", None, False, None)
+        if test_files is not None:
+            cached_result = cached_results.get(test.label, cached_result)
+        prepared.append((test, test_files, output.getvalue(), cached_result))
+
+    test_directory = os.getcwd()
+    tests_to_execute = [
+        (test, test_files)
+        for (test, test_files, _, cached_result) in prepared
+        if test_files is not None and not cached_result[2]
+    ]
+    parallel_tests = [
+        (test, test_files)
+        for (test, test_files) in tests_to_execute
+        if not test.parameters["serial"]
+    ]
+    # so the verdict on each postprocess_output_command is inherited by pool processes
+    check_postprocess_coprocesses(test for (test, _) in parallel_tests)
+    serial_tests_present = len(parallel_tests) != len(tests_to_execute)
+    if serial_tests_present:
+        # serial tests may change the test directory while parallel tests are being copied
+        # so parallel tests are copied from a snapshot
+        source_directory = create_working_copy(test_directory)
+    else:
+        source_directory = test_directory
+
+    results = []
+    # only serial tests, run in this process, share executions
+    executions: Dict[str, Any] = {}
+    context = multiprocessing.get_context("fork")
+    with context.Pool(min(jobs, len(parallel_tests)) or 1) as pool:
+        outcomes = pool.imap(
+            run_test_in_working_copy,
+            [
+                (test, test_files, source_directory, explain)
+                for (test, test_files) in parallel_tests
+            ],
+        )
+        for test, test_files, prepare_output, cached_result in prepared:
+            file.write(prepare_output)
+            if test_files is None:
+                write_result(results_stream, test, None, "not_run")
+                results.append(-1)
+                if fail_fast:
+                    break
+                continue
+            (cache_directory, cache_key, cached, failed_individual_test) = cached_result
+            if cached and changed_only and not failed_individual_test:
+                results.append(None)
+                continue
+            if cached:
+                replay_cached_result(test, failed_individual_test, file=file)
+            elif test.parameters["serial"]:
+                failed_individual_test = execute_test(
+                    test, test_files, file=file, executions=executions
+                )
+            else:
+                (output, test_results, failed_individual_test) = next(outcomes)
+                for attribute, value in test_results.items():
+                    setattr(test, attribute, value)
+                file.write(output)
+            result = report_test_result(
+                test,
+                failed_individual_test,
+                file=file,
+                previous_errors=previous_errors,
+                explain=explain,
+            )
+            write_result(
+                results_stream,
+                test,
+                failed_individual_test,
+                "passed" if result else "failed",
+            )
+            if cache_key and not cached:
+                store_test_result(
+                    cache_directory,
+                    cache_key,
+                    failed_individual_test,
+                    explain=explain,
+                    debug=test.parameters["debug"],
+                )
+            results.append(result)
+            if fail_fast and not result:
+                # leaving the with statement terminates the pool's processes
+                break
+
+    if source_directory != test_directory:
+        remove_working_copy(source_directory)
+    return results
+
+
+def run_test_in_working_copy(arguments):
+    """
+    run_tests_in_parallel helper, executed in a pool process
+    return output of test, a dict of the TEST_RESULT_ATTRIBUTES of the test
+    set by execute_test and the failed execution to be reported
+    """
+    (test, test_files, source_directory, explain) = arguments
+    output = io.StringIO()
+    failed_individual_test = execute_test_in_working_copy(
+        test, test_files, source_directory, file=output
+    )
+    if failed_individual_test and explain:
+        # explanation is needed to detect repeated errors so create it here in parallel
+        failed_individual_test.get_long_explanation()
+    test_results = dict((a, getattr(test, a)) for a in TEST_RESULT_ATTRIBUTES)
+    return (output.getvalue(), test_results, failed_individual_test)
+
+
+def execute_test_in_working_copy(
+    test: _Test,
+    test_files: List[str],
+    source_directory: str,
+    file=sys.stdout,
+    executions: Union[Dict[str, Any], None] = None,
+) -> Union[_Test, None]:
+    """
+    execute_test in a copy of source_directory, discarded after the test
+    """
+    initial_directory = os.getcwd()
+    # in a sandbox an overlay can be mounted, avoiding copying files
+    working_directory = create_working_copy(
+        source_directory, overlay=bool(test.parameters.get("sandbox", ""))
+    )
+    try:
+        os.chdir(working_directory)
+        return execute_test(test, test_files, file=file, executions=executions)
+    finally:
+        os.chdir(initial_directory)
+        remove_working_copy(working_directory)
+
+
+def create_working_copy(directory: str, overlay: bool = False) -> str:
+    """
+    copy directory to a new temporary directory alongside it
+    symlinks to binaries created by link_program are preserved,
+    files are copied by stage_file, so large supplied files are cloned
+    or hard linked, if that is safe, rather than copied for every test
+
+    if overlay is set and it is possible,
+    the copy is instead an overlayfs mount with directory as its lower layer
+    so directory must not be changed until the copy is removed
+    return pathname of the copy
+    """
+    parent_directory = tempfile.mkdtemp(dir=os.path.dirname(directory))
+    working_directory = os.path.join(parent_directory, os.path.basename(directory))
+    if overlay:
+        try:
+            mount_overlay(directory, working_directory)
+            return working_directory
+        except OSError:
+            pass
+    shutil.copytree(
+        directory, working_directory, symlinks=True, copy_function=stage_file
+    )
+    return working_directory
+
+
+def remove_working_copy(working_directory: str) -> None:
+    if os.path.ismount(working_directory):
+        umount(working_directory)
+    shutil.rmtree(os.path.dirname(working_directory), ignore_errors=True)
+
+
 def run_checkers_pre_compile_command(
     test_files: List[str], parameters: Dict[str, Any], file=sys.stdout
 ) -> bool:
@@ -252,6 +833,7 @@ def run_checkers_pre_compile_command(
                 arguments=[filename],
                 print_command=True,
                 file=file,
+                environment=parameters["environment"],
                 debug=debug,
             ):
                 return False
@@ -259,18 +841,30 @@ def run_checkers_pre_compile_command(
     pre_compile_command = parameters["pre_compile_command"]
     if pre_compile_command:
         return run_support_command(
-            pre_compile_command, print_command=False, file=file, debug=debug
+            pre_compile_command,
+            print_command=False,
+            file=file,
+            environment=parameters["environment"],
+            debug=debug,
         )
 
     return True
 
 
 def run_compilers(
-    test_files: List[str], parameters: Dict[str, Any], file=sys.stdout, debug: int = 0
+    test_files: List[str],
+    parameters: Dict[str, Any],
+    file=sys.stdout,
+    debug: int = 0,
+    # pylint: disable=dangerous-default-value
+    cached_programs: Dict[str, bool] = {},
 ) -> bool:
     """
     run any compilers specified for the the test
     return False iff any compiler fails, True otherwise
+
+    if compilation_cache_directory is set, binaries are fetched from
+    and stored in the cache, cached_programs records the binaries already fetched
     """
 
     compile_commands = parameters["compile_commands"]
@@ -282,22 +876,47 @@ def run_compilers(
     program = parameters["program"]
     for compile_command in parameters["compile_commands"]:
         arguments = [] if parameters["compiler_args"] else test_files
-        if not run_support_command(
+        unique_program_name = get_unique_program_name(
+            program, compile_command, test_files
+        )
+        cache_directory = parameters["compilation_cache_directory"]
+        cache_key = None
+        if cache_directory:
+            cache_key = compilation_cache_key(
+                compile_command,
+                arguments,
+                test_files,
+                parameters["show_compile_command"],
+            )
+            if cache_key in cached_programs:
+                continue
+            if not os.path.lexists(unique_program_name):
+                output = fetch_compiled_program(
+                    cache_directory, cache_key, unique_program_name, debug=debug
+                )
+                if output is not None:
+                    file.write(output)
+                    cached_programs[cache_key] = True
+                    continue
+
+        compiler_output = io.StringIO() if cache_key else file
+        success = run_support_command(
             compile_command,
             arguments=arguments,
             unlink=program,
             print_command=parameters["show_compile_command"],
-            file=file,
+            file=compiler_output,
+            environment=parameters["environment"],
             debug=debug,
-        ):
+        )
+        if cache_key:
+            file.write(compiler_output.getvalue())
+        if not success:
             return False
 
         if not os.path.exists(program):
             continue
 
-        unique_program_name = get_unique_program_name(
-            program, compile_command, test_files
-        )
         try:
             if debug > 1:
                 print(f"os.rename({program}, {unique_program_name})", file=sys.stderr)
@@ -309,6 +928,16 @@ def run_compilers(
             if debug:
                 print(e, file=file)
             return False
+        if cache_key and os.path.isfile(unique_program_name):
+            store_compiled_program(
+                cache_directory,
+                cache_key,
+                unique_program_name,
+                compiler_output.getvalue(),
+                parameters["compilation_cache_max_bytes"],
+                debug=debug,
+            )
+            cached_programs[cache_key] = True
     return True
 
 
@@ -447,10 +1076,10 @@ def provide_multi_language_support(
             )
         return []
     elif suffix in ["c", "cc"]:
-        compilers = default_compilers.get(suffix, [])
-        for index, compiler in enumerate(compilers):
-            compilers[index] = [program if a == "%" else str(a) for a in compiler]
-        return compilers
+        return [
+            [program if a == "%" else str(a) for a in compiler]
+            for compiler in default_compilers.get(suffix, [])
+        ]
     # Just in case. If expected behaviour is None, can do that
     # with a slight tweak to mypy.ini
     return []
@@ -464,11 +1093,15 @@ def run_support_command(
     file=sys.stdout,
     arguments: List[str] = None,
     unlink: str = None,
+    environment: Dict[str, str] = None,
     debug: int = 0,
 ) -> bool:
     """
     run support command, shell used iff command is a string
 
+    command is run with environment if it is set,
+    otherwise with autotest's environment
+
     command is not resource-limited, unlike tests
 
     if command is in result_cache, it is not run and previous result returned
@@ -522,6 +1155,7 @@ def run_support_command(
         stderr=subprocess.STDOUT,
         universal_newlines=True,
         check=False,
+        env=environment,
     )
     file.write(p.stdout)
 
@@ -603,7 +1237,7 @@ def print_expected_output(tests: Dict[str, _Test], args: Namespace, file) -> Non
             # override dcc output checking
             finalize_dcc_output_checking("dcc_output_checking", False, test.parameters)
 
-            run_one_test(test, file=dev_null)
+            run_one_test(test, file=dev_null, explain=False)
             if not hasattr(test, "stdout"):
                 die(f"Test {label} could not be run")
             if test.stdout:
@@ -1,4 +1,21 @@
-import os, pickle, sys, subprocess
+import copy, os, pickle, selectors, shutil, signal, socket, sys, subprocess, tempfile
+from results_stream import open_results_stream
+from run_tests import run_tests
+from helper import run_helper
+from util import AutotestException
+from mounts import (
+    CLONE_NEWNET,
+    CLONE_NEWNS,
+    CLONE_NEWPID,
+    MS_BIND,
+    MS_RDONLY,
+    MS_REC,
+    MS_RELATIME,
+    MS_REMOUNT,
+    LOCKED_MOUNT_FLAGS,
+    mount,
+    unshare_namespaces,
+)
 
 SANDBOX_NAME = "../sandbox.pickle"
 
@@ -9,13 +26,25 @@ def run_tests_in_sandbox(argv0_realpath, tests, args, parameters):
     deliberate escape from sandbox is possible.
     variable values are saved in a file for recovery after invocation of unshare
     """
+    pass_fds = []
+    if args.json_results:
+        # the results file may not be visible inside the sandbox
+        # so it is opened here and its file descriptor inherited
+        results_stream = open_results_stream(args.json_results)
+        pass_fds.append(results_stream.fileno())
+        args = copy.copy(args)
+        args.json_results = f"fd:{results_stream.fileno()}"
     with open(SANDBOX_NAME, "wb") as f:
         pickle.dump((tests, args, parameters), f)
-    command = parameters.get("sandbox_command", [])
-    command += [argv0_realpath, "--inside_sandbox"]
+    command = parameters.get("sandbox_command", []) + [
+        argv0_realpath,
+        "--inside_sandbox",
+    ]
     if args.debug:
         print(" ".join(command), file=sys.stderr)
-    p = subprocess.run(command, check=False)
+    p = subprocess.run(command, check=False, pass_fds=pass_fds)
+    if pass_fds:
+        results_stream.close()
     if args.debug:
         print("leaving sandbox with exit status", p.returncode, file=sys.stderr)
     return p.returncode
@@ -45,33 +74,48 @@ def create_file_system(args, parameters):
     if args.debug:
         print("chdir", "../root", file=sys.stderr)
     os.chdir("../root")
+    create_skeleton(args, parameters)
+    enter_skeleton(".", initial_dir, args, parameters)
 
+
+def create_skeleton(args, parameters):
+    """
+    create in the current directory the mounts shared by all sandboxes
+    """
     os.mkdir("tmp", 0o1777)
-    run_command(["mount", "-t", "tmpfs", "tmpfs", "tmp"], args)
 
     os.mkdir("proc", 0o755)
-    run_command(["mount", "-t", "proc", "proc", "proc"], args)
+    mount("proc", "proc", args, fstype="proc")
 
     os.mkdir("sys", 0o755)
     if parameters.get("sandbox_network", True):
         # only possible if a network namespace has been created
-        run_command(["mount", "-t", "sysfs", "none", "sys"], args)
+        mount("none", "sys", args, fstype="sysfs")
     else:
-        run_command(["mount", "--rbind", "/sys", "sys"], args)
+        mount("/sys", "sys", args, flags=MS_BIND | MS_REC)
 
     os.mkdir("dev", 0o755)
-    run_command(["mount", "--rbind", "/dev", "dev"], args)
+    mount("/dev", "dev", args, flags=MS_BIND | MS_REC)
 
-    ro_mounts = parameters.get("sandbox_read_only_mount_base", [])
-    ro_mounts += parameters.get("sandbox_read_only_mount", [])
+    ro_mounts = parameters.get("sandbox_read_only_mount_base", []) + parameters.get(
+        "sandbox_read_only_mount", []
+    )
+    for ro_mount in ro_mounts:
+        do_mount(ro_mount, args, read_only=True)
 
-    rw_mounts = parameters.get("sandbox_read_write_mount", [])
-    rw_mounts += [initial_dir]
 
-    for mount in ro_mounts:
-        do_mount(mount, args, read_only=True)
-    for mount in rw_mounts:
-        do_mount(mount, args, read_only=False)
+def enter_skeleton(root, initial_dir, args, parameters):
+    """
+    mount a new /tmp & the read-write directories in root then chroot to it
+    """
+    if args.debug:
+        print("chdir", root, file=sys.stderr)
+    os.chdir(root)
+    mount("tmpfs", "tmp", args, fstype="tmpfs")
+
+    rw_mounts = parameters.get("sandbox_read_write_mount", []) + [initial_dir]
+    for rw_mount in rw_mounts:
+        do_mount(rw_mount, args, read_only=False)
 
     if args.debug:
         print("chroot", file=sys.stderr)
@@ -81,39 +125,214 @@ def create_file_system(args, parameters):
     os.chdir(initial_dir)
 
 
-def do_mount(mount, args, read_only=False):
+def do_mount(mount_spec, args, read_only=False):
     """
     bind mount a file/or directory relative to the current directory
 
-    if mount is a string it is assumed to be a pathname to be mounted at the
+    if mount_spec is a string it is assumed to be a pathname to be mounted at the
     same position relative to the current directory
 
 
-    otherwise mount[0] should be a pathname and mount[1] a mount point
+    otherwise mount_spec[0] should be a pathname and mount_spec[1] a mount point
+
+    pathnames which do not exist are not mounted
     """
-    if isinstance(mount, str):
-        mount_point = mount.lstrip(os.sep)
+    if isinstance(mount_spec, str):
+        mount_point = mount_spec.lstrip(os.sep)
         pathname = os.sep + mount_point
     else:
-        # mount is a pair specifying a different mount-point inside sandbox
-        pathname = os.sep + mount[0].lstrip(os.sep)
-        mount_point = mount[1].lstrip(os.sep)
+        # mount_spec is a pair specifying a different mount-point inside sandbox
+        pathname = os.sep + mount_spec[0].lstrip(os.sep)
+        mount_point = mount_spec[1].lstrip(os.sep)
 
+    if not os.path.exists(pathname):
+        if args.debug:
+            print("not mounting non-existent", pathname, file=sys.stderr)
+        return
     if os.path.isdir(pathname):
         os.makedirs(mount_point, 0o755, exist_ok=True)
     else:
         # bind mount of single file requires file to exist
-        os.makedirs(os.path.dirname(mount_point), 0o755, exist_ok=True)
+        os.makedirs(os.path.dirname(mount_point) or ".", 0o755, exist_ok=True)
         with open(mount_point, "wb"):
             pass
-    mount_command = ["mount", "--bind"]
+    mount(pathname, mount_point, args, flags=MS_BIND)
     if read_only:
-        mount_command += ["-o", "ro"]
-    mount_command += [pathname, mount_point]
-    run_command(mount_command, args)
+        # a bind mount can only be made read-only by remounting it
+        mount_flags = os.statvfs(mount_point).f_flag
+        flags = MS_REMOUNT | MS_BIND | MS_RDONLY | (mount_flags & LOCKED_MOUNT_FLAGS)
+        if mount_flags & os.ST_RELATIME:
+            flags |= MS_RELATIME
+        mount("none", mount_point, args, flags=flags)
+
 
+#
+# in batch mode, rather than running unshare & creating mounts for every submission,
+# a single sandbox server is started,
+# which creates the mounts shared by all sandboxes once,
+# then forks a process for each submission which only needs to mount /tmp
+# and the submission's directory
+#
 
-def run_command(command, args):
+
+def start_sandbox_server(argv0_realpath, args, parameters):
+    """
+    start a sandbox server inside a sandbox created by sandbox_command
+    return (process, directory) where the directory contains the server's socket
+    """
+    server_directory = tempfile.mkdtemp()
+    command = parameters.get("sandbox_command", []) + [
+        argv0_realpath,
+        "--sandbox_server",
+        server_directory,
+    ]
     if args.debug:
         print(" ".join(command), file=sys.stderr)
-    subprocess.run(command, check=True)
+    # pylint: disable=consider-using-with
+    process = subprocess.Popen(
+        command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=server_directory
+    )
+    # server prints a line once it is ready for connections
+    process.stdout.readline()
+    return (process, server_directory)
+
+
+def stop_sandbox_server(process, server_directory):
+    # server exits when its stdin is closed, killing the sandbox's processes
+    process.stdin.close()
+    process.wait()
+    process.stdout.close()
+    shutil.rmtree(server_directory, ignore_errors=True)
+
+
+def run_tests_in_sandbox_server(server_directory, tests, args, parameters):
+    """
+    run tests in a sandbox forked by the sandbox server,
+    stdout, stderr and any results stream are passed to the sandbox
+    return the exit status of the tests
+    """
+    fds = [sys.stdout.fileno(), sys.stderr.fileno()]
+    if args.json_results:
+        results_stream = open_results_stream(args.json_results)
+        fds.append(results_stream.fileno())
+    with open(SANDBOX_NAME, "wb") as f:
+        pickle.dump((tests, args, parameters), f)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(os.path.join(server_directory, "socket"))
+        socket.send_fds(connection, [os.getcwd().encode()], fds)
+        reply = b""
+        while True:
+            data = connection.recv(64)
+            if not data:
+                break
+            reply += data
+    if args.json_results:
+        results_stream.close()
+    return int(reply) if reply else 2
+
+
+def serve_sandboxes(server_directory):
+    """
+    run inside a sandbox created by sandbox_command,
+    fork a sandbox for each connection to a socket in server_directory
+    exit when stdin is closed
+    """
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(os.path.join(server_directory, "socket"))
+    listener.listen()
+    # sandbox processes are not waited for
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    root = os.path.join(server_directory, "root")
+    skeleton_created = False
+    print("ready", flush=True)
+
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ)
+    selector.register(sys.stdin, selectors.EVENT_READ)
+    while True:
+        for key, _ in selector.select():
+            if key.fileobj is sys.stdin:
+                return 0
+            connection, _ = listener.accept()
+            message, fds, _, _ = socket.recv_fds(connection, 4096, 3)
+            working_directory = message.decode()
+            if not skeleton_created:
+                # parameters affecting the sandbox are the same for all submissions
+                with open(os.path.join(working_directory, SANDBOX_NAME), "rb") as f:
+                    (_, args, parameters) = pickle.load(f)
+                os.mkdir(root, 0o755)
+                os.chdir(root)
+                create_skeleton(args, parameters)
+                skeleton_created = True
+            if os.fork() == 0:
+                listener.close()
+                run_forked_sandbox(connection, fds, working_directory, root)
+            connection.close()
+            for fd in fds:
+                os.close(fd)
+
+
+def run_forked_sandbox(connection, fds, working_directory, root):
+    """
+    run tests for a submission in a process forked by serve_sandboxes,
+    send the exit status back over connection then exit
+
+    the tests are run in new mount and PID namespaces, and a new network namespace
+    if the network is sandboxed, so they can not see or signal processes
+    of other submissions
+    """
+    exit_status = 2
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        os.dup2(fds[0], 1)
+        os.dup2(fds[1], 2)
+        os.chdir(working_directory)
+        with open(SANDBOX_NAME, "rb") as f:
+            (tests, args, parameters) = pickle.load(f)
+        os.unlink(SANDBOX_NAME)
+        if args.json_results:
+            args.json_results = f"fd:{fds[2]}"
+        namespaces = CLONE_NEWNS | CLONE_NEWPID
+        if parameters.get("sandbox_network", True):
+            namespaces |= CLONE_NEWNET
+        unshare_namespaces(namespaces)
+        # only children of this process are in the new PID namespace
+        pid = os.fork()
+        if pid == 0:
+            connection.close()
+            run_sandboxed_tests(tests, args, parameters, working_directory, root)
+        _, status = os.waitpid(pid, 0)
+        exit_status = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 2
+    except Exception as e:
+        print(f"autotest: internal error in sandbox: {e}", file=sys.stderr)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        connection.sendall(str(exit_status).encode())
+        # pylint: disable=protected-access
+        os._exit(0)
+
+
+def run_sandboxed_tests(tests, args, parameters, working_directory, root):
+    """
+    run tests as process 1 of a PID namespace created by run_forked_sandbox,
+    exit with their exit status, killing any processes they leave running
+    """
+    exit_status = 2
+    try:
+        # /proc in the skeleton shows the server's PID namespace
+        mount("proc", os.path.join(root, "proc"), args, fstype="proc")
+        enter_skeleton(root, working_directory, args, parameters)
+        exit_status = run_tests(tests, parameters, args)
+        run_helper(tests, parameters, args)
+    except AutotestException as e:
+        print(f"autotest: {e}", file=sys.stderr)
+    except SystemExit as e:
+        exit_status = e.code if isinstance(e.code, int) else 2
+    except Exception as e:
+        print(f"autotest: internal error in sandbox: {e}", file=sys.stderr)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # pylint: disable=protected-access
+        os._exit(exit_status)
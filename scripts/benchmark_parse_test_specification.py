@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+
+# time parsing of synthetic test specifications with large multi-line literals
+#
+# usage: benchmark_parse_test_specification.py [n_lines ...]
+
+import os, sys, time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from parse_test_specification import parse_string
+
+
+def triple_quoted_specification(n_lines):
+    """a single test with an expected_stdout of n_lines lines in a triple-quoted string"""
+    lines = "".join(f"line {i} = [{i}] 'quoted' \"text\"\n" for i in range(n_lines))
+    return f"files=a.sh\n\n1 command=./a.sh expected_stdout='''\n{lines}'''\n"
+
+
+def list_specification(n_lines):
+    """a single test with a list of n_lines arguments, one per line"""
+    items = "".join(f"    'argument {i}]',\n" for i in range(n_lines))
+    return f"files=a.sh\n\n1 command=./a.sh arguments=[\n{items}]\n"
+
+
+def many_tests_specification(n_lines):
+    """n_lines one-line tests"""
+    tests = "".join(
+        f"test_{i} command=./a.sh {i} expected_stdout='{i}\\n'\n"
+        for i in range(n_lines)
+    )
+    return f"files=a.sh\n\n{tests}"
+
+
+SPECIFICATIONS = [
+    triple_quoted_specification,
+    list_specification,
+    many_tests_specification,
+]
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [100, 1000, 5000]
+    for make_specification in SPECIFICATIONS:
+        for n_lines in sizes:
+            specification = make_specification(n_lines)
+            start = time.perf_counter()
+            parse_string(
+                specification,
+                source_name=make_specification.__name__,
+                initial_parameters={"supplied_files_directory": "/dev/null"},
+            )
+            elapsed = time.perf_counter() - start
+            print(f"{make_specification.__name__:30} {n_lines:8} lines {elapsed:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
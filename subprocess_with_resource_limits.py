@@ -8,24 +8,223 @@
 # Recent versions of Python 3 may allow this code to be rewrritten and much simplified
 #
 
-import asyncio, locale, re, os, resource, signal, subprocess, sys, tempfile, threading
-import shutil
+import asyncio, collections, fcntl, locale, re, os, resource, signal, subprocess, sys
+import tempfile, warnings, shutil, time
+from cgroups import Cgroup
 
 
-def run(command, **parameters):
-    if sys.platform == "win32":
-        loop = asyncio.ProactorEventLoop()
-        asyncio.set_event_loop(loop)
-    else:
-        loop = asyncio.get_event_loop()
+class ExecutionRuntime:
+    """
+    event loop reused for all executions in a process
+
+    creating an event loop and a child watcher for every execution is expensive
+    when thousands of tests are run, so one runtime is created per process
+    (after a fork a new runtime is created)
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.child_watcher = None
+        if sys.platform == "win32":
+            self.loop = asyncio.ProactorEventLoop()
+        else:
+            self.loop = asyncio.new_event_loop()
+            self.child_watcher = install_child_watcher()
+        asyncio.set_event_loop(self.loop)
+
+    def run(self, command, resource_usage=None, **parameters):
+        """
+        equivalent of subprocess.run with resource limits
+        return (stdout, stderr, exit_status)
+
+        if resource_usage is a dict, it is updated with the resources used
+        by the command and any descendants it waited for
+        """
+        usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start_time = time.time()
+        execution_usage = {}
+        try:
+            result = self.loop.run_until_complete(
+                self.run_async(command, resource_usage=execution_usage, **parameters)
+            )
+        except KeyboardInterrupt:
+            sys.exit(1)
+        if resource_usage is not None:
+            if not execution_usage:
+                # the child could not be reaped with wait4, e.g. no pidfd support
+                execution_usage = resource_usage_difference(
+                    usage_before, resource.getrusage(resource.RUSAGE_CHILDREN)
+                )
+            resource_usage["real_seconds"] = round(time.time() - start_time, 6)
+            resource_usage.update(execution_usage)
+        return result
+
+    async def run_async(
+        self, command, cgroup_directory="", resource_usage=None, **parameters
+    ):
+        """
+        if resource_usage is a dict, it is updated with the resources used
+        by the command, measured by the cgroup if cgroup_directory is set,
+        otherwise when the child is reaped
+        if cgroup_directory is set, command is run in a new cgroup below it,
+        if possible
+        """
+        cgroup = None
+        try:
+            if cgroup_directory:
+                try:
+                    cgroup = Cgroup(
+                        cgroup_directory,
+                        max_memory_bytes=parameters.get("max_rss_bytes", 0),
+                        max_pids=parameters.get("max_processes", 0),
+                        max_cpus=parameters.get("max_cpus", 0),
+                    )
+                except OSError as e:
+                    # limits set with setrlimit still apply
+                    if parameters.get("debug", 0):
+                        print(f"cgroup not used: {e}", file=sys.stderr)
+            return await run_coroutine(
+                self.loop,
+                command,
+                cgroup=cgroup,
+                child_watcher=self.child_watcher,
+                resource_usage=resource_usage,
+                **parameters,
+            )
+        except OSError as e:
+            return (b"", re.sub(r"^\[.*?\] *", "", str(e)).encode("UTF-8"), 2)
+        finally:
+            if cgroup:
+                # a cgroup measures all descendants and their peak memory use exactly
+                if resource_usage is not None:
+                    resource_usage.update(cgroup.resource_usage())
+                cgroup.remove()
+
+    def close(self):
+        self.loop.close()
+
+
+def child_resource_usage(usage):
+    """
+    return a dict of the resources in a rusage from wait4 for one child,
+    max_rss_bytes includes memory the child shared with autotest before exec
+    """
+    return {
+        "user_cpu_seconds": round(usage.ru_utime, 6),
+        "system_cpu_seconds": round(usage.ru_stime, 6),
+        "max_rss_bytes": usage.ru_maxrss * 1024,
+        "voluntary_context_switches": usage.ru_nvcsw,
+        "involuntary_context_switches": usage.ru_nivcsw,
+    }
+
+
+def resource_usage_difference(before, after):
+    """
+    return a dict of the resources used between two getrusage(RUSAGE_CHILDREN) calls,
+    only used if children can not be reaped with wait4
+
+    the kernel only records the largest resident set size of any child,
+    so max_rss_bytes is None unless it exceeds that of all previous children
+    """
+    return {
+        "user_cpu_seconds": round(after.ru_utime - before.ru_utime, 6),
+        "system_cpu_seconds": round(after.ru_stime - before.ru_stime, 6),
+        "max_rss_bytes": (
+            after.ru_maxrss * 1024 if after.ru_maxrss > before.ru_maxrss else None
+        ),
+        "voluntary_context_switches": after.ru_nvcsw - before.ru_nvcsw,
+        "involuntary_context_switches": after.ru_nivcsw - before.ru_nivcsw,
+    }
+
+
+# child watchers are deprecated in Python 3.12 & removed in 3.14
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+
+    class ResourceUsageChildWatcher(getattr(asyncio, "AbstractChildWatcher", object)):
+        """
+        child watcher which waits for children with a pidfd from the event loop
+        and reaps them with wait4, recording the resources used by each child
+        and the descendants it waited for, indexed by pid
+        """
+
+        def __init__(self):
+            self.resource_usage = {}
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def is_active(self):
+            return True
+
+        def close(self):
+            pass
+
+        def attach_loop(self, loop):
+            pass
+
+        def add_child_handler(self, pid, callback, *args):
+            loop = asyncio.get_running_loop()
+            pidfd = os.pidfd_open(pid)
+            loop.add_reader(pidfd, self.reap_child, loop, pid, pidfd, callback, args)
+
+        def remove_child_handler(self, pid):
+            return False
+
+        def reap_child(self, loop, pid, pidfd, callback, args):
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+            try:
+                _, status, usage = os.wait4(pid, 0)
+            except ChildProcessError:
+                # already reaped elsewhere, as asyncio's own watchers report this
+                returncode = 255
+            else:
+                self.resource_usage[pid] = child_resource_usage(usage)
+                returncode = os.waitstatus_to_exitcode(status)
+            callback(pid, returncode, *args)
+
+
+def install_child_watcher():
+    """
+    by default Python 3.8-3.11 start a thread to wait for every child process,
+    install a watcher which waits for children from the event loop with a pidfd
+    and records the resources each used
+    return the watcher or None if this is not possible
+    """
+    if not hasattr(asyncio, "set_child_watcher"):
+        return None
     try:
-        cooroutine = run_coroutine(loop, command, **parameters)
-        output = loop.run_until_complete(cooroutine)
-    except KeyboardInterrupt:
-        sys.exit(1)
-    except OSError as e:
-        return (b"", re.sub(r"^\[.*?\] *", "", str(e)).encode("UTF-8"), 2)
-    return output
+        os.close(os.pidfd_open(os.getpid()))
+    except (AttributeError, OSError):
+        return None
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        watcher = asyncio.get_child_watcher()
+        if not isinstance(watcher, ResourceUsageChildWatcher):
+            watcher = ResourceUsageChildWatcher()
+            asyncio.set_child_watcher(watcher)
+    return watcher
+
+
+_runtime = None
+
+
+def get_runtime():
+    """
+    return the ExecutionRuntime for this process
+    """
+    global _runtime
+    if _runtime is None or _runtime.pid != os.getpid():
+        _runtime = ExecutionRuntime()
+    return _runtime
+
+
+def run(command, **parameters):
+    return get_runtime().run(command, **parameters)
 
 
 async def run_coroutine(
@@ -45,9 +244,15 @@ async def run_coroutine(
     max_stderr_bytes=10000,
     debug=0,
     nice=0,
+    stdout_comparator=None,
+    cgroup=None,
+    environment=None,
+    child_watcher=None,
+    resource_usage=None,
     **parameters,
 ):
     exit_future = asyncio.Future(loop=loop)
+    process_exited_future = asyncio.Future(loop=loop)
 
     def set_rlimit(which, limit):
         try:
@@ -86,6 +291,14 @@ async def run_coroutine(
         if nice != 0:
             os.nice(nice)
 
+        if cgroup:
+            try:
+                cgroup.add_current_process()
+            except OSError:
+                # an exception here would stop the program being run,
+                # limits set with setrlimit still apply
+                pass
+
     # Create the subprocess
     # FIXME: There should be a parameter to control what shell to use
     command = (
@@ -98,57 +311,70 @@ async def run_coroutine(
         else command
     )
 
-    # subtle issue with providing string as input so just write it to a temporary file
+    # subtle issue with providing string as input so supply it from a file
     if stdin:
-        # pylint: disable=consider-using-with
-        stdin_stream = tempfile.TemporaryFile()
-        if parameters["unicode_stdin"]:
-            stdin_stream.write(stdin.encode(locale.getpreferredencoding(False)))
-        else:
-            stdin_stream.write(stdin)
-        stdin_stream.seek(0)
+        stdin_stream = open_stdin_file(stdin, parameters["unicode_stdin"])
     else:
         stdin_stream = subprocess.DEVNULL
     process = loop.subprocess_exec(
-        lambda: SubprocessProtocol(exit_future, max_stdout_bytes, max_stderr_bytes),
+        lambda: SubprocessProtocol(
+            exit_future,
+            max_stdout_bytes,
+            max_stderr_bytes,
+            stdout_comparator=stdout_comparator,
+            process_exited_future=process_exited_future,
+        ),
         *command,
         preexec_fn=set_limits,
         stdin=stdin_stream,
+        env=environment,
     )
 
     transport, protocol = await process
     errors = []
     if max_real_seconds:
 
-        def wall_clock_alarm(errors):
+        def wall_clock_alarm():
             errors.append(
                 f"Error: real time limit of {max_real_seconds} seconds exceeded\n".encode(
                     "utf-8"
                 )
             )
+            if cgroup:
+                cgroup.kill()
             transport.kill()
             transport.close()
             if debug > 1:
                 print("wall clock alarm", file=sys.stderr)
 
-        timer = threading.Timer(
-            max_real_seconds, lambda errors=errors: wall_clock_alarm(errors)
-        )
+        timer = loop.call_later(max_real_seconds, wall_clock_alarm)
         if debug > 1:
             print(
                 "wall clock timer set for", max_real_seconds, "seconds", file=sys.stderr
             )
-        timer.start()
     # Wait for the subprocess exit using the process_exited() method
     # of the protocol
     await exit_future
     if max_real_seconds:
         timer.cancel()
+    exit_status = transport.get_returncode()
     transport.close()
+    if exit_status is None:
+        if cgroup:
+            cgroup.kill()
+        # a process stopped early is killed by close,
+        # wait for it to be reaped so its resource usage is counted for this execution
+        try:
+            await asyncio.wait_for(process_exited_future, 1)
+        except asyncio.TimeoutError:
+            pass
     if stdin:
         stdin_stream.close()
+    if child_watcher and resource_usage is not None:
+        usage = child_watcher.resource_usage.pop(transport.get_pid(), None)
+        if usage:
+            resource_usage.update(usage)
     (stdout, stderr) = protocol.process_streams[1:3]
-    exit_status = transport.get_returncode()
     if errors:
         stderr += b"".join(errors)
     elif exit_status == -signal.SIGXCPU:
@@ -159,16 +385,90 @@ async def run_coroutine(
         stderr += f"Error: maximum file creation size of {max_file_size_bytes} bytes exceeded\n".encode(
             "utf-8"
         )
-    if debug > 2:
-        print(
-            "run_corotine", stdout, stderr, transport.get_returncode(), file=sys.stderr
+    elif cgroup and cgroup.memory_limit_exceeded():
+        stderr += f"Error: memory limit of {max_rss_bytes} bytes exceeded\n".encode(
+            "utf-8"
+        )
+    elif cgroup and cgroup.process_limit_exceeded():
+        stderr += f"Error: limit of {max_processes} processes exceeded\n".encode(
+            "utf-8"
         )
-    return (stdout, stderr, transport.get_returncode())
+    if debug > 2:
+        print("run_corotine", stdout, stderr, exit_status, file=sys.stderr)
+    return (stdout, stderr, exit_status)
+
+
+# number of stdin contents kept in memory files, each uses a file descriptor
+MAX_STDIN_FILES = 64
+
+
+def open_stdin_file(
+    stdin,
+    unicode_stdin,
+    # pylint: disable=dangerous-default-value
+    cache=collections.OrderedDict(),
+):
+    """
+    return a file positioned at the start of stdin, encoded if unicode_stdin is set
+
+    stdin is encoded once and stored in a sealed memfd,
+    which is reopened for each execution so each has its own file offset,
+    if this is not possible stdin is written to a temporary file
+    """
+    key = (stdin, unicode_stdin)
+    try:
+        if key not in cache:
+            cache[key] = create_sealed_memfd(encode_stdin(stdin, unicode_stdin))
+            if len(cache) > MAX_STDIN_FILES:
+                os.close(cache.popitem(last=False)[1])
+        cache.move_to_end(key)
+        # pylint: disable=consider-using-with
+        return open(f"/proc/self/fd/{cache[key]}", "rb")
+    except (AttributeError, OSError):
+        pass
+    # pylint: disable=consider-using-with
+    stdin_stream = tempfile.TemporaryFile()
+    stdin_stream.write(encode_stdin(stdin, unicode_stdin))
+    stdin_stream.seek(0)
+    return stdin_stream
+
+
+def encode_stdin(stdin, unicode_stdin):
+    return stdin.encode(locale.getpreferredencoding(False)) if unicode_stdin else stdin
+
+
+def create_sealed_memfd(data):
+    """
+    return a file descriptor for a memory file containing data which can not be changed
+    """
+    fd = os.memfd_create("stdin", os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+    try:
+        with open(fd, "wb", closefd=False) as f:
+            f.write(data)
+        seals = fcntl.F_SEAL_SHRINK | fcntl.F_SEAL_GROW | fcntl.F_SEAL_WRITE
+        fcntl.fcntl(fd, fcntl.F_ADD_SEALS, seals)
+    except OSError:
+        os.close(fd)
+        raise
+    return fd
 
 
 class SubprocessProtocol(asyncio.SubprocessProtocol):
-    def __init__(self, exit_future, max_stdout_bytes, max_stderr_bytes, debug=0):
+    def __init__(
+        self,
+        exit_future,
+        max_stdout_bytes,
+        max_stderr_bytes,
+        stdout_comparator=None,
+        process_exited_future=None,
+        debug=0,
+    ):
         self.exit_future = exit_future
+        # if set, this is completed when the process has exited & been reaped
+        self.process_exited_future = process_exited_future
+        # if set, stdout is passed to this as it is received and
+        # the process is stopped if it returns False
+        self.stdout_comparator = stdout_comparator
         self.output = bytearray()
         self.process_streams = (None, bytearray(), bytearray())
         self.max_stream_bytes = (None, max_stdout_bytes, max_stderr_bytes)
@@ -181,6 +481,13 @@ class SubprocessProtocol(asyncio.SubprocessProtocol):
         n_bytes = len(data)
         max_bytes = max(0, self.max_stream_bytes[fd] - len(self.process_streams[fd]))
         self.process_streams[fd].extend(data[0:max_bytes])
+        if fd == 1 and self.stdout_comparator and not self.finished[1]:
+            if not self.stdout_comparator.feed(data[0:max_bytes]):
+                self.finished = [True, True, True]
+                if self.debug > 1:
+                    print("stdout incorrect", file=sys.stderr)
+                self.terminate()
+                return
         if n_bytes > max_bytes:
             if fd == 1 and not self.finished[1]:
                 self.process_streams[2].extend(
@@ -203,6 +510,8 @@ class SubprocessProtocol(asyncio.SubprocessProtocol):
         if self.debug > 1:
             print("process_exited", file=sys.stderr)
         self.finished[0] = True
+        if self.process_exited_future and not self.process_exited_future.done():
+            self.process_exited_future.set_result(True)
         self.check_everything_finished()
 
     def check_everything_finished(self):
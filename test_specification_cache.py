@@ -0,0 +1,231 @@
+# cache of parsed & normalized test specifications
+#
+# if the parameter cache_test_specification is set
+# the tests and parameters produced by parse_file are saved in a file next to the test specification
+#
+# the cache is shared by everyone running autotest with the test specification,
+# so it contains nothing which depends on the environment autotest is run in:
+# parameters such as environment are removed before the cache is saved
+# and calculated again when it is loaded,
+# global parameters are saved before normalization and normalized when loaded
+#
+# the cache is used only if nothing which could change the result of parsing has changed:
+# the test specification, files it refers to, the autotest source,
+# command-line parameters and the results of searching PATH for commands
+#
+# loading a pickle can run arbitrary code, so the cache is only loaded
+# if it is owned by the user or the owner of the test specification
+# and can not be written by other users
+
+import hashlib, os, pickle, sys, tempfile
+import parameter_descriptions, parse_test_specification
+from parameter_descriptions import (
+    normalize_parameters,
+    remove_environment_parameters,
+    renormalize_environment_parameters,
+    search_path,
+)
+from parse_test_specification import parse_file, TestParameters
+
+CACHE_FORMAT_VERSION = 2
+CACHE_SUFFIX = ".autotest_cache"
+
+
+def parse_file_cached(
+    pathname,
+    initial_parameters=None,
+    initial_tests=None,
+    debug=0,
+):
+    """
+    equivalent of parse_file, using a cached result if it is valid
+    """
+    if initial_parameters is None:
+        initial_parameters = {}
+    if "supplied_files_directory" not in initial_parameters:
+        initial_parameters["supplied_files_directory"] = (
+            os.path.dirname(pathname) or "."
+        )
+    if initial_tests:
+        # tests from the command line have already been normalized in this environment
+        return parse_file(
+            pathname,
+            initial_parameters=initial_parameters,
+            initial_tests=initial_tests,
+            debug=debug,
+        )
+    cache_pathname = get_cache_pathname(pathname)
+    try:
+        key = get_cache_key(pathname, initial_parameters)
+    except OSError:
+        key = None
+    if key:
+        cached = load_cache(cache_pathname, pathname, key, debug=debug)
+        if cached:
+            return cached
+
+    parameter_descriptions.files_read.clear()
+    parameter_descriptions.executables_searched.clear()
+    tests, parameters = parse_file(
+        pathname,
+        initial_parameters=initial_parameters,
+        normalize_global_parameters=False,
+        debug=debug,
+    )
+    unnormalized_parameters = dict(parameters)
+    normalize_parameters(parameters, check_required_parameters_set=False)
+    if (
+        key
+        and parameters.get("cache_test_specification", False)
+        and all(isinstance(t, TestParameters) for t in tests.values())
+    ):
+        save_cache(
+            cache_pathname, pathname, key, tests, unnormalized_parameters, debug=debug
+        )
+    return tests, parameters
+
+
+def get_cache_pathname(pathname):
+    directory, basename = os.path.split(pathname)
+    return os.path.join(directory, "." + basename + CACHE_SUFFIX)
+
+
+def is_cache_file(name):
+    """
+    return True if name is a cache file, or a temporary file used to create one
+    """
+    return name.startswith(".") and CACHE_SUFFIX in name
+
+
+def get_cache_key(pathname, initial_parameters):
+    """
+    return a hash of everything known before parsing which may affect the result,
+    except the environment
+    """
+    h = hashlib.sha256()
+    h.update(f"{CACHE_FORMAT_VERSION} {sys.version}".encode())
+    for module in [parameter_descriptions, parse_test_specification]:
+        with open(module.__file__, "rb") as f:
+            h.update(f.read())
+    with open(pathname, "rb") as f:
+        h.update(f.read())
+    h.update(repr(initial_parameters).encode())
+    return h.hexdigest()
+
+
+def get_dependencies(tests, parameters, files_read):
+    """
+    return the files the parsed test specification depends on,
+    with their modification times and sizes
+
+    directories of supplied files are included as
+    the existence of files such as test_label.stdin changes parameter values
+    """
+    directories = set(
+        p["supplied_files_directory"]
+        for p in [parameters] + list(tests.values())
+        if p.get("supplied_files_directory", "")
+    )
+    dependencies = {}
+    for directory in sorted(directories):
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if not is_cache_file(entry.name):
+                        s = entry.stat()
+                        dependencies[entry.path] = (s.st_mtime_ns, s.st_size)
+        except OSError:
+            dependencies[directory] = None
+    for pathname in files_read:
+        try:
+            s = os.stat(pathname)
+            dependencies[pathname] = (s.st_mtime_ns, s.st_size)
+        except OSError:
+            dependencies[pathname] = None
+    return dependencies
+
+
+def load_cache(cache_pathname, pathname, key, debug=0):
+    """
+    return cached (tests, parameters) for the test specification in pathname
+    or None if no valid cache exists
+    """
+    try:
+        with open(cache_pathname, "rb") as f:
+            check_cache_trusted(f, pathname)
+            cache = pickle.load(f)
+        if cache["version"] != CACHE_FORMAT_VERSION or cache["key"] != key:
+            return None
+        tests, parameters = cache["tests"], cache["parameters"]
+        dependencies = get_dependencies(tests, parameters, cache["files_read"])
+        if dependencies != cache["dependencies"] or any(
+            search_path(e) != p for (e, p) in cache["executables_searched"].items()
+        ):
+            if debug:
+                print(f"{cache_pathname} out of date", file=sys.stderr)
+            return None
+        for test in tests.values():
+            renormalize_environment_parameters(test)
+        normalize_parameters(parameters, check_required_parameters_set=False)
+    # pylint: disable=broad-except
+    except Exception as e:
+        # any problem with the cache file just means it can not be used
+        if debug > 1:
+            print(f"{cache_pathname} not used: {e}", file=sys.stderr)
+        return None
+    if debug:
+        print(f"using cached test specification {cache_pathname}", file=sys.stderr)
+    return tests, parameters
+
+
+def check_cache_trusted(f, pathname):
+    """
+    raise ValueError unless the open cache file f is owned by this user
+    or the owner of the test specification pathname,
+    and is not writable by other users
+    """
+    s = os.fstat(f.fileno())
+    if s.st_uid not in (os.getuid(), os.stat(pathname).st_uid):
+        raise ValueError("owned by another user")
+    if s.st_mode & 0o022:
+        raise ValueError("writable by other users")
+
+
+def save_cache(cache_pathname, pathname, key, tests, parameters, debug=0):
+    """
+    save tests, with values depending on the environment removed,
+    and unnormalized global parameters in cache_pathname,
+    failure is ignored as the specification directory may not be writable
+    """
+    files_read = sorted(parameter_descriptions.files_read)
+    cached_tests = {}
+    for label, test in tests.items():
+        cached_tests[label] = TestParameters(dict(test.maps[0]), *test.maps[1:])
+        remove_environment_parameters(cached_tests[label])
+    cache = {
+        "version": CACHE_FORMAT_VERSION,
+        "key": key,
+        "files_read": files_read,
+        "executables_searched": dict(parameter_descriptions.executables_searched),
+        "dependencies": get_dependencies(tests, parameters, files_read),
+        "tests": cached_tests,
+        "parameters": parameters,
+    }
+    directory, basename = os.path.split(cache_pathname)
+    try:
+        fd, temp_pathname = tempfile.mkstemp(dir=directory or ".", prefix=basename)
+    except OSError as e:
+        if debug:
+            print(f"can not save {cache_pathname}: {e}", file=sys.stderr)
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # readable by those who can read the test specification
+            os.fchmod(f.fileno(), os.stat(pathname).st_mode & 0o644)
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # rename is atomic so simultaneous autotests never see a partial cache file
+        os.rename(temp_pathname, cache_pathname)
+    except (OSError, pickle.PicklingError) as e:
+        if debug:
+            print(f"can not save {cache_pathname}: {e}", file=sys.stderr)
+        os.unlink(temp_pathname)
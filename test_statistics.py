@@ -0,0 +1,89 @@
+# statistics of previous test runs, used to choose the order tests are run in
+#
+# for each test the number of runs, the number of failures
+# and an average of the seconds taken are kept in a small JSON file
+# concurrent autotests may lose each other's updates, which is harmless
+
+import json, os, sys, tempfile
+
+# weight of the latest run in the average of a test's duration
+SECONDS_WEIGHT = 0.5
+
+ORDERS = ["spec", "fastest_first", "most_likely_to_fail"]
+
+
+def load_statistics(pathname, debug=0):
+    """
+    return statistics from pathname, empty if it does not exist or is invalid
+    """
+    try:
+        with open(pathname, encoding="utf-8") as f:
+            statistics = json.load(f)
+        if isinstance(statistics, dict):
+            return statistics
+    except (OSError, ValueError) as e:
+        if debug > 1:
+            print(f"test statistics not loaded from {pathname}: {e}", file=sys.stderr)
+    return {}
+
+
+def save_statistics(pathname, statistics, debug=0):
+    """
+    write statistics to pathname, failures are ignored
+    """
+    try:
+        directory = os.path.dirname(pathname) or "."
+        os.makedirs(directory, 0o700, exist_ok=True)
+        fd, temp_pathname = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    except OSError as e:
+        if debug:
+            print(f"test statistics not saved to {pathname}: {e}", file=sys.stderr)
+        return
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(statistics, f)
+        os.rename(temp_pathname, pathname)
+    except OSError as e:
+        if debug:
+            print(f"test statistics not saved to {pathname}: {e}", file=sys.stderr)
+        os.unlink(temp_pathname)
+
+
+def record_result(statistics, key, failed, seconds=None):
+    """
+    add a run of the test identified by key to statistics,
+    seconds is None if the test could not be run
+    """
+    entry = statistics.setdefault(key, {"runs": 0, "failures": 0, "seconds": None})
+    entry["runs"] += 1
+    entry["failures"] += int(failed)
+    if seconds is not None:
+        if entry["seconds"] is None:
+            entry["seconds"] = seconds
+        else:
+            entry["seconds"] += SECONDS_WEIGHT * (seconds - entry["seconds"])
+
+
+def failure_rate(statistics, key):
+    """
+    return estimated probability of the test identified by key failing,
+    0.5 for a test with no statistics
+    """
+    entry = statistics.get(key, {})
+    return (entry.get("failures", 0) + 1) / (entry.get("runs", 0) + 2)
+
+
+def order_tests(tests, order, statistics, key_function):
+    """
+    return tests sorted according to order using statistics,
+    tests with equal statistics keep their order
+    """
+    if order == "fastest_first":
+        # tests with no statistics are run first so their duration is learnt
+        return sorted(
+            tests,
+            key=lambda t: statistics.get(key_function(t), {}).get("seconds") or 0,
+        )
+    if order == "most_likely_to_fail":
+        return sorted(tests, key=lambda t: -failure_rate(statistics, key_function(t)))
+    return list(tests)
@@ -0,0 +1,4 @@
+#!/bin/sh
+echo "$1"
+test "$1" = forever && while true; do :; done
+exit 0
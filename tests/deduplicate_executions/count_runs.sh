@@ -0,0 +1,4 @@
+#!/bin/sh
+# prints how many times it has been run
+echo run >>runs.txt
+echo "run $(wc -l <runs.txt)"
@@ -0,0 +1,2 @@
+#include "words.h"
+#define GREETING HELLO " " WORLD
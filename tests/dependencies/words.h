@@ -0,0 +1,2 @@
+#define HELLO "hello"
+#define WORLD "world"
@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+
+# postprocess_output_command co-process which removes 'z' characters
+
+import sys
+
+while True:
+    header = sys.stdin.buffer.readline()
+    if not header:
+        break
+    record = sys.stdin.buffer.read(int(header)).replace(b"z", b"")
+    sys.stdout.buffer.write(b"%d\n" % len(record) + record)
+    sys.stdout.buffer.flush()
@@ -0,0 +1,5 @@
+#!/bin/sh
+# creates a file which must not be visible to later tests
+test -e created.txt && echo created.txt already exists
+echo "$1" >created.txt
+echo done
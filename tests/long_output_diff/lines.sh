@@ -0,0 +1,2 @@
+#!/bin/sh
+seq 1 1000 | sed -e '10d' -e '900s/$/ changed/'
@@ -0,0 +1,7 @@
+#!/bin/bash
+i=0
+while test $i -lt "$1"
+do
+    i=$((i + 1))
+done
+echo $i
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+
+# postprocess_output_command co-process which replaces 'z' characters with $REPLACEMENT
+
+import os, sys
+
+replacement = os.environ.get("REPLACEMENT", "").encode()
+while True:
+    header = sys.stdin.buffer.readline()
+    if not header:
+        break
+    record = sys.stdin.buffer.read(int(header)).replace(b"z", replacement)
+    sys.stdout.buffer.write(b"%d\n" % len(record) + record)
+    sys.stdout.buffer.flush()
@@ -0,0 +1,7 @@
+#include <stdio.h>
+
+int main(int argc, char *argv[]) {
+    int unused;
+    printf("hello %d\n", argc);
+    return 0;
+}
@@ -0,0 +1,2 @@
+with open("names.txt", encoding="utf-8") as f:
+    print("hello", f.read().strip())
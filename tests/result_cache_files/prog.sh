@@ -0,0 +1,3 @@
+#!/bin/sh
+# writes a file read by a later test
+echo hi >out
@@ -0,0 +1,3 @@
+#!/bin/sh
+# print how many processes running the sandbox server are visible
+grep -l -a -s -e '--sandbox_serve[r]' /proc/[0-9]*/cmdline | wc -l
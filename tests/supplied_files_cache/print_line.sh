@@ -0,0 +1,3 @@
+#!/bin/sh
+# prints a line from a supplied data file
+sed -n "$1p" data.txt
@@ -0,0 +1,4 @@
+#!/bin/sh
+# prints ok unless its argument is bad
+[ "$1" = bad ] && echo wrong && exit
+echo ok
@@ -5,7 +5,7 @@ import io, os, platform, sys, zipfile
 
 def upload_results_http(tests, parameters, args):
     upload_url = parameters["upload_url"]
-    upload_fields = parameters["upload_fields"]
+    upload_fields = dict(parameters["upload_fields"])
     upload_fields["exercise"] = args.exercise
     upload_fields["hostname"] = platform.node()
     upload_fields["login"] = getlogin()